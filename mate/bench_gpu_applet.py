@@ -0,0 +1,445 @@
+#!/usr/bin/python3
+"""Headless benchmark of the GPU applet charts and sampling
+
+Draws the chart window and the panel charts onto cairo image surfaces
+for several sizes, history lengths and GPU counts, samples fake
+nvidia-smi, radeontop and intel_gpu_top executables, polls stand-in
+remote agents on loopback and imports the applet in a fresh
+interpreter, all without a running panel.
+Reports latency percentiles per call and the peak memory allocated per
+call (tracemalloc).
+
+To compare a change against the current code:
+
+    python3 bench_gpu_applet.py --save before.json
+    # ... change the code ...
+    python3 bench_gpu_applet.py --compare before.json
+"""
+
+import argparse                                        # noqa
+import json                                            # noqa
+import os                                              # noqa
+import socket                                          # noqa
+import subprocess                                      # noqa
+import sys                                             # noqa
+import tempfile                                        # noqa
+import threading                                       # noqa
+import time                                            # noqa
+import tracemalloc                                     # noqa
+
+import cairo                                           # noqa
+
+import mate_gpu_applet                                 # noqa
+from mate_gpu_applet import GLib, GPUApplet            # noqa
+
+FAKE_NVIDIA_SMI = '''#!{python}
+import sys, time
+gpus = {gpus}
+args = sys.argv[1:]
+fields = next(arg for arg in args
+              if arg.startswith('--query-gpu=')).split('=', 1)[1]
+values = {{'memory.total': '8192', 'memory.used': '2048'}}
+
+
+def emit(tick):
+    for index in range(gpus):
+        row = [str(index) if field == 'index'
+               else values.get(field, str((tick * 7 + index * 13) % 100))
+               for field in fields.split(',')]
+        print(', '.join(row))
+    sys.stdout.flush()
+
+
+if '-lms' in args:
+    interval = int(args[args.index('-lms') + 1]) / 1000
+    tick = 0
+    while True:
+        emit(tick)
+        tick += 1
+        time.sleep(interval)
+else:
+    emit(0)
+'''
+
+FAKE_RADEONTOP = '''#!{python}
+import sys, time
+args = sys.argv[1:]
+limit = int(args[args.index('-l') + 1]) if '-l' in args else None
+interval = float(args[args.index('-i') + 1]) if '-i' in args else 1
+tick = 0
+while limit is None or tick < limit:
+    print(f"{{time.time():.6f}}: bus 03, gpu {{tick % 100}}.00%, "
+          f"ee 0.00%, vram 20.00% 800.00mb, gtt 1.00% 40.00mb, "
+          f"mclk 50.00% 0.500ghz, sclk 40.00% 0.800ghz", flush=True)
+    tick += 1
+    if limit is None or tick < limit:
+        time.sleep(interval)
+'''
+
+FAKE_INTEL_GPU_TOP = '''#!{python}
+import json, sys, time
+args = sys.argv[1:]
+interval = int(args[args.index('-s') + 1]) / 1000
+print('[')
+tick = 0
+while True:
+    report = {{
+        'period': {{'duration': interval * 1000, 'unit': 'ms'}},
+        'frequency': {{'requested': 1200.0, 'actual': 1100.0 + tick % 100,
+                      'unit': 'MHz'}},
+        'power': {{'GPU': 4.5, 'Package': 12.0, 'unit': 'W'}},
+        'engines': {{
+            'Render/3D': {{'busy': float(tick % 100), 'sema': 0.0,
+                          'wait': 0.0, 'unit': '%'}},
+            'Blitter': {{'busy': 0.0, 'sema': 0.0, 'wait': 0.0,
+                        'unit': '%'}},
+            'Video': {{'busy': 12.5, 'sema': 0.0, 'wait': 0.0, 'unit': '%'}},
+            'VideoEnhance': {{'busy': 0.0, 'sema': 0.0, 'wait': 0.0,
+                             'unit': '%'}},
+        }},
+    }}
+    # Pretty printed and comma separated, like intel_gpu_top
+    print((',' if tick else '') + json.dumps(report, indent='\\t'),
+          flush=True)
+    tick += 1
+    time.sleep(interval)
+'''
+
+
+class FakeAllocation:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+
+class FakeWidget:
+    """Stands in for a Gtk.DrawingArea in the draw handlers"""
+
+    def __init__(self, width, height):
+        self.allocation = FakeAllocation(width, height)
+
+    def get_allocation(self):
+        return self.allocation
+
+
+def make_applet(gpus, rows, **preferences):
+    """Create a GPUApplet without widgets, with a filled history"""
+    applet = GPUApplet.__new__(GPUApplet)
+    applet.config_file = os.path.join(tempfile.gettempdir(),
+                                      'bench-gpu-applet-missing.json')
+    applet.init_preferences()
+    applet.preferences.update(preferences)
+    applet.init_history()
+    applet.chart_renderers = {}
+    applet.throttle = mate_gpu_applet.ThrottleDetector()
+    applet.remote = None
+    applet.local_host = 'localhost'
+
+    devices = [str(index) for index in range(gpus)]
+    for device_id in devices:
+        applet.history[device_id] = applet.new_series(device_id)
+    applet.device_ids = devices
+
+    # Fill every tier directly, feeding samples through the tiers would
+    # take 24 hours worth of appends
+    now = time.time()
+    for key, series in applet.history.items():
+        for tier in series.tiers.values():
+            count = min(rows, tier.capacity)
+            for i in range(count):
+                value = (i * 7 + len(key) * 13) % 100
+                row = {column: value for column in tier.columns}
+                row['time'] = now - (count - i) * 2
+                tier.append(row)
+    for i in range(min(rows, applet.timestamps.capacity)):
+        applet.timestamps.append({'time': now - i})
+    return applet
+
+
+def sample_devices(gpus, tick):
+    """Return a synthetic sample for gpus devices"""
+    return [{'id': str(index), 'usage': float((tick + index * 11) % 100),
+             'temp': 40.0 + index, 'memory': 30}
+            for index in range(gpus)]
+
+
+def measure(name, func, iterations, results):
+    """Time func, then measure its allocations in a separate pass"""
+    func()  # Warm up caches and surfaces
+
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+
+    peaks = []
+    tracemalloc.start()
+    for _ in range(min(iterations, 20)):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    def percentile(fraction):
+        return times[min(len(times) - 1, int(len(times) * fraction))] * 1000
+
+    results[name] = {
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'peak_kib': sum(peaks) / len(peaks) / 1024,
+        'calls': iterations,
+    }
+    print(f"{name:44} {results[name]['p50_ms']:9.3f} "
+          f"{results[name]['p95_ms']:9.3f} {results[name]['p99_ms']:9.3f} "
+          f"{results[name]['peak_kib']:9.1f}")
+
+
+def bench_window(args, results):
+    """Chart window at several sizes, time ranges and GPU counts"""
+    for gpus in args.gpus:
+        for tier in mate_gpu_applet.TIME_RANGES:
+            applet = make_applet(gpus, args.rows,
+                                 chart_time_range=tier)
+            for width, height in ((600, 400), (1200, 800)):
+                surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                             width, height)
+                widget = FakeWidget(width, height)
+
+                def draw():
+                    applet.on_chart_draw(widget, cairo.Context(surface))
+
+                measure(f"window/{gpus}gpu/{tier}/{width}x{height}", draw,
+                        args.iterations, results)
+
+
+def bench_panel(args, results):
+    """Panel charts, per tick and with full redraws"""
+    # A session recording makes the ticks repeatable between runs
+    recorded = []
+    if args.replay:
+        recorded = [devices for timestamp, devices
+                    in mate_gpu_applet.SessionRecorder.read(args.replay)]
+    for gpus in args.gpus:
+        applet = make_applet(gpus, args.rows)
+        for width in (30, 50, 100):
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, 24)
+            widget = FakeWidget(width, 24)
+            ticks = [0]
+
+            def tick():
+                ticks[0] += 1
+                if recorded:
+                    devices = recorded[ticks[0] % len(recorded)]
+                else:
+                    devices = sample_devices(gpus, ticks[0])
+                applet.store_sample(devices, time.time())
+                applet.draw_individual_chart(widget, cairo.Context(surface),
+                                             'gpu', '0')
+
+            def full():
+                for renderer in applet.chart_renderers.values():
+                    renderer.invalidate()
+                applet.draw_individual_chart(widget, cairo.Context(surface),
+                                             'gpu', '0')
+
+            measure(f"panel/{gpus}gpu/{width}px/tick", tick,
+                    args.iterations, results)
+            measure(f"panel/{gpus}gpu/{width}px/full", full,
+                    args.iterations, results)
+
+
+def bench_sampler(args, results):
+    """get_gpu_data against fake nvidia-smi, radeontop and intel_gpu_top"""
+    backends = (('nvidia-smi', FAKE_NVIDIA_SMI,
+                 mate_gpu_applet.NvidiaSmiBackend),
+                ('radeontop', FAKE_RADEONTOP,
+                 mate_gpu_applet.RadeontopBackend),
+                ('intel_gpu_top', FAKE_INTEL_GPU_TOP,
+                 mate_gpu_applet.IntelGpuTopBackend))
+    interval_ms = 100
+    context = GLib.MainContext.default()
+
+    with tempfile.TemporaryDirectory() as bin_dir:
+        old_path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + old_path
+        try:
+            for gpus in args.gpus:
+                for name, script, cls in backends:
+                    path = os.path.join(bin_dir, name)
+                    with open(path, 'w') as f:
+                        f.write(script.format(python=sys.executable,
+                                              gpus=gpus))
+                    os.chmod(path, 0o755)
+
+                    applet = make_applet(gpus, 0)
+                    applet.backends = mate_gpu_applet.BackendManager(
+                        interval_ms, backend_classes=[cls])
+
+                    def sample():
+                        # Let streaming backends read their pipes, as
+                        # the main loop does between ticks
+                        deadline = time.monotonic() + interval_ms / 1000
+                        while time.monotonic() < deadline:
+                            context.iteration(False)
+                            time.sleep(0.005)
+                        start = time.perf_counter()
+                        applet.get_gpu_data()
+                        return time.perf_counter() - start
+
+                    # Only the get_gpu_data call itself is timed
+                    measure_sampler(f"sampler/{gpus}gpu/{name}", sample,
+                                    args.sampler_iterations, results)
+                    applet.backends.stop()
+                    os.unlink(path)
+        finally:
+            os.environ['PATH'] = old_path
+
+
+def measure_sampler(name, sample, iterations, results):
+    """Like measure, for functions returning their own timed duration"""
+    sample()  # Probe the backend
+    times = sorted(sample() for _ in range(iterations))
+
+    def percentile(fraction):
+        return times[min(len(times) - 1, int(len(times) * fraction))] * 1000
+
+    results[name] = {
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'peak_kib': None,
+        'calls': iterations,
+    }
+    print(f"{name:44} {results[name]['p50_ms']:9.3f} "
+          f"{results[name]['p95_ms']:9.3f} {results[name]['p99_ms']:9.3f} "
+          f"{'-':>9}")
+
+
+def bench_remote(args, results):
+    """Polling stand-in agents on loopback, also with a hung one
+
+    Times the slowest reply of the answering agents, which must not grow
+    when another agent stops answering. The agents serve synthetic
+    samples and run until the benchmark exits.
+    """
+    interval_ms = 100
+    threading.Thread(target=GLib.MainLoop().run, daemon=True).start()
+    # Accepts connections in its backlog but never answers
+    hung = socket.create_server(('127.0.0.1', 0))
+    hung_address = '127.0.0.1:%d' % hung.getsockname()[1]
+
+    for hosts in args.hosts:
+        addresses = []
+        for _ in range(hosts):
+            agent = mate_gpu_applet.RemoteAgent(('127.0.0.1', 0),
+                                                interval_ms)
+            agent.backends.sample = \
+                lambda: sample_devices(2, int(time.time() * 10))
+            agent.listen()
+            agent.update_interval()
+            addresses.append('127.0.0.1:%d' %
+                             agent.server.getsockname()[1])
+
+        for case, extra in (('', []), ('+hung', [hung_address])):
+            poller = mate_gpu_applet.RemotePoller(addresses + extra,
+                                                  interval_ms, 1)
+
+            def sample():
+                time.sleep(interval_ms / 1000)
+                return max(host.latency or 0
+                           for host in poller.hosts[:hosts])
+
+            measure_sampler(f"remote/{hosts}host{case}/poll", sample,
+                            args.sampler_iterations, results)
+            poller.stop()
+    hung.close()
+
+
+def bench_startup(args, results):
+    """Import of the applet module, the part of startup before the panel
+
+    The rest of the startup, up to the first sample, is shown under
+    Diagnostics in the running applet.
+    """
+    code = ('import time; start = time.perf_counter(); '
+            'import mate_gpu_applet; print(time.perf_counter() - start)')
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    def start():
+        result = subprocess.run([sys.executable, '-c', code],
+                                cwd=directory, capture_output=True,
+                                text=True, check=True)
+        return float(result.stdout)
+
+    measure_sampler("startup/import", start, args.sampler_iterations,
+                    results)
+
+
+def compare(results, baseline_file):
+    """Print the p50 change of every case against a saved baseline"""
+    with open(baseline_file) as f:
+        baseline = json.load(f)['results']
+
+    print()
+    print(f"{'case':44} {'base p50':>9} {'p50':>9} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['p50_ms']
+        new = result['p50_ms']
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{name:44} {old:9.3f} {new:9.3f} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only',
+                        choices=('window', 'panel', 'sampler', 'remote',
+                                 'startup'),
+                        action='append', help="run only these groups")
+    parser.add_argument('--gpus', type=int, nargs='+', default=[1, 4, 8],
+                        help="GPU counts to benchmark")
+    parser.add_argument('--hosts', type=int, nargs='+', default=[1, 4],
+                        help="remote agent counts to benchmark")
+    parser.add_argument('--rows', type=int, default=1440,
+                        help="history rows per tier (capped by capacity)")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--sampler-iterations', type=int, default=20)
+    parser.add_argument('--replay', metavar='FILE',
+                        help="feed the panel ticks from a session recording")
+    parser.add_argument('--save', metavar='FILE',
+                        help="save the results as a baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare the results with a baseline")
+    args = parser.parse_args()
+
+    groups = args.only or ['window', 'panel', 'sampler', 'remote',
+                           'startup']
+    results = {}
+    print(f"{'case':44} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'peak KiB':>9}")
+    if 'window' in groups:
+        bench_window(args, results)
+    if 'panel' in groups:
+        bench_panel(args, results)
+    if 'sampler' in groups:
+        bench_sampler(args, results)
+    if 'remote' in groups:
+        bench_remote(args, results)
+    if 'startup' in groups:
+        bench_startup(args, results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'created': time.time(), 'python': sys.version,
+                       'results': results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,43 +4,3506 @@ import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('MatePanelApplet', '4.0')
 
-from gi.repository import Gtk, MatePanelApplet, GLib   # pyright: ignore[reportAttributeAccessIssue] # noqa: E402,E501
+from gi.repository import Gtk, MatePanelApplet, GLib, Gio   # pyright: ignore[reportAttributeAccessIssue] # noqa: E402,E501
 import cairo                                           # noqa
+import bisect                                          # noqa
+import math                                            # noqa
+import mmap                                            # noqa
+import fcntl                                           # noqa
+import glob                                            # noqa
 import json                                            # noqa
 import os                                              # noqa
+import queue                                           # noqa
 import re                                              # noqa
+import socket                                          # noqa
+import struct                                          # noqa
 import subprocess                                      # noqa
+import sys                                             # noqa
+import tempfile                                        # noqa
+import threading                                       # noqa
 import time                                            # noqa
+from array import array                                # noqa
 from collections import deque                          # noqa
 
+# Metric registry, everything shown for a metric is generated from it:
+# - field: key of the value in sample dicts
+# - title, unit: chart window legend; text: panel label format
+# - prefix, short, label, color: panel chart value, unit, placeholder
+# - scale: chart maximum, or None to scale to the highest value in the
+#   window, rounded up to a multiple of step
+# - preference: the preference that shows the metric; core metrics are
+#   always sampled, the others only while shown
+# - check: preferences dialog label
+# - nvidia: nvidia-smi --query-gpu fields and the function of their
+#   values giving the metric, or None if nvidia-smi has no such field
+# - openmetrics: name and help of the exported gauge
+METRICS = {
+    'gpu': {
+        'field': 'usage', 'title': "GPU Load", 'unit': '%',
+        'text': "{name}: {value}%", 'prefix': 'g', 'short': '%',
+        'label': 'gpu', 'color': (0.3, 0.7, 1.0), 'scale': 100,
+        'preference': 'show_gpu_load', 'core': True,
+        'check': "Show GPU Load",
+        'nvidia': (('utilization.gpu',), float),
+        'openmetrics': ('gpu_utilization_percent', "GPU utilization"),
+    },
+    'temp': {
+        'field': 'temp', 'title': "Temperature", 'unit': '°C',
+        'text': "{value}°C", 'prefix': 't', 'short': '°',
+        'label': 'tmp', 'color': (1.0, 0.5, 0.2), 'scale': 100,
+        'preference': 'show_temperature', 'core': True,
+        'check': "Show Temperature",
+        'nvidia': (('temperature.gpu',), float),
+        'openmetrics': ('gpu_temperature_celsius', "GPU temperature"),
+    },
+    'memory': {
+        'field': 'memory', 'title': "Memory", 'unit': '%',
+        'text': "Mem: {value}%", 'prefix': 'm', 'short': '%',
+        'label': 'mem', 'color': (0.2, 0.8, 0.2), 'scale': 100,
+        'preference': 'show_memory', 'core': True,
+        'check': "Show Memory Usage",
+        'nvidia': (('memory.used', 'memory.total'),
+                   lambda used, total: round(used / total * 100)),
+        'openmetrics': ('gpu_memory_used_percent', "GPU memory used"),
+    },
+    'gtt': {
+        'field': 'gtt', 'title': "GTT", 'unit': '%',
+        'text': "GTT {value:.0f}%", 'prefix': 'gt', 'short': '%',
+        'label': 'gtt', 'color': (0.6, 0.6, 0.2), 'scale': 100,
+        'preference': 'show_gtt', 'check': "Show GTT Usage (AMD)",
+        'nvidia': None,
+        'openmetrics': ('gpu_gtt_used_percent',
+                        "System memory mapped for the GPU (GTT) used"),
+    },
+    'power': {
+        'field': 'power', 'title': "Power", 'unit': 'W',
+        'text': "{value:.0f} W", 'prefix': 'p', 'short': 'W',
+        'label': 'pwr', 'color': (0.9, 0.3, 0.6), 'scale': None,
+        'step': 50, 'preference': 'show_power',
+        'check': "Show Power Draw",
+        'nvidia': (('power.draw',), float),
+        'openmetrics': ('gpu_power_watts', "GPU power draw"),
+    },
+    'sm_clock': {
+        'field': 'sm_clock', 'title': "Shader Clock", 'unit': 'MHz',
+        'text': "SM {value:.0f} MHz", 'prefix': 's', 'short': '',
+        'label': 'sm', 'color': (0.8, 0.8, 0.3), 'scale': None,
+        'step': 500, 'preference': 'show_sm_clock',
+        'check': "Show Shader Clock",
+        'nvidia': (('clocks.sm',), float),
+        'openmetrics': ('gpu_sm_clock_megahertz', "GPU shader clock"),
+    },
+    'mem_clock': {
+        'field': 'mem_clock', 'title': "Memory Clock", 'unit': 'MHz',
+        'text': "MClk {value:.0f} MHz", 'prefix': 'c', 'short': '',
+        'label': 'mclk', 'color': (0.5, 0.9, 0.9), 'scale': None,
+        'step': 500, 'preference': 'show_mem_clock',
+        'check': "Show Memory Clock",
+        'nvidia': (('clocks.mem',), float),
+        'openmetrics': ('gpu_memory_clock_megahertz', "GPU memory clock"),
+    },
+    'fan': {
+        'field': 'fan', 'title': "Fan", 'unit': '%',
+        'text': "Fan {value:.0f}%", 'prefix': 'f', 'short': '%',
+        'label': 'fan', 'color': (0.7, 0.7, 0.7), 'scale': 100,
+        'preference': 'show_fan', 'check': "Show Fan Speed",
+        'nvidia': (('fan.speed',), float),
+        'openmetrics': ('gpu_fan_speed_percent', "GPU fan speed"),
+    },
+    'encoder': {
+        'field': 'encoder', 'title': "Encoder", 'unit': '%',
+        'text': "Enc {value:.0f}%", 'prefix': 'e', 'short': '%',
+        'label': 'enc', 'color': (0.6, 0.5, 1.0), 'scale': 100,
+        'preference': 'show_encoder', 'check': "Show Encoder Load",
+        'nvidia': (('utilization.encoder',), float),
+        'openmetrics': ('gpu_encoder_utilization_percent',
+                        "Video encoder utilization"),
+    },
+    'decoder': {
+        'field': 'decoder', 'title': "Decoder", 'unit': '%',
+        'text': "Dec {value:.0f}%", 'prefix': 'd', 'short': '%',
+        'label': 'dec', 'color': (1.0, 0.8, 0.5), 'scale': 100,
+        'preference': 'show_decoder', 'check': "Show Decoder Load",
+        'nvidia': (('utilization.decoder',), float),
+        'openmetrics': ('gpu_decoder_utilization_percent',
+                        "Video decoder utilization"),
+    },
+}
+
+CORE_METRICS = tuple(name for name, metric in METRICS.items()
+                     if metric.get('core'))
+
+# Chart metrics and the sample fields they are taken from
+METRIC_FIELDS = {name: metric['field'] for name, metric in METRICS.items()}
+
+
+# Fields nvidia-smi always queries for ThrottleDetector, and the sample
+# fields they go to: the active clock throttle reasons as a bitmask, and
+# the SM clock and its maximum in MHz
+NVIDIA_THROTTLE_FIELDS = {
+    'clocks_throttle_reasons.active': 'throttle',
+    'clocks.sm': 'sm_clock',
+    'clocks.max.sm': 'max_sm_clock',
+}
+
+# Throttling flagged by ThrottleDetector: the clocks_throttle_reasons
+# bits of each reason, its name and the colour of its marks
+THROTTLE_REASONS = {
+    'thermal': {'mask': 0x20 | 0x40, 'label': "thermal",  # SW and HW
+                'color': (1.0, 0.3, 0.2)},
+    'power': {'mask': 0x04 | 0x80, 'label': "power cap",  # and brake
+              'color': (1.0, 0.8, 0.2)},
+    'slowdown': {'mask': 0x08, 'label': "HW slowdown",
+                 'color': (0.8, 0.4, 1.0)},
+}
+
+
+def nvidia_query_fields(metrics):
+    """Return the --query-gpu fields for sampling metrics at once"""
+    fields = ['index']
+    for name in metrics:
+        if METRICS[name]['nvidia'] is None:
+            continue
+        for field in METRICS[name]['nvidia'][0]:
+            if field not in fields:
+                fields.append(field)
+    for field in NVIDIA_THROTTLE_FIELDS:
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+# Burst statistics kept next to the raw samples and the sample fields
+# they are taken from, see BurstAggregator
+BURST_FIELDS = {'gpu_p95': 'usage_p95', 'gpu_peak': 'usage_peak'}
+
+# History retention tiers: name, bucket length in seconds (None for raw
+# samples) and number of rows kept
+HISTORY_TIERS = (
+    ('raw', None, 300),
+    ('10s', 10, 360),  # One hour
+    ('1m', 60, 1440),  # 24 hours
+)
+
+TIER_NAMES = [name for name, seconds, capacity in HISTORY_TIERS]
+
+# Chart window time ranges by the history tier they are drawn from
+TIME_RANGES = {
+    'raw': "Recent samples",
+    '10s': "Last hour",
+    '1m': "Last 24 hours",
+}
+
+# How several GPUs are shown: each on its own, or combined
+MULTI_GPU_MODES = {
+    'per_gpu': "Show each GPU",
+    'max': "Maximum across GPUs",
+    'avg': "Average across GPUs",
+    'per_host': "Maximum of each host",
+}
+
+# Default TCP port of the remote agent, see RemoteAgent
+AGENT_PORT = 9840
+
+# Registered backend classes, probed in priority order
+BACKENDS = []
+
+
+def register_backend(cls):
+    """Class decorator adding a backend to the registry"""
+    BACKENDS.append(cls)
+    BACKENDS.sort(key=lambda backend: backend.priority)
+    return cls
+
+
+def device_sort_key(device_id):
+    """Sort local GPUs first, then by host, numeric ids numerically"""
+    host, _, index = device_id.rpartition(':')
+    if index.isdigit():
+        return (host, 0, int(index), '')
+    return (host, 1, 0, index)
+
+
+def device_host(device_id):
+    """Return the host a device id belongs to, '' for this host"""
+    return device_id.rpartition(':')[0]
+
+
+def is_device_key(key):
+    """Tell GPU history keys from the aggregate and per-host ones"""
+    return key.isdigit() or ':' in key
+
+
+def trace_series(cr, series, metric, x, y, width, height, max_val,
+                 reverse=False, connect=False):
+    """Add a polyline through the values of a metric to the cairo path
+
+    The values are spread over width, missing values are skipped, and
+    the line only goes through about one value per unit of width, see
+    TimeSeries.decimated. With reverse the line runs from right to left,
+    with connect it continues the current path instead of starting a
+    new one. Returns the number of points traced.
+    """
+    count = len(series)
+    if count < 2:
+        return 0
+    step = width / (count - 1)
+    scale = height / max_val
+    bottom = y + height
+
+    traced = series.decimated(metric, width)
+    if reverse:
+        traced = traced[::-1]
+    for points, (i, value) in enumerate(traced):
+        if points or connect:
+            cr.line_to(x + step * i, bottom - value * scale)
+        else:
+            cr.move_to(x + step * i, bottom - value * scale)
+    return len(traced)
+
+
+def lttb(points, threshold):
+    """Reduce (x, y) points to threshold points keeping their shape
+
+    Largest-Triangle-Three-Buckets: the first and last points are kept,
+    the others are split into threshold - 2 buckets of equal size, and
+    each bucket keeps the point forming the largest triangle with the
+    point kept from the bucket before and the mean of the bucket after.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+    kept = [points[0]]
+    every = (count - 2) / (threshold - 2)
+    ax, ay = points[0]
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        # The last bucket is followed by the last point alone
+        after = points[end:min(int((bucket + 2) * every) + 1, count)]
+        mean_x = sum(x for x, _ in after) / len(after)
+        mean_y = sum(y for _, y in after) / len(after)
+        largest = -1.0
+        for x, y in points[start:end]:
+            # Twice the triangle area, the factor does not matter
+            area = abs((ax - mean_x) * (y - ay) - (ax - x) * (mean_y - ay))
+            if area > largest:
+                largest = area
+                chosen = (x, y)
+        kept.append(chosen)
+        ax, ay = chosen
+    kept.append(points[-1])
+    return kept
+
+
+def drm_cards(sysfs_root):
+    """Return the sysfs directory of every DRM card by card number"""
+    cards = {}
+    for card in glob.glob(os.path.join(sysfs_root, 'class', 'drm', 'card*')):
+        match = re.fullmatch(r'card(\d+)', os.path.basename(card))
+        if match:
+            cards[int(match.group(1))] = card
+    return cards
+
+
+def default_sampler_socket():
+    """Return the per-user path of the shared sampler socket
+
+    Only the applets of one user share a sampler. A socket other users
+    could reach would need a system service and access control.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'mate-gpu-applet', 'sampler.sock')
+    return os.path.join(tempfile.gettempdir(),
+                        f'mate-gpu-applet-{os.getuid()}', 'sampler.sock')
+
+
+def call_on_main(func, *args):
+    """Run func once on the GTK main loop"""
+    def callback():
+        func(*args)
+        return False
+    GLib.idle_add(callback)
+
+
+class TimeSeries:
+    """Fixed size ring buffer holding several float columns
+
+    Values live in one preallocated array('d') per column, missing
+    values are stored as NaN. The minimum, maximum and mean of every
+    column over the buffered window are kept up to date on append, in
+    amortized O(1), using running sums and monotonic deques.
+    """
+
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.columns = tuple(columns)
+        self.data = {column: array('d', [math.nan]) * capacity
+                     for column in self.columns}
+        self.head = 0  # Next write position
+        self.count = 0
+        self.appended = 0  # Serial number of the next row
+        self.sums = dict.fromkeys(self.columns, 0.0)
+        self.valid = dict.fromkeys(self.columns, 0)
+        # (serial, value) pairs with increasing / decreasing values
+        self.min_queues = {column: deque() for column in self.columns}
+        self.max_queues = {column: deque() for column in self.columns}
+        # Per column: serial and threshold it was made for, and points
+        self.decimation = {}
+        # Per column: serial it was made for, and values
+        self.filled_columns = {}
+
+    def __len__(self):
+        return self.count
+
+    def append(self, values):
+        """Append a row from a dict, missing columns become NaN"""
+        serial = self.appended
+        oldest = serial - self.capacity + 1
+        full = self.count == self.capacity
+        for column in self.columns:
+            value = values.get(column)
+            value = math.nan if value is None else float(value)
+            data = self.data[column]
+
+            if full and not math.isnan(data[self.head]):
+                self.sums[column] -= data[self.head]
+                self.valid[column] -= 1
+            data[self.head] = value
+
+            min_queue = self.min_queues[column]
+            max_queue = self.max_queues[column]
+            if not math.isnan(value):
+                self.sums[column] += value
+                self.valid[column] += 1
+                while min_queue and min_queue[-1][1] >= value:
+                    min_queue.pop()
+                min_queue.append((serial, value))
+                while max_queue and max_queue[-1][1] <= value:
+                    max_queue.pop()
+                max_queue.append((serial, value))
+            if min_queue and min_queue[0][0] < oldest:
+                min_queue.popleft()
+            if max_queue and max_queue[0][0] < oldest:
+                max_queue.popleft()
+
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.appended += 1
+
+    def pad(self, rows):
+        """Append rows of missing values"""
+        for _ in range(min(rows, self.capacity)):
+            self.append({})
+
+    def segments(self, column, last=None):
+        """Return memoryviews over a column, oldest values first
+
+        With last, only the newest `last` values are covered.
+        """
+        view = memoryview(self.data[column])
+        if self.count < self.capacity:
+            parts = (view[:self.count],)
+        else:
+            parts = (view[self.head:], view[:self.head])
+        if last is None or last >= self.count:
+            return parts
+        skip = self.count - last
+        if len(parts) == 2 and skip >= len(parts[0]):
+            return (parts[1][skip - len(parts[0]):],)
+        return (parts[0][skip:],) + parts[1:]
+
+    def values(self, column, last=None):
+        """Iterate over a column, oldest values first"""
+        for segment in self.segments(column, last):
+            yield from segment
+
+    def decimated(self, column, threshold):
+        """Return about threshold (row, value) points tracing a column
+
+        Rows count from the oldest one, missing values are left out.
+        The points are picked with lttb and kept until a row is appended
+        or another threshold is asked for.
+        """
+        threshold = max(int(threshold), 3)
+        cached = self.decimation.get(column)
+        if cached and cached[:2] == (self.appended, threshold):
+            return cached[2]
+        points = [(i, value) for i, value in enumerate(self.values(column))
+                  if not math.isnan(value)]
+        points = lttb(points, threshold)
+        self.decimation[column] = (self.appended, threshold, points)
+        return points
+
+    def filled(self, column):
+        """Return a column as a list with no missing values
+
+        Missing values take the value before them, or -inf at the start.
+        The list is kept until a row is appended.
+        """
+        cached = self.filled_columns.get(column)
+        if cached and cached[0] == self.appended:
+            return cached[1]
+        values = []
+        previous = -math.inf
+        for value in self.values(column):
+            if not math.isnan(value):
+                previous = value
+            values.append(previous)
+        self.filled_columns[column] = (self.appended, values)
+        return values
+
+    def last(self, column):
+        """Return the newest value of a column, or None if missing"""
+        if not self.count:
+            return None
+        value = self.data[column][self.head - 1]
+        return None if math.isnan(value) else value
+
+    def has_data(self, column):
+        """Return True if a column has any value in the window"""
+        return self.valid[column] > 0
+
+    def min(self, column):
+        queue_ = self.min_queues[column]
+        return queue_[0][1] if queue_ else None
+
+    def max(self, column):
+        queue_ = self.max_queues[column]
+        return queue_[0][1] if queue_ else None
+
+    def mean(self, column):
+        if not self.valid[column]:
+            return None
+        return self.sums[column] / self.valid[column]
+
+
+class TieredHistory:
+    """Metric history kept at several resolutions
+
+    Raw samples go into the 'raw' tier, together with the burst
+    statistics of BURST_FIELDS. Every other tier of HISTORY_TIERS holds
+    min/avg/max buckets of a fixed length in columns named
+    '<metric>_min', '<metric>' and '<metric>_max'. The bucket maximum
+    takes '<metric>_peak' into account when a sample has it. Buckets are
+    accumulated on append and written when the next one starts, so the
+    memory used never grows.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = tuple(metrics)
+        self.tiers = {}
+        self.open_buckets = {}
+        # Called with the tier name, tier and row for every new row
+        self.listener = None
+        for name, seconds, capacity in HISTORY_TIERS:
+            if seconds is None:
+                columns = ('time',) + self.metrics + tuple(BURST_FIELDS)
+            else:
+                columns = ('time',) + tuple(
+                    metric + suffix for metric in self.metrics
+                    for suffix in ('_min', '', '_max'))
+            self.tiers[name] = TimeSeries(capacity, columns)
+
+    @property
+    def raw(self):
+        return self.tiers['raw']
+
+    def __len__(self):
+        return len(self.raw)
+
+    def append(self, timestamp, values):
+        """Add a sample to the raw tier and to the open buckets"""
+        row = dict(values)
+        row['time'] = timestamp
+        self.raw.append(row)
+        if self.listener:
+            self.listener('raw', self.raw, row)
+
+        for name, seconds, capacity in HISTORY_TIERS:
+            if seconds is None:
+                continue
+            start = timestamp - timestamp % seconds
+            bucket = self.open_buckets.get(name)
+            if bucket is not None and bucket['start'] != start:
+                self.close_bucket(name)
+                bucket = None
+            if bucket is None:
+                bucket = self.open_buckets[name] = self.new_bucket(start)
+            for metric in self.metrics:
+                value = values.get(metric)
+                if value is None:
+                    continue
+                peak = values.get(metric + '_peak')
+                totals = bucket['totals'][metric]
+                totals[0] += value
+                totals[1] += 1
+                totals[2] = min(totals[2], value)
+                totals[3] = max(totals[3], value if peak is None else peak)
+
+    def new_bucket(self, start):
+        """Return an empty bucket starting at start"""
+        # Sum, count, minimum and maximum per metric
+        return {'start': start,
+                'totals': {metric: [0.0, 0, math.inf, -math.inf]
+                           for metric in self.metrics}}
+
+    def close_bucket(self, name):
+        """Write the open bucket of a tier as a row"""
+        bucket = self.open_buckets.pop(name)
+        row = {'time': bucket['start']}
+        for metric, (total, count, low, high) in bucket['totals'].items():
+            if count:
+                row[metric + '_min'] = low
+                row[metric] = total / count
+                row[metric + '_max'] = high
+        self.tiers[name].append(row)
+        if self.listener:
+            self.listener(name, self.tiers[name], row)
+
+    def pad_like(self, other):
+        """Pad every tier with missing rows to line up with other"""
+        for name, tier in self.tiers.items():
+            tier.pad(len(other.tiers[name]))
+        # Close the next bucket together with other
+        for name, bucket in other.open_buckets.items():
+            self.open_buckets[name] = self.new_bucket(bucket['start'])
+
+
+class HistoryStore:
+    """History rows kept in a fixed size memory-mapped ring file
+
+    The file starts with a header holding the format version, the ring
+    capacities and the number of records ever written to each ring.
+    Every tier of HISTORY_TIERS has its own ring of fixed size records
+    (time, history key, up to VALUES column values), shared by up to
+    `keys` history keys. Records are written straight into the mapping
+    without any fsync, the kernel writes the pages back. The file is
+    locked while mapped, opening it a second time raises OSError.
+    """
+
+    MAGIC = b'GPUHIST\0'
+    VERSION = 3
+    HEADER = struct.Struct('<8sII3I3Q')
+    HEADER_SIZE = 64
+    # Bucket tiers have the most columns, min/avg/max of every metric
+    VALUES = 3 * len(METRICS)
+    # Room for remote GPU ids, which start with the host name
+    KEY_SIZE = 64
+    RECORD = struct.Struct(f'<d{KEY_SIZE}s{VALUES}d')
+    HEADS_OFFSET = 28
+
+    def __init__(self, path, keys=8):
+        self.path = path
+        self.capacities = [capacity * keys
+                           for name, seconds, capacity in HISTORY_TIERS]
+        self.offsets = []
+        offset = self.HEADER_SIZE
+        for capacity in self.capacities:
+            self.offsets.append(offset)
+            offset += capacity * self.RECORD.size
+        size = offset
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Rows of two writers would overwrite each other
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fresh = os.fstat(self.fd).st_size != size
+            if fresh:
+                os.ftruncate(self.fd, size)
+            self.map = mmap.mmap(self.fd, size)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+        magic, version, record_size, *rest = \
+            self.HEADER.unpack_from(self.map, 0)
+        if (fresh or magic != self.MAGIC or version != self.VERSION or
+                record_size != self.RECORD.size or
+                list(rest[:3]) != self.capacities):
+            self.heads = [0] * len(self.capacities)
+            self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION,
+                                  self.RECORD.size, *self.capacities,
+                                  *self.heads)
+        else:
+            self.heads = list(rest[3:])
+
+    def write(self, key, tier_name, tier, row):
+        """Append a history row of a tier to its ring"""
+        index = TIER_NAMES.index(tier_name)
+        values = [row.get(column) for column in tier.columns[1:]]
+        values = [math.nan if value is None else value for value in values]
+        values += [math.nan] * (self.VALUES - len(values))
+        position = self.heads[index] % self.capacities[index]
+        self.RECORD.pack_into(
+            self.map, self.offsets[index] + position * self.RECORD.size,
+            row['time'], key.encode('utf-8')[:self.KEY_SIZE], *values)
+        self.heads[index] += 1
+        struct.pack_into('<Q', self.map, self.HEADS_OFFSET + 8 * index,
+                         self.heads[index])
+
+    def read(self, tier_name):
+        """Return (time, key, values) of a tier ring, oldest first"""
+        index = TIER_NAMES.index(tier_name)
+        capacity = self.capacities[index]
+        head = self.heads[index]
+        count = min(head, capacity)
+        start = self.offsets[index]
+        end = start + capacity * self.RECORD.size
+        records = list(self.RECORD.iter_unpack(self.map[start:end]))
+        if head > capacity:
+            split = head % capacity
+            records = records[split:] + records[:split]
+        records = records[:count]
+        return [(record[0], record[1].rstrip(b'\0').decode('utf-8',
+                                                           'replace'),
+                 record[2:])
+                for record in records]
+
+    def close(self):
+        """Unmap and unlock the file, leaving write back to the kernel"""
+        self.map.close()
+        os.close(self.fd)
+
+
+class ScrollingChart:
+    """Offscreen surface of a panel chart that scrolls with the samples
+
+    Every sample takes `step` pixels, the newest one at the right edge.
+    A new sample shifts the surface left and only the newest segment is
+    drawn, so the cost per tick does not depend on the chart width or
+    the history length. The whole chart is redrawn only when the size
+    or the style changes. With peak_metric, the peaks of that column are
+    drawn as a thin line over the chart.
+    """
+
+    margin = 2
+    line_width = 1.5
+    background = (0.1, 0.1, 0.1)
+
+    def __init__(self, color, peak_metric=None):
+        self.color = color
+        self.peak_metric = peak_metric
+        self.surface = None
+        self.spare = None
+        self.style = None
+        self.series = None
+        self.serial = 0  # series.appended when last drawn
+
+    def invalidate(self):
+        """Force a full redraw on the next render"""
+        self.style = None
+
+    def render(self, series, metric, width, height, alpha, points,
+               max_val=100):
+        """Bring the surface up to date with series and return it
+
+        points is the number of samples the chart width should show,
+        max_val the value at the top of the chart.
+        """
+        chart_width = width - self.margin * 2
+        step = max(1, round(chart_width / max(points - 1, 1)))
+        visible = chart_width // step + 1
+        style = (width, height, alpha, step, max_val)
+        new = series.appended - self.serial
+
+        if (style != self.style or series is not self.series or
+                new < 0 or new >= visible):
+            self.style = style
+            self.series = series
+            self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                              width, height)
+            self.spare = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                            width, height)
+            cr = cairo.Context(self.surface)
+            cr.set_source_rgb(*self.background)
+            cr.paint()
+            # One extra value so the first segment enters from the left
+            self.draw_values(cr, list(series.values(metric, visible + 1)),
+                             width, height, step, alpha, 0,
+                             self.peaks(series, visible + 1), max_val)
+        elif new:
+            shift = new * step
+            cr = cairo.Context(self.spare)
+            cr.set_operator(cairo.OPERATOR_SOURCE)
+            cr.set_source_surface(self.surface, -shift, 0)
+            cr.paint()
+            cr.set_operator(cairo.OPERATOR_OVER)
+            self.surface, self.spare = self.spare, self.surface
+
+            # Clear the left margin and the uncovered strip on the right
+            cr.set_source_rgb(*self.background)
+            cr.rectangle(0, 0, self.margin, height)
+            cr.rectangle(width - self.margin - shift, 0,
+                         self.margin + shift, height)
+            cr.fill()
+            # Redraw the segment before the new ones too, clipped to the
+            # strip, so the joins look like a full redraw
+            self.draw_values(cr, list(series.values(metric, new + 2)),
+                             width, height, step, alpha, shift,
+                             self.peaks(series, new + 2), max_val)
+
+        self.serial = series.appended
+        return self.surface
+
+    def peaks(self, series, last):
+        """Return the newest peak values, or None without peaks"""
+        if self.peak_metric is None or not series.has_data(self.peak_metric):
+            return None
+        return list(series.values(self.peak_metric, last))
+
+    def draw_values(self, cr, values, width, height, step, alpha, strip,
+                    peaks=None, max_val=100):
+        """Fill and stroke values, the newest at the right edge
+
+        With strip, drawing is limited to that many pixels on the right.
+        """
+        margin = self.margin
+        right = width - margin
+        bottom = height - margin
+        scale = (height - margin * 2) / max_val
+
+        cr.save()
+        if strip:
+            cr.rectangle(right - strip, margin, strip, height - margin * 2)
+        else:
+            cr.rectangle(margin, margin, width - margin * 2,
+                         height - margin * 2)
+        cr.clip()
+
+        # Every run of values without gaps becomes one filled line
+        for run in self.runs(values, right, bottom, step, scale):
+            if len(run) < 2:
+                continue
+            cr.move_to(*run[0])
+            for x, y in run[1:]:
+                cr.line_to(x, y)
+            line = cr.copy_path()
+
+            cr.set_source_rgba(*self.color, alpha)
+            cr.line_to(run[-1][0], bottom)
+            cr.line_to(run[0][0], bottom)
+            cr.close_path()
+            cr.fill()
+
+            cr.set_source_rgb(*self.color)
+            cr.set_line_width(self.line_width)
+            cr.append_path(line)
+            cr.stroke()
+
+        if peaks:
+            cr.set_source_rgba(1, 1, 1, 0.6)
+            cr.set_line_width(1)
+            for run in self.runs(peaks, right, bottom, step, scale):
+                cr.move_to(*run[0])
+                for x, y in run[1:]:
+                    cr.line_to(x, y)
+            cr.stroke()
+        cr.restore()
+
+    @staticmethod
+    def runs(values, right, bottom, step, scale):
+        """Split values into runs of points without gaps"""
+        runs = []
+        run = []
+        count = len(values)
+        for i, value in enumerate(values):
+            if math.isnan(value):
+                if run:
+                    runs.append(run)
+                    run = []
+                continue
+            run.append((right - (count - 1 - i) * step,
+                        bottom - value * scale))
+        if run:
+            runs.append(run)
+        return runs
+
+
+class StreamingProcess:
+    """Long-lived child process whose stdout is consumed line by line"""
+
+    # Give up after this many exits in a row without a single good line
+    max_failures = 3
+
+    def __init__(self, restart_delay=2):
+        self.restart_delay = restart_delay
+        self.process = None
+        self.watch_id = None
+        self.restart_id = None
+        self.buffer = b''
+        self.failures = 0
+        self.got_line = False
+        self.available = True
+
+    def build_command(self):
+        """Return the argv of the child process"""
+        raise NotImplementedError
+
+    def handle_line(self, line):
+        """Parse one line of output, return True if it was valid"""
+        raise NotImplementedError
+
+    def start(self):
+        """Spawn the child and start watching its stdout"""
+        if self.process is not None:
+            return True
+        if not self.available:
+            return False
+
+        try:
+            self.process = subprocess.Popen(self.build_command(),
+                                            stdin=subprocess.DEVNULL,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL)
+        except OSError:
+            # Executable missing or not runnable, no point in retrying
+            self.available = False
+            return False
+
+        self.buffer = b''
+        self.got_line = False
+        fd = self.process.stdout.fileno()
+        os.set_blocking(fd, False)
+        self.watch_id = GLib.io_add_watch(
+            fd, GLib.PRIORITY_DEFAULT,
+            GLib.IOCondition.IN | GLib.IOCondition.HUP |
+            GLib.IOCondition.ERR,
+            self.on_readable)
+        return True
+
+    def stop(self):
+        """Stop watching and terminate the child"""
+        if self.restart_id:
+            GLib.source_remove(self.restart_id)
+            self.restart_id = None
+        if self.watch_id:
+            GLib.source_remove(self.watch_id)
+            self.watch_id = None
+        self.reap()
+
+    def restart(self):
+        """Restart the child, e.g. after its arguments changed"""
+        self.stop()
+        self.failures = 0
+        self.start()
+
+    def reap(self):
+        """Terminate the child if still running and collect its status"""
+        if self.process is None:
+            return
+        process = self.process
+        self.process = None
+        try:
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            process.stdout.close()
+        except Exception:
+            pass
+
+    def on_readable(self, fd, condition):
+        """Read what is available from the child and dispatch lines"""
+        if condition & GLib.IOCondition.IN:
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                return True
+            except OSError:
+                chunk = b''
+            if chunk:
+                *lines, self.buffer = (self.buffer + chunk).split(b'\n')
+                for line in lines:
+                    line = line.decode('utf-8', 'replace').strip()
+                    if line and self.handle_line(line):
+                        self.got_line = True
+                return True
+
+        # End of file or hangup: the child is gone
+        self.watch_id = None
+        self.reap()
+        self.on_exit()
+        return False
+
+    def on_exit(self):
+        """Schedule a restart of a child that died"""
+        if self.got_line:
+            self.failures = 0
+        else:
+            self.failures += 1
+        if self.failures >= self.max_failures:
+            self.available = False
+            return
+        self.restart_id = GLib.timeout_add_seconds(self.restart_delay,
+                                                   self.on_restart_timeout)
+
+    def on_restart_timeout(self):
+        """Restart the child after a delay"""
+        self.restart_id = None
+        self.start()
+        return False
+
+
+class NvidiaSmiSampler(StreamingProcess):
+    """Keeps one nvidia-smi running in loop mode and tracks its output
+
+    All metrics are queried by the one nvidia-smi, in one line per GPU.
+    """
+
+    def __init__(self, interval_ms, metrics=CORE_METRICS):
+        super().__init__()
+        self.interval_ms = interval_ms
+        self.set_metrics(metrics)
+        # Written from the main loop, read from the sampling thread
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def set_metrics(self, metrics):
+        """Choose the metrics, takes effect when nvidia-smi restarts"""
+        self.metrics = tuple(metrics)
+        self.fields = nvidia_query_fields(self.metrics)
+
+    def build_command(self):
+        return ['nvidia-smi',
+                '--query-gpu=' + ','.join(self.fields),
+                '--format=csv,noheader,nounits',
+                '-lms', str(self.interval_ms)]
+
+    def handle_line(self, line):
+        values = line.split(', ')
+        if len(values) != len(self.fields):
+            return False
+        values = dict(zip(self.fields, values))
+        try:
+            index = int(values['index'])
+        except ValueError:
+            return False
+        sample = {'id': values['index'], 'time': time.time()}
+        for name in self.metrics:
+            if METRICS[name]['nvidia'] is None:
+                continue
+            fields, convert = METRICS[name]['nvidia']
+            try:
+                value = convert(*[float(values[field]) for field in fields])
+            except (ValueError, ZeroDivisionError):
+                # [N/A] or [Not Supported] on this GPU
+                value = None
+            sample[METRICS[name]['field']] = value
+        for field, key in NVIDIA_THROTTLE_FIELDS.items():
+            try:
+                # The reasons are hexadecimal, 0x0000000000000004
+                sample[key] = (int(values[field], 16) if key == 'throttle'
+                               else float(values[field]))
+            except ValueError:
+                sample[key] = None
+        if all(sample[METRICS[name]['field']] is None
+               for name in CORE_METRICS):
+            return False
+        with self.lock:
+            self.samples[index] = sample
+        return True
+
+    def set_interval(self, interval_ms):
+        """Change the sampling interval, restarting nvidia-smi"""
+        if interval_ms == self.interval_ms:
+            return
+        self.interval_ms = interval_ms
+        if self.available:
+            self.restart()
+
+    def latest(self):
+        """Return the most recent sample of every GPU, or None"""
+        with self.lock:
+            samples = [self.samples[index] for index in sorted(self.samples)]
+        # Ignore samples left over from a child that stopped reporting
+        cutoff = time.time() - 3 * self.interval_ms / 1000
+        samples = [sample for sample in samples if sample['time'] >= cutoff]
+        return samples or None
+
+
+class RadeontopSampler(StreamingProcess):
+    """Keeps one radeontop dumping to stdout and tracks its output
+
+    Every dump line holds fields like 'gpu 12.50%', 'vram 20.00%
+    800.00mb' and 'sclk 40.00% 0.800ghz', for the one GPU radeontop
+    watches. radeontop dumps at whole seconds only.
+    """
+
+    # Name, percentage and the optional amount and unit of a field
+    FIELD = re.compile(r'([a-z]+) ([\d.]+)%(?: ([\d.]+)(mb|ghz))?')
+
+    def __init__(self, interval_ms, metrics=CORE_METRICS):
+        super().__init__()
+        self.interval_ms = interval_ms
+        self.metrics = tuple(metrics)
+        # Written from the main loop, read from the sampling thread
+        self.sample = None
+        self.lock = threading.Lock()
+
+    def interval_seconds(self):
+        return max(1, round(self.interval_ms / 1000))
+
+    def build_command(self):
+        return ['radeontop', '-d', '-', '-i', str(self.interval_seconds())]
+
+    def handle_line(self, line):
+        sample = self.parse_line(line, self.metrics)
+        if sample is None:
+            return False
+        with self.lock:
+            self.sample = sample
+        return True
+
+    @classmethod
+    def parse_line(cls, line, metrics):
+        """Return the device dict of one dump line, or None"""
+        try:
+            fields = {name: (float(percent), amount and float(amount))
+                      for name, percent, amount, unit
+                      in cls.FIELD.findall(line)}
+        except ValueError:
+            return None
+        if 'gpu' not in fields:
+            return None
+        sample = {'id': '0', 'time': time.time(), 'usage': fields['gpu'][0],
+                  'temp': None, 'memory': fields.get('vram', (None,))[0]}
+        if 'gtt' in metrics and 'gtt' in fields:
+            sample[METRICS['gtt']['field']] = fields['gtt'][0]
+        for metric, name in (('sm_clock', 'sclk'), ('mem_clock', 'mclk')):
+            if metric in metrics and fields.get(name, (0, ''))[1]:
+                # GHz
+                sample[METRICS[metric]['field']] = round(
+                    fields[name][1] * 1000)
+        return sample
+
+    def set_interval(self, interval_ms):
+        """Change the dump interval, restarting radeontop if it changed"""
+        seconds = self.interval_seconds()
+        self.interval_ms = interval_ms
+        if self.interval_seconds() != seconds and self.available:
+            self.restart()
+
+    def latest(self):
+        """Return the most recent sample as a device list, or None"""
+        with self.lock:
+            sample = self.sample
+        # Ignore a sample left over from a child that stopped reporting
+        if (sample is None or
+                sample['time'] < time.time() - 3 * self.interval_seconds()):
+            return None
+        return [sample]
+
+
+class JSONStreamParser:
+    """Picks complete objects out of a stream of JSON text
+
+    intel_gpu_top -J writes one array that never ends, so the objects in
+    it are handed to json.loads one at a time, as soon as their closing
+    brace arrives. Only the object being read is buffered. Strings must
+    not span the chunks fed, which holds for lines of JSON output.
+    """
+
+    TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}]')
+
+    def __init__(self):
+        self.parts = []
+        self.depth = 0
+
+    def feed(self, text):
+        """Return the objects completed by text"""
+        objects = []
+        start = 0 if self.depth else None
+        for match in self.TOKEN.finditer(text):
+            token = match.group()
+            if token == '{':
+                if not self.depth:
+                    start = match.start()
+                self.depth += 1
+            elif token == '}' and self.depth:
+                self.depth -= 1
+                if not self.depth:
+                    self.parts.append(text[start:match.end()])
+                    try:
+                        objects.append(json.loads(''.join(self.parts)))
+                    except ValueError:
+                        pass  # Skip a damaged object, keep going
+                    self.parts = []
+                    start = None
+        if self.depth:
+            self.parts.append(text[start:])
+        return objects
+
+
+class IntelGpuTopSampler(StreamingProcess):
+    """Keeps one intel_gpu_top running in JSON mode and tracks its output
+
+    intel_gpu_top reports the first GPU only, as device '0'.
+    """
+
+    def __init__(self, interval_ms, metrics=CORE_METRICS):
+        super().__init__()
+        self.interval_ms = interval_ms
+        self.metrics = tuple(metrics)
+        self.parser = JSONStreamParser()
+        # Written from the main loop, read from the sampling thread
+        self.sample = None
+        self.lock = threading.Lock()
+
+    def build_command(self, interval_ms=None):
+        return ['intel_gpu_top', '-J', '-s',
+                str(interval_ms or self.interval_ms)]
+
+    def start(self):
+        if self.process is None:
+            self.parser = JSONStreamParser()
+        return super().start()
+
+    def handle_line(self, line):
+        valid = False
+        for report in self.parser.feed(line):
+            sample = self.parse_report(report, self.metrics)
+            if sample is not None:
+                with self.lock:
+                    self.sample = sample
+                valid = True
+        return valid
+
+    @staticmethod
+    def parse_report(report, metrics):
+        """Return the device dict of one intel_gpu_top report, or None"""
+        engines = report.get('engines')
+        if not isinstance(engines, dict):
+            return None
+        # Engines are named 'Render/3D', 'Video' or, in older versions,
+        # 'Render/3D/0', 'Video/1' and so on; keep the busiest of a kind
+        busy = {}
+        try:
+            for name, engine in engines.items():
+                kind = name.split('/')[0]
+                busy[kind] = max(busy.get(kind, 0.0), float(engine['busy']))
+            frequency = report.get('frequency', {}).get('actual')
+            power = report.get('power', {})
+            # 'GPU' since igt 1.25, 'value' before
+            power = power.get('GPU', power.get('value'))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        if 'Render' not in busy:
+            return None
+
+        # Video engines both decode and encode, there is no split
+        values = {
+            'sm_clock': frequency,
+            'power': power,
+            'encoder': busy.get('Video'),
+            'decoder': busy.get('Video'),
+        }
+        sample = {'id': '0', 'time': time.time(),
+                  'usage': max(busy['Render'], busy.get('Compute', 0.0)),
+                  'temp': None, 'memory': None}
+        for metric, value in values.items():
+            if metric in metrics:
+                sample[METRICS[metric]['field']] = value
+        return sample
+
+    def set_interval(self, interval_ms):
+        """Change the sampling interval, restarting intel_gpu_top"""
+        if interval_ms == self.interval_ms:
+            return
+        self.interval_ms = interval_ms
+        if self.available:
+            self.restart()
+
+    def latest(self):
+        """Return the most recent sample as a device list, or None"""
+        with self.lock:
+            sample = self.sample
+        # Ignore a sample left over from a child that stopped reporting
+        if (sample is None or
+                sample['time'] < time.time() - 3 * self.interval_ms / 1000):
+            return None
+        return [sample]
+
+
+class GPUBackend:
+    """Common interface of all GPU data sources
+
+    probe() and sample() run on the sampling thread and may block.
+    start(), stop() and set_interval() run on the main loop.
+    """
+
+    name = None
+    label = None
+    priority = 100  # Lower values are probed first
+
+    def __init__(self, interval_ms, sysfs_root='/sys',
+                 metrics=CORE_METRICS):
+        self.interval_ms = interval_ms
+        self.sysfs_root = sysfs_root
+        # Names of the METRICS to sample, backends may return fewer
+        self.metrics = tuple(metrics)
+        # Queries that took too long, for the diagnostics
+        self.timeouts = 0
+
+    def probe(self):
+        """Return True if this backend works on this machine"""
+        return self.sample() is not None
+
+    def start(self):
+        """Start background resources after the backend was selected"""
+
+    def stop(self):
+        """Release background resources"""
+
+    def set_interval(self, interval_ms):
+        """Change the sampling interval"""
+        self.interval_ms = interval_ms
+
+    def set_metrics(self, metrics):
+        """Change the metrics to sample"""
+        self.metrics = tuple(metrics)
+
+    def sample(self):
+        """Return a list of device dicts, or None on failure
+
+        Each device dict has a string 'id' that stays the same between
+        samples, plus the fields of the core metrics ('usage', 'temp'
+        and 'memory') and of any other METRICS the backend knows. All
+        devices must come from one query.
+        """
+        raise NotImplementedError
+
+
+class StreamingBackend(GPUBackend):
+    """Backends reading the output of one long-lived child process
+
+    sampler_class is a StreamingProcess taking the interval and the
+    metrics, with a latest() method returning the newest device list or
+    None. The child is started once the backend is selected.
+    """
+
+    sampler_class = None
+
+    def __init__(self, interval_ms, **kwargs):
+        super().__init__(interval_ms, **kwargs)
+        self.sampler = self.sampler_class(interval_ms, self.metrics)
+        self.last_sample = None
+
+    def start(self):
+        self.sampler.start()
+
+    def stop(self):
+        self.sampler.stop()
+
+    def set_interval(self, interval_ms):
+        super().set_interval(interval_ms)
+        self.sampler.set_interval(interval_ms)
+
+    def set_metrics(self, metrics):
+        super().set_metrics(metrics)
+        self.sampler.metrics = self.metrics
+
+    def sample(self):
+        if not self.sampler.available:
+            return None
+        sample = self.sampler.latest()
+        if sample is None:
+            # The child is (re)starting, repeat the last value meanwhile
+            sample = self.last_sample
+            grace = self.sampler.restart_delay + 3 * self.interval_ms / 1000
+            if sample is None or time.time() - sample[0]['time'] > grace:
+                if sample is not None:
+                    self.timeouts += 1
+                return None
+        self.last_sample = sample
+        return sample
+
+
+@register_backend
+class NvidiaSmiBackend(StreamingBackend):
+    """NVIDIA GPUs through a streaming nvidia-smi"""
+
+    name = 'nvidia-smi'
+    label = 'NVIDIA (nvidia-smi)'
+    priority = 10
+    sampler_class = NvidiaSmiSampler
+
+    def probe(self):
+        try:
+            result = subprocess.run([
+                'nvidia-smi',
+                '--query-gpu=' + ','.join(self.sampler.fields),
+                '--format=csv,noheader,nounits'
+            ], capture_output=True, text=True, timeout=5)
+        except subprocess.TimeoutExpired:
+            self.timeouts += 1
+            return False
+        except (OSError, subprocess.SubprocessError):
+            return False
+        if result.returncode != 0:
+            return False
+        for line in result.stdout.splitlines():
+            self.sampler.handle_line(line.strip())
+        self.last_sample = self.sampler.latest()
+        return self.last_sample is not None
+
+    def set_metrics(self, metrics):
+        if tuple(metrics) == self.metrics:
+            return
+        super().set_metrics(metrics)
+        self.sampler.set_metrics(metrics)
+        if self.sampler.available:
+            self.sampler.restart()
+
+
+class SysfsBackend(GPUBackend):
+    """Backends re-reading sysfs files they keep open
+
+    find_files() returns the files to read of every card by card number.
+    The probe opens them all, and sample() re-reads them with read_value,
+    so a sample costs one read per file and no process.
+    """
+
+    def __init__(self, interval_ms, **kwargs):
+        super().__init__(interval_ms, **kwargs)
+        # Open file descriptors per card number and file
+        self.fds = {}
+
+    def find_files(self):
+        """Return {card number: {key: path}} of the supported cards"""
+        raise NotImplementedError
+
+    def probe(self):
+        cards = self.find_files()
+        if not cards:
+            return False
+        try:
+            for number in sorted(cards):
+                self.fds[str(number)] = {
+                    key: os.open(path, os.O_RDONLY)
+                    for key, path in cards[number].items()}
+        except OSError:
+            self.stop()
+            return False
+        if self.sample() is None:
+            # The manager drops failed backends without stopping them
+            self.stop()
+            return False
+        return True
+
+    def stop(self):
+        cards, self.fds = self.fds, {}
+        for fds in cards.values():
+            for fd in fds.values():
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def read_value(fds, key):
+        """Re-read an open sysfs file from the start"""
+        return int(os.pread(fds[key], 32, 0))
+
+
+@register_backend
+class AmdSysfsBackend(SysfsBackend):
+    """AMD GPUs through the amdgpu sysfs and hwmon files
+
+    The files stay open and are re-read with os.pread, so a sample costs
+    four reads, plus one or two per other metric shown, and no process.
+    """
+
+    name = 'amdgpu-sysfs'
+    label = 'AMD (amdgpu sysfs)'
+    priority = 30
+
+    # Optional hwmon files by metric, and the divisor giving the metric
+    HWMON_FILES = {
+        'power': ('power1_average', 1e6),  # Microwatts
+        'sm_clock': ('freq1_input', 1e6),  # Hz
+        'mem_clock': ('freq2_input', 1e6),
+        'fan': ('pwm1', 2.55),  # 0-255
+    }
+
+    def find_files(self):
+        """Return the metric files of every amdgpu card by card number"""
+        cards = {}
+        for number, card in drm_cards(self.sysfs_root).items():
+            device = os.path.join(card, 'device')
+            files = {
+                'busy': os.path.join(device, 'gpu_busy_percent'),
+                'vram_used': os.path.join(device, 'mem_info_vram_used'),
+                'vram_total': os.path.join(device, 'mem_info_vram_total'),
+            }
+            if not all(os.path.exists(path) for path in files.values()):
+                continue
+            # temp1 is the edge sensor, prefer it over junction and memory
+            temps = sorted(glob.glob(os.path.join(
+                device, 'hwmon', 'hwmon*', 'temp*_input')))
+            if temps:
+                files['temp'] = temps[0]
+            for key in ('gtt_used', 'gtt_total'):
+                path = os.path.join(device, 'mem_info_' + key)
+                if os.path.exists(path):
+                    files[key] = path
+            for hwmon in sorted(glob.glob(os.path.join(device, 'hwmon',
+                                                       'hwmon*')))[:1]:
+                for metric, (name, divisor) in self.HWMON_FILES.items():
+                    path = os.path.join(hwmon, name)
+                    if os.path.exists(path):
+                        files[metric] = path
+            cards[number] = files
+        return cards
+
+    def sample(self):
+        devices = []
+        try:
+            for card, fds in self.fds.items():
+                data = {'id': card, 'temp': None,
+                        'usage': float(self.read_value(fds, 'busy'))}
+                data['memory'] = round(self.read_value(fds, 'vram_used') /
+                                       self.read_value(fds, 'vram_total') *
+                                       100)
+                if 'temp' in fds:
+                    # hwmon reports millidegrees
+                    data['temp'] = self.read_value(fds, 'temp') / 1000
+                if 'gtt' in self.metrics and 'gtt_total' in fds:
+                    data['gtt'] = round(self.read_value(fds, 'gtt_used') /
+                                        self.read_value(fds, 'gtt_total') *
+                                        100)
+                for metric in self.metrics:
+                    if metric in self.HWMON_FILES and metric in fds:
+                        data[METRICS[metric]['field']] = round(
+                            self.read_value(fds, metric) /
+                            self.HWMON_FILES[metric][1], 1)
+                devices.append(data)
+        except (OSError, KeyError, ValueError, ZeroDivisionError):
+            return None
+        return devices or None
+
+
+@register_backend
+class RadeontopBackend(StreamingBackend):
+    """AMD GPUs through a radeontop dumping continuously"""
+
+    name = 'radeontop'
+    label = 'AMD (radeontop)'
+    priority = 50
+    sampler_class = RadeontopSampler
+
+    def probe(self):
+        try:
+            result = subprocess.run(['radeontop', '-d', '-', '-l', '1'],
+                                    capture_output=True, text=True,
+                                    timeout=5)
+        except subprocess.TimeoutExpired:
+            self.timeouts += 1
+            return False
+        except (OSError, subprocess.SubprocessError):
+            return False
+        if result.returncode != 0:
+            return False
+        for line in result.stdout.splitlines():
+            self.sampler.handle_line(line.strip())
+        self.last_sample = self.sampler.latest()
+        return self.last_sample is not None
+
+
+@register_backend
+class IntelGpuTopBackend(StreamingBackend):
+    """Intel GPUs through a streaming intel_gpu_top -J
+
+    intel_gpu_top needs CAP_PERFMON or a low kernel.perf_event_paranoid.
+    Where it is not permitted it exits at once, the probe fails and
+    IntelSysfsBackend is tried next.
+    """
+
+    name = 'intel_gpu_top'
+    label = 'Intel (intel_gpu_top)'
+    priority = 40
+
+    sampler_class = IntelGpuTopSampler
+
+    probe_interval_ms = 100  # Report period of the probe
+    probe_timeout = 5  # Seconds to wait for the first report
+
+    def probe(self):
+        """Read the first report of a short-lived intel_gpu_top"""
+        try:
+            process = subprocess.Popen(
+                self.sampler.build_command(self.probe_interval_ms),
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, text=True)
+        except OSError:
+            return False
+        # The pipe is read blocking, a hung child is killed instead
+        deadline = time.monotonic() + self.probe_timeout
+        timer = threading.Timer(self.probe_timeout, process.kill)
+        timer.start()
+        parser = JSONStreamParser()
+        sample = None
+        try:
+            for line in process.stdout:
+                for report in parser.feed(line):
+                    sample = sample or self.sampler.parse_report(
+                        report, self.metrics)
+                if sample is not None:
+                    break
+        finally:
+            timer.cancel()
+            process.kill()
+            process.wait()
+            process.stdout.close()
+        if sample is None:
+            if time.monotonic() >= deadline:
+                self.timeouts += 1
+            return False
+        self.last_sample = [sample]
+        return True
+
+
+@register_backend
+class IntelSysfsBackend(SysfsBackend):
+    """Intel GPUs through the i915 and xe sysfs files
+
+    Needs no privileges, but sysfs has no busy percentage: the load is
+    the share of time the GPU spent out of its idle (RC6) state since
+    the previous sample, and the clock is the actual GT frequency.
+    """
+
+    name = 'intel-sysfs'
+    label = 'Intel (i915/xe sysfs)'
+    priority = 60
+
+    # Idle residency in ms and actual frequency in MHz, relative to the
+    # card directory, by driver
+    DRIVER_FILES = {
+        'i915': {'idle': 'power/rc6_residency_ms',
+                 'sm_clock': 'gt_act_freq_mhz'},
+        'xe': {'idle': 'device/tile0/gt0/gtidle/idle_residency_ms',
+               'sm_clock': 'device/tile0/gt0/freq0/act_freq'},
+    }
+
+    def __init__(self, interval_ms, **kwargs):
+        super().__init__(interval_ms, **kwargs)
+        # Idle residency and time of the previous sample per card number
+        self.previous = {}
+
+    def find_files(self):
+        """Return the files of every i915 or xe card by card number"""
+        cards = {}
+        for number, card in drm_cards(self.sysfs_root).items():
+            driver = os.path.basename(os.path.realpath(
+                os.path.join(card, 'device', 'driver')))
+            if driver not in self.DRIVER_FILES:
+                continue
+            files = {key: os.path.join(card, path) for key, path
+                     in self.DRIVER_FILES[driver].items()}
+            if all(os.path.exists(path) for path in files.values()):
+                cards[number] = files
+        return cards
+
+    def stop(self):
+        super().stop()
+        self.previous = {}
+
+    def sample(self):
+        devices = []
+        try:
+            for card, fds in self.fds.items():
+                now = time.monotonic()
+                idle = self.read_value(fds, 'idle')
+                # Usage needs two samples
+                usage = None
+                before = self.previous.get(card)
+                if before is not None and now > before[1]:
+                    idle_share = (idle - before[0]) / 1000 / (now - before[1])
+                    usage = round(min(max(100 * (1 - idle_share), 0.0),
+                                      100.0), 1)
+                self.previous[card] = (idle, now)
+                data = {'id': card, 'usage': usage, 'temp': None,
+                        'memory': None}
+                if 'sm_clock' in self.metrics:
+                    data['sm_clock'] = float(self.read_value(fds, 'sm_clock'))
+                devices.append(data)
+        except (OSError, KeyError, ValueError):
+            return None
+        return devices or None
+
+
+class Diagnostics:
+    """Counters and timings of the applet's own work
+
+    Timings are kept per group ('sample', 'draw', 'timer', 'startup') and
+    name, counters per group ('failures', 'timeouts') and name. Both may
+    be recorded from any thread.
+    """
+
+    recent = 256  # Timings kept per name for the percentiles
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.cpu_started = self.cpu_time()
+        self.timings = {}
+        self.counters = {}
+
+    @staticmethod
+    def cpu_time():
+        """Return the user and system CPU time of the process"""
+        times = os.times()
+        return times.user + times.system
+
+    @staticmethod
+    def rss():
+        """Return the resident set size in bytes, or None"""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def record(self, group, name, seconds):
+        """Add a timing in seconds"""
+        with self.lock:
+            timing = self.timings.setdefault(group, {}).get(name)
+            if timing is None:
+                timing = self.timings[group][name] = {
+                    'count': 0, 'total': 0.0, 'max': 0.0,
+                    'recent': deque(maxlen=self.recent)}
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+            timing['recent'].append(seconds)
+
+    def count(self, group, name, amount=1):
+        """Add to a counter"""
+        with self.lock:
+            counters = self.counters.setdefault(group, {})
+            counters[name] = counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """Return all counters and timings as plain data, times in ms"""
+        uptime = time.monotonic() - self.started
+        cpu = self.cpu_time() - self.cpu_started
+        with self.lock:
+            timings = {}
+            for group, names in self.timings.items():
+                timings[group] = {}
+                for name, timing in names.items():
+                    recent = sorted(timing['recent'])
+                    p95 = recent[min(len(recent) - 1,
+                                     int(len(recent) * 0.95))]
+                    timings[group][name] = {
+                        'count': timing['count'],
+                        'last_ms': timing['recent'][-1] * 1000,
+                        'mean_ms': timing['total'] / timing['count'] * 1000,
+                        'p95_ms': p95 * 1000,
+                        'max_ms': timing['max'] * 1000,
+                    }
+            counters = {group: dict(names)
+                        for group, names in self.counters.items()}
+        return {
+            'time': time.time(),
+            'uptime_s': uptime,
+            'cpu_time_s': cpu,
+            'cpu_percent': cpu / uptime * 100 if uptime else 0.0,
+            'rss_bytes': self.rss(),
+            'timings': timings,
+            'counters': counters,
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def describe(self):
+        """Return a human readable summary"""
+        snapshot = self.snapshot()
+        lines = [f"CPU time: {snapshot['cpu_time_s']:.2f} s "
+                 f"({snapshot['cpu_percent']:.2f}% over "
+                 f"{snapshot['uptime_s']:.0f} s)"]
+        if snapshot['rss_bytes'] is not None:
+            lines.append(f"Memory (RSS): "
+                         f"{snapshot['rss_bytes'] / 1048576:.1f} MiB")
+        for group, names in sorted(snapshot['timings'].items()):
+            lines.append("")
+            for name, timing in sorted(names.items()):
+                lines.append(f"{group} {name}: {timing['count']} times, "
+                             f"mean {timing['mean_ms']:.2f} ms, "
+                             f"p95 {timing['p95_ms']:.2f} ms, "
+                             f"max {timing['max_ms']:.2f} ms")
+        if snapshot['counters']:
+            lines.append("")
+        for group, names in sorted(snapshot['counters'].items()):
+            for name, value in sorted(names.items()):
+                lines.append(f"{group} {name}: {value}")
+        return "\n".join(lines)
+
+
+class ProcessMonitor:
+    """Finds the processes using the GPUs, on a slow schedule of its own
+
+    Runs on its own thread every interval seconds and keeps the result,
+    so the sampling tick never pays for it. NVIDIA processes come from
+    nvidia-smi pmon (utilization and memory), or from --query-compute-apps
+    (memory only) where pmon is not supported. AMD processes come from
+    the DRM fdinfo of their render nodes, utilization being the engine
+    time used between two scans.
+    """
+
+    top = 5  # Processes kept, by utilization then memory
+
+    def __init__(self, interval, on_update, sysfs_root='/sys',
+                 proc_root='/proc'):
+        self.interval = interval
+        self.on_update = on_update
+        self.sysfs_root = sysfs_root
+        self.proc_root = proc_root
+        self.processes = []
+        self.names = {}  # Process name by pid
+        self.engine_times = {}  # (pid, client id): (engine ns, time)
+        self.nvidia_uuids = None  # GPU index by UUID
+        self.has_nvidia_smi = True
+        self.use_pmon = True
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='gpu-processes',
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def run(self):
+        """Thread body: scan, publish and wait"""
+        while not self.stopped:
+            processes = []
+            for scan in (self.scan_nvidia, self.scan_amdgpu):
+                try:
+                    processes += scan()
+                except Exception:
+                    pass
+            processes.sort(key=lambda process: (process['usage'] or 0,
+                                                process['memory_mib'] or 0),
+                           reverse=True)
+            self.prune_names(processes)
+            self.processes = processes[:self.top]
+            GLib.idle_add(self.deliver)
+            self.wakeup.wait(self.interval)
+
+    def deliver(self):
+        if not self.stopped:
+            self.on_update(self.processes)
+        return False
+
+    def name(self, pid):
+        """Return the command name of a pid, cached"""
+        name = self.names.get(pid)
+        if name is None:
+            try:
+                path = os.path.join(self.proc_root, str(pid), 'comm')
+                with open(path) as f:
+                    name = f.read().strip()
+            except OSError:
+                name = '?'
+            self.names[pid] = name
+        return name
+
+    def prune_names(self, processes):
+        """Forget the names of pids that went away"""
+        alive = {process['pid'] for process in processes}
+        for pid in list(self.names):
+            if pid not in alive:
+                del self.names[pid]
+
+    @staticmethod
+    def nvidia_smi(*args):
+        result = subprocess.run(('nvidia-smi',) + args, capture_output=True,
+                                text=True, timeout=10)
+        if result.returncode != 0:
+            raise OSError(result.stderr.strip())
+        return result.stdout
+
+    def scan_nvidia(self):
+        """Return the NVIDIA GPU processes"""
+        if not self.has_nvidia_smi:
+            return []
+        try:
+            return self.scan_nvidia_smi()
+        except FileNotFoundError:
+            # No NVIDIA driver here, do not spawn it on every scan
+            self.has_nvidia_smi = False
+            return []
+
+    def scan_nvidia_smi(self):
+        """Return the NVIDIA GPU processes from nvidia-smi"""
+        if self.use_pmon:
+            try:
+                return self.scan_pmon()
+            except (OSError, subprocess.SubprocessError, ValueError):
+                # Not supported on every GPU, fall back for good
+                self.use_pmon = False
+
+        if self.nvidia_uuids is None:
+            self.nvidia_uuids = {}
+            for line in self.nvidia_smi('--query-gpu=index,uuid',
+                                        '--format=csv,noheader').splitlines():
+                index, uuid = [part.strip() for part in line.split(',')]
+                self.nvidia_uuids[uuid] = index
+        processes = []
+        for line in self.nvidia_smi(
+                '--query-compute-apps=gpu_uuid,pid,used_memory',
+                '--format=csv,noheader,nounits').splitlines():
+            try:
+                uuid, pid, memory = [part.strip()
+                                     for part in line.split(',')]
+                pid = int(pid)
+                memory = float(memory)
+            except ValueError:
+                continue
+            processes.append({'pid': pid, 'name': self.name(pid),
+                              'gpu': self.nvidia_uuids.get(uuid, '?'),
+                              'usage': None, 'memory_mib': memory})
+        return processes
+
+    def scan_pmon(self):
+        """Return the NVIDIA GPU processes from one pmon sample"""
+        columns = None
+        processes = {}
+        for line in self.nvidia_smi('pmon', '-c', '1',
+                                    '-s', 'um').splitlines():
+            if line.startswith('#'):
+                if columns is None:
+                    columns = line.lstrip('#').split()
+                continue
+            fields = line.split()
+            if columns is None or len(fields) < len(columns) - 1:
+                continue
+            row = dict(zip(columns, fields))
+            if row.get('pid', '-') == '-':
+                continue
+            pid = int(row['pid'])
+            usage = row.get('sm', '-')
+            memory = row.get('fb', '-')
+            key = (pid, row['gpu'])
+            name = self.name(pid)
+            if name == '?':
+                name = row.get('command', name)
+            process = processes.setdefault(key, {
+                'pid': pid, 'name': name, 'gpu': row['gpu'],
+                'usage': None, 'memory_mib': None})
+            if usage != '-':
+                process['usage'] = float(usage)
+            if memory != '-':
+                process['memory_mib'] = float(memory)
+        if columns is None:
+            raise ValueError("no pmon header")
+        return list(processes.values())
+
+    def amdgpu_cards(self):
+        """Return the card number of every amdgpu PCI address"""
+        cards = {}
+        for number, card in drm_cards(self.sysfs_root).items():
+            driver = os.path.basename(os.path.realpath(
+                os.path.join(card, 'device', 'driver')))
+            if driver != 'amdgpu':
+                continue
+            address = os.path.basename(
+                os.path.realpath(os.path.join(card, 'device')))
+            cards[address] = str(number)
+        return cards
+
+    def scan_amdgpu(self):
+        """Return the amdgpu processes from their DRM fdinfo"""
+        # Only walk the descriptors of every process with an amdgpu card
+        cards = self.amdgpu_cards()
+        if not cards:
+            return []
+        now = time.monotonic()
+        clients = {}
+        for pid_dir in glob.glob(os.path.join(self.proc_root, '[0-9]*')):
+            pid = int(os.path.basename(pid_dir))
+            try:
+                fds = os.listdir(os.path.join(pid_dir, 'fd'))
+            except OSError:
+                continue  # Gone, or not ours
+            for fd in fds:
+                try:
+                    target = os.readlink(os.path.join(pid_dir, 'fd', fd))
+                    if not target.startswith('/dev/dri/'):
+                        continue
+                    with open(os.path.join(pid_dir, 'fdinfo', fd)) as f:
+                        info = dict(line.split(':', 1)
+                                    for line in f if ':' in line)
+                except OSError:
+                    continue
+                info = {key: value.strip() for key, value in info.items()}
+                if info.get('drm-driver') != 'amdgpu':
+                    continue
+                # Several descriptors may share one DRM client
+                key = (pid, info.get('drm-client-id', fd))
+                if key in clients:
+                    continue
+                try:
+                    # Busy time in ns per engine, skipping the
+                    # drm-engine-capacity-* engine counts
+                    engine = sum(int(value.split()[0])
+                                 for name, value in info.items()
+                                 if name.startswith('drm-engine-') and
+                                 not name.startswith('drm-engine-capacity'))
+                    vram = int(info.get('drm-memory-vram', '0').split()[0])
+                except (ValueError, IndexError):
+                    continue
+                clients[key] = {
+                    'pid': pid, 'name': self.name(pid),
+                    'gpu': cards.get(info.get('drm-pdev'), '?'),
+                    'usage': None,
+                    'memory_mib': vram / 1024,
+                    'engine': engine,
+                }
+
+        engine_times = {}
+        processes = []
+        for key, client in clients.items():
+            engine = client.pop('engine')
+            engine_times[key] = (engine, now)
+            previous = self.engine_times.get(key)
+            if previous and now > previous[1]:
+                client['usage'] = min(100.0, round(
+                    (engine - previous[0]) / 1e9 / (now - previous[1]) *
+                    100, 1))
+            processes.append(client)
+        self.engine_times = engine_times
+        return processes
+
+
+class BackendManager:
+    """Selects a working backend once and sticks with it
+
+    Backends are probed in priority order on the first sample. The
+    selected backend is dropped only after several failed samples in a
+    row, and probing is then retried with exponential backoff.
+    """
+
+    max_failures = 3
+    min_backoff = 2  # Seconds
+    max_backoff = 300
+
+    def __init__(self, interval_ms, backend_classes=None, sysfs_root='/sys',
+                 diagnostics=None, metrics=None):
+        self.interval_ms = interval_ms
+        self.sysfs_root = sysfs_root
+        self.metrics = tuple(METRICS) if metrics is None else tuple(metrics)
+        self.diagnostics = (Diagnostics() if diagnostics is None
+                            else diagnostics)
+        self.backend_classes = (BACKENDS if backend_classes is None
+                                else backend_classes)
+        self.backend = None
+        self.failures = 0
+        self.backoff = self.min_backoff
+        self.next_probe = 0
+        self.probed = False
+        # Probe duration in seconds and outcome per backend name
+        self.probe_results = {}
+        self.status_lock = threading.Lock()
+
+    def probe(self):
+        """Try backends in priority order and keep the first that works"""
+        results = {}
+        selected = None
+        for cls in self.backend_classes:
+            backend = cls(self.interval_ms, sysfs_root=self.sysfs_root,
+                          metrics=self.metrics)
+            start = time.monotonic()
+            try:
+                ok = backend.probe()
+            except Exception:
+                ok = False
+            results[cls.name] = (time.monotonic() - start, ok)
+            if backend.timeouts:
+                self.diagnostics.count('timeouts', cls.name,
+                                       backend.timeouts)
+            if ok:
+                selected = backend
+                break
+
+        with self.status_lock:
+            self.probed = True
+            self.probe_results = results
+            self.backend = selected
+        self.failures = 0
+        if selected is None:
+            self.schedule_probe()
+        else:
+            self.backoff = self.min_backoff
+            call_on_main(selected.start)
+        return selected
+
+    def schedule_probe(self):
+        """Delay the next probe, doubling the delay each time"""
+        self.next_probe = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def sample(self):
+        """Return a sample from the selected backend, or None"""
+        backend = self.backend
+        if backend is None:
+            if time.monotonic() < self.next_probe:
+                return None
+            backend = self.probe()
+            if backend is None:
+                return None
+
+        timeouts = backend.timeouts
+        start = time.perf_counter()
+        try:
+            data = backend.sample()
+        except Exception:
+            data = None
+        self.diagnostics.record('sample', backend.name,
+                                time.perf_counter() - start)
+        if backend.timeouts != timeouts:
+            self.diagnostics.count('timeouts', backend.name,
+                                   backend.timeouts - timeouts)
+
+        if data is not None:
+            self.failures = 0
+            return data
+
+        self.diagnostics.count('failures', backend.name)
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            with self.status_lock:
+                self.backend = None
+            call_on_main(backend.stop)
+            self.schedule_probe()
+        return None
+
+    def set_interval(self, interval_ms):
+        """Change the sampling interval of the current and future backends"""
+        self.interval_ms = interval_ms
+        backend = self.backend
+        if backend is not None:
+            backend.set_interval(interval_ms)
+
+    def set_metrics(self, metrics):
+        """Change the metrics of the current and future backends"""
+        self.metrics = tuple(metrics)
+        backend = self.backend
+        if backend is not None:
+            backend.set_metrics(self.metrics)
+
+    def stop(self):
+        """Stop the selected backend"""
+        backend = self.backend
+        if backend is not None:
+            backend.stop()
+
+    def reset(self):
+        """Stop the selected backend and probe again on the next sample"""
+        self.stop()
+        with self.status_lock:
+            self.backend = None
+            self.probed = False
+        self.next_probe = 0
+        self.backoff = self.min_backoff
+
+    def describe(self):
+        """Return a human readable summary of backend selection"""
+        with self.status_lock:
+            if not self.probed:
+                return "Backend: detecting..."
+            backend = self.backend
+            results = dict(self.probe_results)
+
+        lines = [f"Backend: {backend.label if backend else 'none'}"]
+        for name, (duration, ok) in results.items():
+            status = "ok" if ok else "failed"
+            lines.append(f"  probe {name}: {duration * 1000:.0f} ms, "
+                         f"{status}")
+        return "\n".join(lines)
+
+
+class AdaptivePoller:
+    """Picks the polling interval from GPU activity and visibility
+
+    Polls at the base interval while the metrics move, doubles the
+    interval after every calm_samples steady samples while all GPUs are
+    idle, and drops to the minimum interval for a while as soon as
+    utilization or temperature jumps. Polls at the maximum interval while
+    nothing is on screen.
+    """
+
+    usage_jump = 15  # Utilization change in points that counts as sharp
+    temp_jump = 5  # Temperature change in degrees that counts as sharp
+    idle_usage = 10  # Utilization below which a GPU counts as idle
+    calm_samples = 5  # Steady idle samples before each back off step
+    fast_samples = 5  # Samples kept at the minimum after a jump
+
+    def __init__(self, base, minimum, maximum):
+        self.previous = {}
+        self.configure(base, minimum, maximum)
+
+    def configure(self, base, minimum, maximum):
+        """Set the bounds in seconds and return to the base interval"""
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.base = min(max(base, self.minimum), self.maximum)
+        self.interval = self.base
+        self.reason = "active"
+        self.calm = 0
+        self.fast = 0
+
+    def changed_sharply(self, devices):
+        """Return True if any GPU jumped since the previous sample"""
+        jumped = False
+        for device in devices:
+            before = self.previous.get(device['id'])
+            if before is not None:
+                for field, limit in (('usage', self.usage_jump),
+                                     ('temp', self.temp_jump)):
+                    if (device[field] is not None and
+                            before[field] is not None and
+                            abs(device[field] - before[field]) >= limit):
+                        jumped = True
+            self.previous[device['id']] = {'usage': device['usage'],
+                                           'temp': device['temp']}
+        return jumped
+
+    def update(self, devices, visible):
+        """Return the interval in seconds until the next sample"""
+        jumped = self.changed_sharply(devices)
+        if not visible:
+            self.interval = self.maximum
+            self.reason = "hidden"
+            self.calm = 0
+            return self.interval
+
+        if jumped:
+            self.fast = self.fast_samples
+            self.calm = 0
+            self.interval = self.minimum
+            self.reason = "changing"
+        elif self.fast > 0:
+            self.fast -= 1
+            if not self.fast:
+                self.interval = self.base
+                self.reason = "active"
+        elif devices and all(device['usage'] is not None and
+                             device['usage'] < self.idle_usage
+                             for device in devices):
+            self.calm += 1
+            if self.interval < self.base:
+                self.interval = self.base
+            if self.calm >= self.calm_samples:
+                self.calm = 0
+                self.interval = min(self.interval * 2, self.maximum)
+                self.reason = "idle"
+        else:
+            self.calm = 0
+            self.interval = self.base
+            self.reason = "active"
+        return self.interval
+
+    def wake(self):
+        """Return to the base interval, e.g. when shown again"""
+        self.interval = self.base
+        self.reason = "active"
+        self.calm = 0
+        self.fast = 0
+
+
+class ThrottleDetector:
+    """Flags throttling in the sample stream, with hysteresis
+
+    A reason of THROTTLE_REASONS becomes an event once `enter` samples
+    in a row have it, and the event ends once `leave` samples in a row
+    do not, so a single sample neither starts nor ends one. The event
+    spans from the first to the last sample that had the reason. Events
+    are logged with the lowest SM clock seen while they lasted.
+    """
+
+    enter = 2
+    leave = 3
+
+    def __init__(self, size=100):
+        self.log = deque(maxlen=size)
+        # Ongoing events by (device id, reason)
+        self.active = {}
+        # Samples in a row against the current state, and the time of
+        # the first of them, by (device id, reason)
+        self.pending = {}
+        # Time of the previous sample by device id
+        self.last_time = {}
+
+    def update(self, devices, timestamp):
+        """Feed a sample, return the events that started or ended"""
+        changed = []
+        for device in devices:
+            bits = device.get('throttle')
+            if bits is None:
+                continue
+            device_id = device['id']
+            for reason, config in THROTTLE_REASONS.items():
+                key = (device_id, reason)
+                event = self.active.get(key)
+                throttled = bool(bits & config['mask'])
+                if throttled == (event is not None):
+                    self.pending.pop(key, None)
+                    if event is not None:
+                        self.track(event, device, timestamp)
+                    continue
+
+                count, since = self.pending.get(key, (0, timestamp))
+                if throttled:
+                    count += 1
+                    if count < self.enter:
+                        self.pending[key] = (count, since)
+                        continue
+                    event = {'device': device_id, 'reason': reason,
+                             'start': since, 'end': None, 'last': since,
+                             'clock': None, 'clock_max': None}
+                    self.track(event, device, timestamp)
+                    self.active[key] = event
+                    self.log.append(event)
+                else:
+                    if key not in self.pending:
+                        # The event lasted until the previous sample
+                        since = self.last_time.get(device_id, timestamp)
+                    count += 1
+                    if count < self.leave:
+                        self.pending[key] = (count, since)
+                        continue
+                    event = self.active.pop(key)
+                    event['end'] = since
+                self.pending.pop(key, None)
+                changed.append(event)
+            self.last_time[device_id] = timestamp
+        return changed
+
+    @staticmethod
+    def track(event, device, timestamp):
+        """Follow an ongoing event"""
+        event['last'] = timestamp
+        clock = device.get('sm_clock')
+        if clock is not None and (event['clock'] is None or
+                                  clock < event['clock']):
+            event['clock'] = clock
+        if device.get('max_sm_clock') is not None:
+            event['clock_max'] = device['max_sm_clock']
+
+    def reasons(self, device_ids=None):
+        """Return the ongoing reasons of some devices, or of any device"""
+        return [reason for (event_device, reason) in self.active
+                if device_ids is None or event_device in device_ids]
+
+    def events(self, start, end, device_ids=None):
+        """Return the logged events overlapping a time range"""
+        return [event for event in self.log
+                if (device_ids is None or event['device'] in device_ids) and
+                event['start'] <= end and
+                (event['end'] is None or event['end'] >= start)]
+
+    @staticmethod
+    def describe(event):
+        """Return one line about an event"""
+        end = event['last'] if event['end'] is None else event['end']
+        line = (f"GPU{event['device']} "
+                f"{THROTTLE_REASONS[event['reason']]['label']} "
+                f"{time.strftime('%H:%M:%S', time.localtime(event['start']))}"
+                f", {end - event['start']:.0f} s")
+        if event['end'] is None:
+            line += " so far"
+        if event['clock'] is not None:
+            line += f", SM clock down to {event['clock']:.0f}"
+            if event['clock_max']:
+                line += f" of {event['clock_max']:.0f}"
+            line += " MHz"
+        return line
+
+
+class BurstAggregator:
+    """Collects fast samples and sums them up once per display interval
+
+    Utilization is reported as the mean of the interval, plus its 95th
+    percentile and peak in 'usage_p95' and 'usage_peak'. The other
+    metrics are averaged, throttle reasons combined. Samples may be added
+    from any thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, devices):
+        """Add one sample of every device"""
+        with self.lock:
+            for device in devices:
+                rows = self.samples.setdefault(device['id'], [])
+                # Streaming backends repeat a sample until the next one
+                if (rows and 'time' in device and
+                        rows[-1].get('time') == device['time']):
+                    continue
+                rows.append(device)
+
+    def collect(self):
+        """Return the aggregated devices and start a new interval"""
+        with self.lock:
+            samples, self.samples = self.samples, {}
+        devices = []
+        for device_id, rows in samples.items():
+            device = {'id': device_id, 'samples': len(rows)}
+            for field in METRIC_FIELDS.values():
+                values = [row.get(field) for row in rows
+                          if row.get(field) is not None]
+                device[field] = (round(sum(values) / len(values), 1)
+                                 if values else None)
+            # Memory is a whole percentage like in single samples
+            if device['memory'] is not None:
+                device['memory'] = round(device['memory'])
+            # Throttling anywhere in the interval counts
+            for row in rows:
+                if row.get('throttle') is not None:
+                    device['throttle'] = (device.get('throttle', 0) |
+                                          row['throttle'])
+                if row.get('max_sm_clock') is not None:
+                    device['max_sm_clock'] = row['max_sm_clock']
+            usage = sorted(row['usage'] for row in rows
+                           if row['usage'] is not None)
+            if usage:
+                device['usage_p95'] = usage[min(len(usage) - 1,
+                                                int(len(usage) * 0.95))]
+                device['usage_peak'] = usage[-1]
+            devices.append(device)
+        return devices or None
+
+
+class BurstSampler:
+    """Samples on a background thread at a sub-second interval
+
+    Samples go into a BurstAggregator for the main loop to collect once
+    per display interval, so the main loop does not wake up for each.
+    """
+
+    def __init__(self, sample_func, interval_ms):
+        self.sample_func = sample_func
+        self.interval_ms = interval_ms
+        self.aggregator = BurstAggregator()
+        self.running = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='gpu-burst',
+                                       daemon=True)
+        self.running.set()
+        self.thread.start()
+
+    def set_interval(self, interval_ms):
+        self.interval_ms = interval_ms
+
+    def pause(self):
+        """Stop sampling until resumed, e.g. while samples are pushed"""
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def stop(self):
+        """Let the thread finish after the current sample"""
+        self.stopped = True
+        self.running.set()
+
+    def run(self):
+        """Thread body: sample at the interval while running"""
+        deadline = time.monotonic()
+        while True:
+            self.running.wait()
+            if self.stopped:
+                return
+            try:
+                devices = self.sample_func()
+            except Exception:
+                devices = None
+            if devices:
+                self.aggregator.add(devices)
+            # Keep the rate steady however long sampling took
+            deadline = max(deadline + self.interval_ms / 1000,
+                           time.monotonic())
+            time.sleep(deadline - time.monotonic())
+
+
+class SamplingWorker:
+    """Runs a blocking sampling function on a background thread
+
+    Results are handed back to the GTK main loop with GLib.idle_add, so
+    on_result always runs on the main thread.
+    """
+
+    def __init__(self, sample_func, on_result):
+        self.sample_func = sample_func
+        self.on_result = on_result
+        self.requests = queue.Queue()
+        self.busy = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='gpu-sampler',
+                                       daemon=True)
+        self.thread.start()
+
+    def request(self):
+        """Ask for a new sample unless the previous one is still running"""
+        if self.busy or self.stopped:
+            return False
+        self.busy = True
+        self.requests.put(True)
+        return True
+
+    def stop(self):
+        """Let the thread finish after the current sample"""
+        self.stopped = True
+        self.requests.put(None)
+
+    def run(self):
+        """Thread body: take a sample for every request"""
+        while self.requests.get() is not None:
+            try:
+                data = self.sample_func()
+            except Exception:
+                data = None
+            GLib.idle_add(self.deliver, data)
+
+    def deliver(self, data):
+        """Pass a sample to the main loop callback"""
+        self.busy = False
+        if data is not None and not self.stopped:
+            self.on_result(data)
+        return False
+
+
+class RenderScheduler:
+    """Redraws widgets at most once per frame, and only when needed
+
+    Widgets marked dirty are redrawn together on the next tick of the
+    frame clock, so several changes within one frame cost one redraw.
+    Widgets that cannot be seen are skipped, GTK draws them anyway once
+    they are mapped again, and texts are only set when they change.
+    Redraws done and avoided are counted in the diagnostics.
+    """
+
+    def __init__(self, diagnostics):
+        self.diagnostics = diagnostics
+        # Dirty widgets in the order they were marked
+        self.dirty = {}
+        # Widget whose frame clock runs the pending flush, and its id
+        self.tick_widget = None
+        self.tick_id = None
+
+    def invalidate(self, widget):
+        """Mark a widget to be redrawn on the next frame"""
+        if not widget.is_drawable():
+            self.diagnostics.count('redraws', 'skipped hidden')
+            return
+        if widget in self.dirty:
+            self.diagnostics.count('redraws', 'merged')
+            return
+        self.dirty[widget] = True
+
+        # A frame clock only ticks while its widget is mapped
+        if self.tick_id is not None and not self.tick_widget.is_drawable():
+            self.cancel_tick()
+        if self.tick_id is None:
+            self.tick_widget = widget
+            self.tick_id = widget.add_tick_callback(self.on_tick)
+
+    def cancel_tick(self):
+        """Remove the pending flush, the dirty widgets stay dirty"""
+        if self.tick_id is not None:
+            self.tick_widget.remove_tick_callback(self.tick_id)
+        self.tick_widget = None
+        self.tick_id = None
+
+    def on_tick(self, widget, frame_clock):
+        """Redraw everything marked dirty since the last frame"""
+        self.tick_widget = None
+        self.tick_id = None
+        dirty, self.dirty = self.dirty, {}
+        for widget in dirty:
+            widget.queue_draw()
+        self.diagnostics.count('redraws', 'queued', len(dirty))
+        return False
+
+    def set_text(self, label, text):
+        """Set the text of a label if it changed"""
+        if label.get_text() == text:
+            self.diagnostics.count('redraws', 'unchanged text')
+            return
+        label.set_text(text)
+
+    def describe(self):
+        """Return a line with the redraws done and avoided"""
+        with self.diagnostics.lock:
+            counters = dict(self.diagnostics.counters.get('redraws', {}))
+        queued = counters.pop('queued', 0)
+        return (f"Redraws: {queued} done, {sum(counters.values())} "
+                f"avoided")
+
+
+class MetricsServer:
+    """Serves the latest sample in OpenMetrics text format over HTTP
+
+    The server runs on its own thread and only reads the sample last
+    handed over with publish(), so a scrape never queries the GPUs and
+    never waits for the main loop.
+    """
+
+    content_type = 'application/openmetrics-text; version=1.0.0; ' \
+        'charset=utf-8'
+
+    # Metric name, help text and sample field of the per GPU gauges
+    GAUGES = tuple(
+        metric['openmetrics'] + (metric['field'],)
+        for metric in METRICS.values()) + (
+        ('gpu_utilization_peak_percent',
+         "Peak GPU utilization of the update interval", 'usage_peak'),
+    )
+
+    def __init__(self, port, diagnostics, host='127.0.0.1'):
+        self.diagnostics = diagnostics
+        self.devices = []
+        self.sample_time = None
+        self.samples = 0
+
+        # Imported here, it takes longer than the rest of the applet
+        import http.server
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = server.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', server.content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep scrapes out of the session log
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name='gpu-metrics', daemon=True)
+        self.thread.start()
+
+    def publish(self, devices):
+        """Hand over the latest sample, called on the main loop"""
+        # Replaced as a whole, so scrapes see one sample or the other
+        self.devices = [dict(device) for device in devices]
+        self.sample_time = time.time()
+        self.samples += 1
+
+    @staticmethod
+    def label(value):
+        """Escape a label value"""
+        return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+                .replace('\n', '\\n'))
+
+    def render(self):
+        """Return the exposition text"""
+        devices = self.devices
+        lines = []
+        for name, help_text, field in self.GAUGES:
+            values = [(device['id'], device.get(field)) for device in devices
+                      if device.get(field) is not None]
+            if not values:
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"# HELP {name} {help_text}.")
+            for device_id, value in values:
+                lines.append(f'{name}{{gpu="{self.label(device_id)}"}} '
+                             f'{value}')
+
+        if self.sample_time is not None:
+            lines.append("# TYPE gpu_applet_last_sample_timestamp_seconds "
+                         "gauge")
+            lines.append("gpu_applet_last_sample_timestamp_seconds "
+                         f"{self.sample_time:.3f}")
+        lines.append("# TYPE gpu_applet_samples counter")
+        lines.append(f"gpu_applet_samples_total {self.samples}")
+
+        snapshot = self.diagnostics.snapshot()
+        lines.append("# TYPE gpu_applet_cpu_seconds counter")
+        lines.append(f"gpu_applet_cpu_seconds_total "
+                     f"{snapshot['cpu_time_s']:.3f}")
+        if snapshot['rss_bytes'] is not None:
+            lines.append("# TYPE gpu_applet_resident_memory_bytes gauge")
+            lines.append(f"gpu_applet_resident_memory_bytes "
+                         f"{snapshot['rss_bytes']}")
+
+        samples = snapshot['timings'].get('sample', {})
+        if samples:
+            lines.append("# TYPE gpu_applet_sample_duration_seconds summary")
+            for backend, timing in sorted(samples.items()):
+                label = f'backend="{self.label(backend)}"'
+                lines.append(
+                    f'gpu_applet_sample_duration_seconds{{{label},'
+                    f'quantile="0.95"}} {timing["p95_ms"] / 1000:.6f}')
+                lines.append(
+                    f'gpu_applet_sample_duration_seconds_sum{{{label}}} '
+                    f'{timing["mean_ms"] * timing["count"] / 1000:.6f}')
+                lines.append(
+                    f'gpu_applet_sample_duration_seconds_count{{{label}}} '
+                    f'{timing["count"]}')
+        for group in ('failures', 'timeouts'):
+            counters = snapshot['counters'].get(group, {})
+            if not counters:
+                continue
+            lines.append(f"# TYPE gpu_applet_backend_{group} counter")
+            for backend, value in sorted(counters.items()):
+                lines.append(f'gpu_applet_backend_{group}_total'
+                             f'{{backend="{self.label(backend)}"}} {value}')
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def stop(self):
+        """Shut the server down without waiting on the main loop"""
+        def shutdown():
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+        threading.Thread(target=shutdown, daemon=True).start()
+
+
+class SessionRecorder:
+    """Appends every sample to a compact binary recording
+
+    The file starts with FILE_HEADER and the comma separated names of
+    the recorded sample fields. Each sample is a RECORD (time and device
+    count) followed by one device record per GPU (id and a float per
+    field, NaN when missing). Writes go through a large buffer, which is
+    flushed at most every flush_interval seconds.
+    """
+
+    MAGIC = b'GPUREC\0\0'
+    VERSION = 3
+    FILE_HEADER = struct.Struct('<8sIH')
+    RECORD = struct.Struct('<dB')
+    FIELDS = tuple(METRIC_FIELDS.values()) + tuple(BURST_FIELDS.values())
+    # Room for remote GPU ids, which start with the host name
+    ID_SIZE = 64
+
+    flush_interval = 60
+
+    @classmethod
+    def device_struct(cls, fields):
+        return struct.Struct(f'<{cls.ID_SIZE}s{len(fields)}f')
+
+    def __init__(self, path):
+        self.path = path
+        self.device = self.device_struct(self.FIELDS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'xb', buffering=65536)
+        names = ','.join(self.FIELDS).encode('ascii')
+        self.file.write(self.FILE_HEADER.pack(self.MAGIC, self.VERSION,
+                                              len(names)) + names)
+        self.flushed = time.monotonic()
+
+    def write(self, timestamp, devices):
+        """Append one sample"""
+        devices = devices[:255]
+        parts = [self.RECORD.pack(timestamp, len(devices))]
+        for device in devices:
+            values = [device.get(field) for field in self.FIELDS]
+            parts.append(self.device.pack(
+                str(device['id']).encode('utf-8')[:self.ID_SIZE],
+                *[math.nan if value is None else value
+                  for value in values]))
+        self.file.write(b''.join(parts))
+        if time.monotonic() - self.flushed >= self.flush_interval:
+            self.file.flush()
+            self.flushed = time.monotonic()
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def read(cls, path):
+        """Yield (time, devices) from a recording, oldest first
+
+        A record cut short at the end, e.g. by a crash, is ignored.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(cls.FILE_HEADER.size)
+            if (len(header) < cls.FILE_HEADER.size or
+                    header[:8] != cls.MAGIC):
+                raise ValueError(f"{path} is not a GPU session recording")
+            magic, version, size = cls.FILE_HEADER.unpack(header)
+            if version != cls.VERSION:
+                raise ValueError(f"{path} has unknown version {version}")
+            fields = f.read(size).decode('ascii').split(',')
+            device_struct = cls.device_struct(fields)
+            while True:
+                record = f.read(cls.RECORD.size)
+                if len(record) < cls.RECORD.size:
+                    return
+                timestamp, count = cls.RECORD.unpack(record)
+                data = f.read(device_struct.size * count)
+                if len(data) < device_struct.size * count:
+                    return
+                devices = []
+                for values in device_struct.iter_unpack(data):
+                    device = {'id': values[0].rstrip(b'\0').decode(
+                        'utf-8', 'replace')}
+                    for field in METRIC_FIELDS.values():
+                        device[field] = None
+                    for field, value in zip(fields, values[1:]):
+                        if not math.isnan(value):
+                            device[field] = value
+                    devices.append(device)
+                yield timestamp, devices
+
+
+class SessionReplay:
+    """Plays a recording back on the main loop
+
+    Samples are handed to on_sample(devices, timestamp) with the
+    recorded gaps divided by speed. Gaps longer than max_gap seconds,
+    e.g. while nothing was recorded, are shortened to it.
+    """
+
+    max_gap = 5
+
+    def __init__(self, path, speed, on_sample, on_done):
+        self.records = SessionRecorder.read(path)
+        self.speed = speed
+        self.on_sample = on_sample
+        self.on_done = on_done
+        self.timer_id = None
+        self.pending = next(self.records, None)
+
+    def start(self):
+        self.timer_id = GLib.timeout_add(0, self.on_timeout)
+
+    def on_timeout(self):
+        self.timer_id = None
+        if self.pending is None:
+            self.on_done()
+            return False
+        timestamp, devices = self.pending
+        self.pending = next(self.records, None)
+        self.on_sample(devices, timestamp)
+        if self.pending is None:
+            self.on_done()
+            return False
+        gap = min(max(self.pending[0] - timestamp, 0) / self.speed,
+                  self.max_gap)
+        self.timer_id = GLib.timeout_add(int(gap * 1000), self.on_timeout)
+        return False
+
+    def stop(self):
+        if self.timer_id:
+            GLib.source_remove(self.timer_id)
+            self.timer_id = None
+        self.records.close()
+
+
+class SamplerService:
+    """Samples the GPUs once and pushes every sample to all subscribers
+
+    Subscribers connect to a Unix socket. Both directions carry one JSON
+    object per line: subscribers may send {"interval_ms": N} and the
+    service samples at the shortest interval asked for; the service sends
+    {"devices": [...], "status": "..."} to each subscriber at about the
+    interval it asked for. Subscribers whose interval adapts also send
+    "backend_ms", the interval backend processes keep sampling at.
+    Subscribers may also send "metrics", the names of the METRICS they
+    need; the service samples those of all subscribers, and every metric
+    for subscribers that do not say. A client sending {"poll": true}
+    instead gets the latest sample back at once and nothing pushed. The
+    service exits when it has had no subscriber for idle_timeout seconds.
+    """
+
+    idle_timeout = 30
+    max_pending = 65536  # Bytes queued for a subscriber before dropping it
+
+    def __init__(self, path, interval_ms=2000, sysfs_root='/sys'):
+        self.path = path
+        self.default_interval_ms = interval_ms
+        self.interval_ms = None
+        self.clients = {}
+        self.server = None
+        self.server_watch = None
+        self.timer_id = None
+        self.idle_id = None
+        self.latest = b''
+        self.loop = GLib.MainLoop()
+        self.backends = BackendManager(interval_ms, sysfs_root=sysfs_root,
+                                       metrics=CORE_METRICS)
+        self.worker = SamplingWorker(lambda: self.backends.sample() or [],
+                                     self.on_sample)
+
+    def listen(self):
+        """Bind the socket, return False if another service owns it"""
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+            return False
+        except OSError:
+            pass
+        finally:
+            probe.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.server.bind(self.path)
+        except OSError:
+            self.server.close()
+            return False
+        self.server.listen(16)
+        self.server.setblocking(False)
+        self.server_watch = GLib.io_add_watch(
+            self.server.fileno(), GLib.PRIORITY_DEFAULT,
+            GLib.IOCondition.IN, self.on_accept)
+        return True
+
+    def run(self):
+        """Serve subscribers until idle"""
+        if self.server is None and not self.listen():
+            return
+        self.schedule_idle_exit()
+        self.update_interval()
+        try:
+            self.loop.run()
+        finally:
+            self.backends.stop()
+            self.worker.stop()
+            self.close()
+
+    def close(self):
+        """Stop listening and remove the socket"""
+        self.stop_listening()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def stop_listening(self):
+        """Stop accepting subscribers"""
+        if self.server_watch:
+            GLib.source_remove(self.server_watch)
+            self.server_watch = None
+        self.server.close()
+
+    def schedule_idle_exit(self):
+        if self.idle_id is None and self.idle_timeout:
+            self.idle_id = GLib.timeout_add_seconds(self.idle_timeout,
+                                                    self.on_idle_timeout)
+
+    def on_idle_timeout(self):
+        self.idle_id = None
+        if not self.clients:
+            self.loop.quit()
+        return False
+
+    def on_accept(self, fd, condition):
+        try:
+            conn, address = self.server.accept()
+        except OSError:
+            return True
+        conn.setblocking(False)
+        client = {'socket': conn, 'in': b'', 'out': b'', 'poll': False,
+                  'interval_ms': None, 'backend_ms': None, 'metrics': None,
+                  'out_watch': None, 'sent': 0}
+        client['watch'] = GLib.io_add_watch(
+            conn.fileno(), GLib.PRIORITY_DEFAULT,
+            GLib.IOCondition.IN | GLib.IOCondition.HUP |
+            GLib.IOCondition.ERR,
+            self.on_client_readable, client)
+        self.clients[conn.fileno()] = client
+        if self.idle_id is not None:
+            GLib.source_remove(self.idle_id)
+            self.idle_id = None
+        return True
+
+    def on_client_readable(self, fd, condition, client):
+        try:
+            chunk = client['socket'].recv(4096)
+        except BlockingIOError:
+            return True
+        except OSError:
+            chunk = b''
+        if not chunk:
+            client['watch'] = None
+            self.drop_client(client)
+            return False
+
+        *lines, client['in'] = (client['in'] + chunk).split(b'\n')
+        for line in lines:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(request, dict):
+                self.handle_request(client, request)
+        return True
+
+    def handle_request(self, client, request):
+        """Answer a poll or apply the interval and metrics asked for"""
+        if request.get('poll'):
+            client['poll'] = True
+            client['out'] += self.latest or self.encode_sample([])
+            self.flush(client)
+        if isinstance(request.get('metrics'), list):
+            client['metrics'] = [name for name in request['metrics']
+                                 if name in METRICS]
+        self.update_metrics()
+        try:
+            client['interval_ms'] = max(100, int(request['interval_ms']))
+            if 'backend_ms' in request:
+                client['backend_ms'] = max(100, int(request['backend_ms']))
+        except (ValueError, TypeError, KeyError):
+            return
+        self.update_interval()
+
+    def drop_client(self, client):
+        """Forget a subscriber and close its connection"""
+        for key in ('watch', 'out_watch'):
+            if client[key]:
+                GLib.source_remove(client[key])
+                client[key] = None
+        self.clients.pop(client['socket'].fileno(), None)
+        client['socket'].close()
+        self.update_interval()
+        self.update_metrics()
+        if not self.clients:
+            self.schedule_idle_exit()
+
+    def update_interval(self):
+        """Sample at the shortest interval any subscriber asked for"""
+        intervals = [client['interval_ms'] for client in self.clients.values()
+                     if client['interval_ms']]
+        interval_ms = min(intervals, default=self.default_interval_ms)
+        # Backends only restart when a subscriber's fastest rate changes
+        backend_intervals = [client['backend_ms'] or client['interval_ms']
+                             for client in self.clients.values()
+                             if client['interval_ms']]
+        self.backends.set_interval(min(backend_intervals + [interval_ms]))
+        if interval_ms == self.interval_ms:
+            return
+        self.interval_ms = interval_ms
+        if self.timer_id:
+            GLib.source_remove(self.timer_id)
+        self.timer_id = GLib.timeout_add(interval_ms, self.on_tick)
+
+    def update_metrics(self):
+        """Sample the metrics any subscriber needs"""
+        if not self.clients:
+            return
+        wanted = set(CORE_METRICS)
+        for client in self.clients.values():
+            wanted.update(METRICS if client['metrics'] is None
+                          else client['metrics'])
+        metrics = tuple(name for name in METRICS if name in wanted)
+        if metrics != self.backends.metrics:
+            self.backends.set_metrics(metrics)
+
+    def on_tick(self):
+        if self.clients:
+            self.worker.request()
+        return True
+
+    def encode_sample(self, devices):
+        """Return the message line carrying a sample"""
+        message = json.dumps({'devices': devices,
+                              'status': self.backends.describe(),
+                              'time': time.time()})
+        return message.encode('utf-8') + b'\n'
+
+    def on_sample(self, devices):
+        """Push a sample to every subscriber"""
+        data = self.latest = self.encode_sample(devices)
+        now = time.monotonic()
+        for client in list(self.clients.values()):
+            if client['poll']:
+                continue
+            # Subscribers asking for a slower rate skip samples
+            wanted = client['interval_ms'] or self.interval_ms
+            if (now - client['sent']) * 1000 < wanted - self.interval_ms / 2:
+                continue
+            client['sent'] = now
+            client['out'] += data
+            self.flush(client)
+
+    def flush(self, client):
+        """Send queued data, dropping subscribers that fall behind"""
+        if len(client['out']) > self.max_pending:
+            self.drop_client(client)
+            return False
+        try:
+            sent = client['socket'].send(client['out'])
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.drop_client(client)
+            return False
+        client['out'] = client['out'][sent:]
+        if client['out'] and not client['out_watch']:
+            client['out_watch'] = GLib.io_add_watch(
+                client['socket'].fileno(), GLib.PRIORITY_DEFAULT,
+                GLib.IOCondition.OUT, self.on_client_writable, client)
+        return bool(client['out'])
+
+    def on_client_writable(self, fd, condition, client):
+        if self.flush(client):
+            return True
+        client['out_watch'] = None
+        return False
+
+
+class RemoteAgent(SamplerService):
+    """Serves the samples of this host's GPUs to applets on other hosts
+
+    The protocol is the one of SamplerService over TCP. Applets poll
+    with {"poll": true, "interval_ms": N, "metrics": [...]}, so a reply
+    never waits for the GPUs. The agent keeps running without clients.
+    There is no authentication: listen on a trusted network or tunnel
+    over ssh.
+    """
+
+    idle_timeout = None
+
+    def __init__(self, address, interval_ms=2000, sysfs_root='/sys'):
+        super().__init__(None, interval_ms, sysfs_root)
+        self.address = address
+
+    def listen(self):
+        """Bind the TCP port, return False if it is taken"""
+        try:
+            self.server = socket.create_server(self.address)
+        except OSError:
+            return False
+        self.server.setblocking(False)
+        self.server_watch = GLib.io_add_watch(
+            self.server.fileno(), GLib.PRIORITY_DEFAULT,
+            GLib.IOCondition.IN, self.on_accept)
+        return True
+
+    def close(self):
+        self.stop_listening()
+
+
+class SharedSamplerClient:
+    """Receives samples from a SamplerService, starting it if needed"""
+
+    connect_attempts = 10
+    retry_ms = 200
+
+    def __init__(self, path, interval_ms, on_sample, on_lost,
+                 backend_ms=None, sysfs_root='/sys', metrics=CORE_METRICS):
+        self.path = path
+        self.interval_ms = interval_ms
+        self.backend_ms = backend_ms
+        self.sysfs_root = sysfs_root
+        self.metrics = tuple(metrics)
+        self.on_sample = on_sample
+        self.on_lost = on_lost
+        self.socket = None
+        self.watch_id = None
+        self.retry_id = None
+        self.attempts = 0
+        self.buffer = b''
+
+    @property
+    def connected(self):
+        return self.socket is not None
+
+    def start(self, spawn=True):
+        """Connect, starting the service first if nobody listens"""
+        if self.connect():
+            return
+        if not spawn:
+            self.on_lost()
+            return
+        self.spawn_service()
+        self.attempts = 0
+        self.retry_id = GLib.timeout_add(self.retry_ms, self.on_retry)
+
+    def spawn_service(self):
+        """Start the sampler service in its own session"""
+        argv = [sys.executable, os.path.abspath(__file__),
+                '--sampler-service', '--socket', self.path,
+                '--interval-ms', str(self.interval_ms),
+                '--sysfs-root', self.sysfs_root]
+        try:
+            pid = GLib.spawn_async(
+                argv, flags=(GLib.SpawnFlags.DO_NOT_REAP_CHILD |
+                             GLib.SpawnFlags.STDOUT_TO_DEV_NULL |
+                             GLib.SpawnFlags.STDERR_TO_DEV_NULL),
+                child_setup=os.setsid)[0]
+        except GLib.Error:
+            return
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid,
+                             lambda pid, status: GLib.spawn_close_pid(pid))
+
+    def on_retry(self):
+        if self.connect():
+            self.retry_id = None
+            return False
+        self.attempts += 1
+        if self.attempts >= self.connect_attempts:
+            self.retry_id = None
+            self.on_lost()
+            return False
+        return True
+
+    def connect(self):
+        """Try to connect to the service socket"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            return False
+        sock.setblocking(False)
+        self.socket = sock
+        self.buffer = b''
+        self.watch_id = GLib.io_add_watch(
+            sock.fileno(), GLib.PRIORITY_DEFAULT,
+            GLib.IOCondition.IN | GLib.IOCondition.HUP |
+            GLib.IOCondition.ERR,
+            self.on_readable)
+        self.send_settings()
+        return True
+
+    def set_interval(self, interval_ms, backend_ms=None):
+        """Ask the service for a sampling interval
+
+        backend_ms is the interval backend processes should keep
+        sampling at while interval_ms adapts, by default interval_ms.
+        """
+        self.interval_ms = interval_ms
+        self.backend_ms = backend_ms
+        self.send_settings()
+
+    def set_metrics(self, metrics):
+        """Ask the service to sample metrics, the names of METRICS"""
+        self.metrics = tuple(metrics)
+        self.send_settings()
+
+    def send_settings(self):
+        """Send the interval and metrics to the service"""
+        if self.socket is None:
+            return
+        request = {'interval_ms': self.interval_ms,
+                   'metrics': list(self.metrics)}
+        if self.backend_ms:
+            request['backend_ms'] = self.backend_ms
+        try:
+            self.socket.send(json.dumps(request).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+
+    def on_readable(self, fd, condition):
+        try:
+            chunk = self.socket.recv(65536)
+        except BlockingIOError:
+            return True
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self.watch_id = None
+            self.close()
+            self.on_lost()
+            return False
+
+        *lines, self.buffer = (self.buffer + chunk).split(b'\n')
+        for line in lines:
+            try:
+                message = json.loads(line)
+                devices = message['devices']
+            except (ValueError, KeyError, TypeError):
+                continue
+            self.on_sample(devices, message.get('status', ''))
+        return True
+
+    def close(self):
+        """Disconnect from the service"""
+        for attr in ('watch_id', 'retry_id'):
+            source_id = getattr(self, attr)
+            if source_id:
+                GLib.source_remove(source_id)
+                setattr(self, attr, None)
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+def run_sampler_service(argv):
+    """Entry point of the shared sampler service process"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='mate_gpu_applet.py')
+    parser.add_argument('--sampler-service', action='store_true')
+    parser.add_argument('--socket', default=default_sampler_socket())
+    parser.add_argument('--interval-ms', type=int, default=2000)
+    parser.add_argument('--sysfs-root', default='/sys')
+    args = parser.parse_args(argv)
+    SamplerService(args.socket, args.interval_ms, args.sysfs_root).run()
+
+
+def run_remote_agent(argv):
+    """Entry point of the remote agent process"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='mate_gpu_applet.py')
+    parser.add_argument('--agent', action='store_true')
+    parser.add_argument('--listen', default=f'localhost:{AGENT_PORT}',
+                        help="address to serve on, HOST:PORT")
+    parser.add_argument('--interval-ms', type=int, default=2000)
+    parser.add_argument('--sysfs-root', default='/sys')
+    args = parser.parse_args(argv)
+    address = parse_host_port(args.listen, AGENT_PORT)
+    agent = RemoteAgent(address, args.interval_ms, args.sysfs_root)
+    if not agent.listen():
+        sys.exit(f"Cannot listen on {args.listen}")
+    agent.run()
+
+
+def parse_host_port(address, default_port):
+    """Split "host", "host:port" or "[v6 address]:port" into a tuple"""
+    host, sep, port = address.strip().rpartition(':')
+    if not sep or not port.isdigit() or (':' in host and
+                                         not host.endswith(']')):
+        return address.strip().strip('[]'), default_port
+    return host.strip('[]'), int(port)
+
+
+class RemoteHost:
+    """Polls the agent on one host over a persistent connection
+
+    The connection lives on its own thread and every reply has to come
+    within timeout seconds, so an unreachable or overloaded host only
+    ever delays its own samples. Device ids get the host name prefixed,
+    "render1:0" is GPU 0 of render1.
+    """
+
+    max_backoff = 60  # Longest wait between reconnection attempts
+    max_line = 1 << 20  # Longest reply accepted
+
+    def __init__(self, address, interval_ms, timeout, backend_ms=None,
+                 metrics=None):
+        self.host, self.port = parse_host_port(address, AGENT_PORT)
+        self.name = self.host
+        self.interval_ms = interval_ms
+        self.backend_ms = backend_ms
+        # Names of the METRICS to ask for, None for all
+        self.metrics = metrics
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.devices = None
+        self.received = None
+        self.latency = None
+        self.error = "connecting"
+        self.failures = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run,
+                                       name=f'gpu-remote-{self.name}',
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def latest(self, since):
+        """Return the devices of the last reply if it came after since"""
+        with self.lock:
+            if self.received is None or self.received < since:
+                return []
+            return self.devices
+
+    def run(self):
+        """Thread body: poll until stopped"""
+        sock = None
+        while not self.stop_event.is_set():
+            start = time.monotonic()
+            try:
+                if sock is None:
+                    sock = socket.create_connection((self.host, self.port),
+                                                    timeout=self.timeout)
+                    reader = sock.makefile('rb')
+                request = {'poll': True, 'interval_ms': self.interval_ms}
+                if self.backend_ms:
+                    request['backend_ms'] = self.backend_ms
+                if self.metrics is not None:
+                    request['metrics'] = list(self.metrics)
+                sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+                # A reply has to come before the timeout set on connect
+                line = reader.readline(self.max_line)
+                if not line.endswith(b'\n'):
+                    raise OSError("connection closed")
+                devices = [dict(device, id=f"{self.name}:{device['id']}")
+                           for device in json.loads(line)['devices']]
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                # A late reply would answer the next poll, start over
+                if sock is not None:
+                    reader.close()
+                    sock.close()
+                    sock = None
+                with self.lock:
+                    if isinstance(error, socket.timeout):
+                        self.error = "timed out"
+                    else:
+                        self.error = (getattr(error, 'strerror', None) or
+                                      str(error))
+                    self.failures += 1
+                wait = min(self.interval_ms / 1000 * 2 ** self.failures,
+                           self.max_backoff)
+            else:
+                with self.lock:
+                    self.devices = devices
+                    self.received = time.monotonic()
+                    self.latency = self.received - start
+                    self.error = None
+                    self.failures = 0
+                wait = self.interval_ms / 1000 - (time.monotonic() - start)
+            self.stop_event.wait(max(wait, 0))
+        if sock is not None:
+            reader.close()
+            sock.close()
+
+    def describe(self):
+        """Return the state of the connection for the tooltip"""
+        with self.lock:
+            if self.error is None:
+                return f"{self.name}: {self.latency * 1000:.0f} ms"
+            return f"{self.name}: {self.error}"
+
+
+class RemotePoller:
+    """Polls the GPU agents on several hosts concurrently
+
+    Each host has its own RemoteHost thread. latest() never waits for a
+    host; it returns the newest devices of every host that answered
+    recently enough, so the applet can merge them into its own samples.
+    """
+
+    def __init__(self, addresses, interval_ms, timeout, backend_ms=None,
+                 metrics=None):
+        self.hosts = [RemoteHost(address, interval_ms, timeout, backend_ms,
+                                 metrics)
+                      for address in addresses]
+
+    def latest(self):
+        """Return the recent devices of all hosts"""
+        devices = []
+        for host in self.hosts:
+            # Replies older than a few intervals count as missing
+            since = time.monotonic() - max(3 * host.interval_ms / 1000,
+                                           host.timeout)
+            devices.extend(host.latest(since))
+        return devices
+
+    def set_interval(self, interval_ms, backend_ms=None):
+        for host in self.hosts:
+            host.interval_ms = interval_ms
+            host.backend_ms = backend_ms
+
+    def set_metrics(self, metrics):
+        for host in self.hosts:
+            host.metrics = tuple(metrics)
+
+    def stop(self):
+        for host in self.hosts:
+            host.stop()
+
+    def describe(self):
+        return "\n".join(host.describe() for host in self.hosts)
+
 
 class GPUApplet:
     def __init__(self, applet):
+        # Until the first sample, the time startup began, see on_gpu_data
+        self.startup = time.perf_counter()
         self.applet = applet
         self.config_file = os.path.expanduser("~/.config/mate-gpu-applet.json")
-
-        # Load preferences
-        self.preferences = {
-            'show_gpu_load': True,
-            'show_temperature': True,
-            'show_memory': True,
-            'show_chart': False,
-            'chart_width': 50,  # Width of each individual chart
-            'chart_transparency': 50,  # Chart fill transparency (0-100)
-            'chart_font_size': 10,  # Font size for chart labels
-            'update_interval': 2  # Update interval in seconds
-        }
-        self.load_preferences()
-
-        # Data storage for charts (last 60 data points = 2 minutes)
-        self.max_data_points = 60
-        self.gpu_data = deque(maxlen=self.max_data_points)
-        self.temp_data = deque(maxlen=self.max_data_points)
-        self.memory_data = deque(maxlen=self.max_data_points)
-        self.timestamps = deque(maxlen=self.max_data_points)
+        self.init_preferences()
+        self.init_history()
 
         self.chart_window = None
 
+        # Polling slows down while idle or hidden
+        self.poller = AdaptivePoller(
+            self.preferences['update_interval'],
+            self.preferences['min_update_interval'],
+            self.preferences['max_update_interval'])
+        self.effective_interval = self.preferences['update_interval']
+        self.sampling_ms = self.effective_interval * 1000
+        self.screen_locked = False
+
+        # Clock throttling events, and the label colours showing them
+        self.throttle = ThrottleDetector()
+        self.throttle_css = None
+
+        # Overhead of the applet itself, see show_diagnostics
+        self.diagnostics = Diagnostics()
+        self.timer_due = None
+
+        # Widgets are redrawn once per frame, when they changed
+        self.render_scheduler = RenderScheduler(self.diagnostics)
+
+        # Backends are probed on the first sample, off the main loop
+        self.backends = BackendManager(
+            self.display_interval_ms(),
+            sysfs_root=self.preferences['sysfs_root'],
+            diagnostics=self.diagnostics,
+            metrics=self.sampled_metrics())
+        self.backend_status = None
+
+        # Blocking backends are queried off the main loop
+        self.sampling_worker = SamplingWorker(self.get_gpu_data,
+                                              self.on_gpu_data)
+
+        # Sampling and the services below are started by finish_startup,
+        # once the panel is shown
+        self.timer_id = None
+
+        # Sub-second samples are summed up per display interval
+        self.burst_sampler = None
+
+        # Optional localhost metrics endpoint
+        self.metrics_server = None
+
+        # Session recording and replay of a recording
+        self.recorder = None
+        self.replay = None
+        self.live_history = None
+
+        # Samples come from the shared sampler service while connected
+        self.shared_sampler = None
+        self.shared_status = None
+
+        # GPUs of other hosts, polled from their agents
+        self.remote = None
+        self.local_host = socket.gethostname().split('.')[0]
+
+        # GPU processes, scanned on their own slower schedule
+        self.gpu_processes = []
+        self.process_monitor = None
+
         # Create container for switching between label and drawing area
         self.container = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
         self.applet.add(self.container)
@@ -49,9 +3512,10 @@ class GPUApplet:
         self.label = Gtk.Label()
         self.label.set_text("GPU: --")
 
-        # Individual chart drawing areas
+        # Individual chart drawing areas and their offscreen renderers by
+        # (device key, metric)
         self.chart_areas = {}
-        self.create_chart_areas()
+        self.chart_renderers = {}
 
         # Add appropriate widget based on preferences
         self.update_panel_display()
@@ -61,99 +3525,707 @@ class GPUApplet:
         # Setup context menu
         self.setup_menu()
 
+        self.applet.connect('destroy', self.on_destroy)
+        self.applet.connect('map', self.on_visibility_changed)
+        self.applet.connect('unmap', self.on_visibility_changed)
+
+        # Idle sources run after GTK has drawn, so the panel shows the
+        # placeholder without waiting for any of the services
+        self.diagnostics.record('startup', 'panel',
+                                time.perf_counter() - self.startup)
+        self.startup_id = GLib.idle_add(self.finish_startup)
+
+    def finish_startup(self):
+        """Load the history, start the services and request a sample"""
+        self.startup_id = None
+        start = time.perf_counter()
+        if self.preferences['persist_history']:
+            self.open_history_store(restore=True)
+        if self.preferences['burst_sampling']:
+            self.start_burst_sampling()
+        if self.preferences['metrics_endpoint']:
+            self.start_metrics_server()
+        if self.preferences['shared_sampler']:
+            self.start_shared_sampler()
+        if self.preferences['show_processes']:
+            self.start_process_monitor()
+        if self.preferences['remote_hosts']:
+            self.start_remote_polling()
+        self.watch_screensaver()
+
         self.update_gpu_info()
-        self.timer_id = GLib.timeout_add_seconds(
-            self.preferences['update_interval'], self.update_gpu_info)
+        self.restart_timer()
+        self.diagnostics.record('startup', 'services',
+                                time.perf_counter() - start)
+        return False
 
-    def get_gpu_data(self):
-        """Get raw GPU data and return as dict"""
-        data = {'usage': 0.0, 'temp': 0.0, 'memory': 0.0}
+    def init_preferences(self):
+        """Set default preferences and load the saved ones"""
+        # Load preferences
+        self.preferences = {
+            'show_gpu_load': True,
+            'show_temperature': True,
+            'show_memory': True,
+            'show_chart': False,
+            'chart_width': 50,  # Width of each individual chart
+            'chart_transparency': 50,  # Chart fill transparency (0-100)
+            'chart_font_size': 10,  # Font size for chart labels
+            'update_interval': 2,  # Update interval in seconds
+            'adaptive_polling': True,  # Adapt the interval to activity
+            'min_update_interval': 1,  # Fastest adaptive interval
+            'max_update_interval': 30,  # Slowest adaptive interval
+            'burst_sampling': False,  # Sample faster than the display
+            'burst_interval_ms': 200,  # Interval of burst sampling
+            'metrics_endpoint': False,  # Serve OpenMetrics on localhost
+            'metrics_port': 9839,  # Port of the metrics endpoint
+            'recording_dir': '',  # Session recordings, '' for the cache
+            'replay_speed': 10,  # Replay speed, 1 for real time
+            'show_processes': True,  # List the top GPU processes
+            'process_interval': 10,  # Seconds between process scans
+            'sysfs_root': '/sys',  # Where the AMD backend looks for sysfs
+            'multi_gpu_mode': 'per_gpu',  # One of MULTI_GPU_MODES
+            'chart_time_range': 'raw',  # History tier in the chart window
+            'persist_history': False,  # Keep history across restarts
+            'shared_sampler': True,  # Share one sampler between applets
+            'sampler_socket': '',  # Shared sampler socket, '' for default
+            'remote_hosts': '',  # Agents to poll, "host[:port]" by commas
+            'remote_timeout': 2  # Seconds to wait for an agent's reply
+        }
+        # Metrics beyond the core ones are hidden by default
+        for metric in METRICS.values():
+            self.preferences.setdefault(metric['preference'], False)
+        self.load_preferences()
 
-        try:
-            result = subprocess.run([
-                'nvidia-smi',
-                '--query-gpu=utilization.gpu,memory.used,memory.total,'
-                'temperature.gpu',
-                '--format=csv,noheader,nounits'
-            ], capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\n')
-                if lines:
-                    usage, mem_used, mem_total, temp = lines[0].split(', ')
-                    data['usage'] = float(usage)
-                    data['temp'] = float(temp)
-                    mem_percent = (int(mem_used) / int(mem_total)) * 100
-                    data['memory'] = round(mem_percent)
-                    return data
-        except Exception:
-            pass
+    def init_history(self):
+        """Set up the chart history, restoring it if enabled"""
+        # Samples shown by the panel charts, the chart window draws the
+        # tiers of HISTORY_TIERS
+        self.max_data_points = 60
+        self.timestamps = TimeSeries(HISTORY_TIERS[0][2], ('time',))
+        # Metric series for every device id and for the aggregates, also
+        # per host once GPUs of other hosts are seen
+        self.device_ids = []
+        self.host_keys = []
+        self.history = {}
+        self.history_store = None
+        self.history_file = os.path.expanduser(
+            "~/.cache/mate-gpu-applet/history.bin")
+        for key in ('max', 'avg'):
+            self.history[key] = self.new_series(key)
+
+    def on_destroy(self, widget):
+        """Stop timers and child processes when the applet is removed"""
+        if self.startup_id:
+            GLib.source_remove(self.startup_id)
+            self.startup_id = None
+        if self.timer_id:
+            GLib.source_remove(self.timer_id)
+            self.timer_id = None
+        self.render_scheduler.cancel_tick()
+        self.backends.stop()
+        self.sampling_worker.stop()
+        if self.burst_sampler:
+            self.burst_sampler.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.replay:
+            self.replay.stop()
+        if self.process_monitor:
+            self.process_monitor.stop()
+        if self.recorder:
+            self.recorder.close()
+        if self.shared_sampler:
+            self.shared_sampler.close()
+        if self.remote:
+            self.remote.stop()
+        self.close_history_store()
 
-        try:
-            result = subprocess.run(['radeontop', '-d', '-l1'],
-                                    capture_output=True, text=True,
-                                    timeout=5)
-            if result.returncode == 0:
-                gpu_match = re.search(r'gpu (\d+\.\d+)%', result.stdout)
-                vram_match = re.search(r'vram (\d+\.\d+)%', result.stdout)
-                if gpu_match:
-                    data['usage'] = float(gpu_match.group(1))
-                    if vram_match:
-                        data['memory'] = float(vram_match.group(1))
-                    return data
-        except Exception:
-            pass
+    def get_gpu_data(self):
+        """Get raw GPU data and return a list of device dicts
 
-        return data
+        Runs on the sampling thread, must not touch any widgets.
+        """
+        return self.backends.sample() or []
 
     def get_gpu_usage(self):
         """Get formatted GPU usage string"""
-        data = self.get_gpu_data()
-        return self.format_display(usage=data['usage'], temp=data['temp'],
-                                   mem_percent=data['memory'])
+        return self.format_sample(self.get_gpu_data())
 
-    def format_display(self, usage=None, temp=None, mem_percent=None):
-        """Format display string based on preferences"""
-        parts = []
+    def shown_metrics(self):
+        """Return the names of the metrics enabled in the preferences"""
+        return [name for name, metric in METRICS.items()
+                if self.preferences[metric['preference']]]
+
+    def sampled_metrics(self):
+        """Return the metrics to sample, the core ones and those shown"""
+        return tuple(name for name, metric in METRICS.items()
+                     if metric.get('core') or
+                     self.preferences[metric['preference']])
 
-        if usage is not None and self.preferences['show_gpu_load']:
-            parts.append(f"GPU: {usage}%")
+    def format_display(self, values, name="GPU", peak=None):
+        """Format display string based on preferences
 
-        if temp is not None and self.preferences['show_temperature']:
-            parts.append(f"{temp}°C")
+        values holds the value of each metric by name.
+        """
+        parts = []
 
-        if mem_percent is not None and self.preferences['show_memory']:
-            parts.append(f"Mem: {mem_percent}%")
+        for metric in self.shown_metrics():
+            value = values.get(metric)
+            if value is None:
+                continue
+            parts.append(METRICS[metric]['text'].format(name=name,
+                                                        value=value))
+            if metric == 'gpu' and peak is not None and peak > value:
+                parts[-1] += f" \u2191{peak:.0f}%"
 
         if not parts:
-            return "GPU: --"
+            return f"{name}: --"
+
+        if name != "GPU" and not self.preferences['show_gpu_load']:
+            parts[0] = f"{name}: {parts[0]}"
 
         return " | ".join(parts) if len(parts) > 1 else parts[0]
 
+    def format_sample(self, devices):
+        """Format the panel text for a list of device dicts"""
+        if not devices:
+            return "GPU: --"
+
+        mode = self.preferences['multi_gpu_mode']
+        by_host = {}
+        for device in devices:
+            host = device_host(device['id']) or self.local_host
+            by_host.setdefault(host, []).append(device)
+        if mode == 'per_host' and len(by_host) > 1:
+            return "  ".join(
+                self.format_display(self.combine(by_host[host], 'max'),
+                                    name=host)
+                for host in sorted(by_host, key=self.host_sort_key))
+        if mode == 'per_gpu' and len(devices) > 1:
+            return "  ".join(
+                self.format_display({metric: device.get(field) for metric,
+                                     field in METRIC_FIELDS.items()},
+                                    name=self.key_name(device['id']),
+                                    peak=device.get('usage_peak'))
+                for device in devices)
+
+        combined = self.combine(devices, 'avg' if mode == 'avg' else 'max')
+        return self.format_display(combined, peak=combined.get('gpu_peak'))
+
+    @staticmethod
+    def combine(devices, how):
+        """Combine the metrics of several devices into one value each"""
+        combined = {}
+        for metric, field in METRIC_FIELDS.items():
+            values = [device[field] for device in devices
+                      if device.get(field) is not None]
+            if not values:
+                combined[metric] = None
+            elif how == 'max':
+                combined[metric] = max(values)
+            else:
+                combined[metric] = round(sum(values) / len(values), 1)
+        for column, field in BURST_FIELDS.items():
+            values = [device[field] for device in devices
+                      if device.get(field) is not None]
+            if not values:
+                continue
+            elif how == 'max':
+                combined[column] = max(values)
+            else:
+                combined[column] = round(sum(values) / len(values), 1)
+        return combined
+
+    def new_series(self, key):
+        """Create a metric history aligned with the existing ones"""
+        series = TieredHistory(METRIC_FIELDS)
+        if 'max' in self.history:
+            series.pad_like(self.history['max'])
+        if self.history_store:
+            series.listener = lambda *args: self.history_store.write(key,
+                                                                     *args)
+        return series
+
+    def open_history_store(self, restore=False):
+        """Map the history file, loading the history it holds if restore"""
+        try:
+            self.history_store = HistoryStore(self.history_file)
+        except (OSError, ValueError):
+            # Also when another applet instance keeps the history
+            self.history_store = None
+            self.diagnostics.count('failures', 'history file')
+            return
+        if restore:
+            self.restore_history()
+        for key, series in self.history.items():
+            series.listener = lambda *args, key=key: \
+                self.history_store.write(key, *args)
+
+    def close_history_store(self):
+        """Stop writing history to disk"""
+        if self.history_store:
+            for series in self.history.values():
+                series.listener = None
+            self.history_store.close()
+            self.history_store = None
+
+    def restore_history(self):
+        """Fill the history from the history file
+
+        The file has a fixed size, so this costs the same however long
+        the applet ran before.
+        """
+        cutoff = time.time() - 24 * 3600
+        rows = {}
+        for name in TIER_NAMES:
+            for timestamp, key, values in self.history_store.read(name):
+                if timestamp >= cutoff:
+                    rows.setdefault(key, {}).setdefault(name, []).append(
+                        (timestamp, values))
+        if 'max' not in rows:
+            return
+
+        # Aggregates first so devices can be padded to line up with them
+        keys = ['max', 'avg'] + sorted(
+            (key for key in rows if key not in ('max', 'avg')),
+            key=device_sort_key)
+        for key in keys:
+            series = self.history[key] = TieredHistory(METRIC_FIELDS)
+            if is_device_key(key):
+                self.device_ids.append(key)
+            elif key not in ('max', 'avg'):
+                self.host_keys.append(key)
+                self.host_keys.sort(key=self.host_sort_key)
+            for name, tier in series.tiers.items():
+                key_rows = rows.get(key, {}).get(name, [])[-tier.capacity:]
+                expected = len(rows['max'].get(name, [])[-tier.capacity:])
+                tier.pad(expected - len(key_rows))
+                for timestamp, values in key_rows:
+                    row = dict(zip(tier.columns[1:], values))
+                    row['time'] = timestamp
+                    tier.append(row)
+
+        for timestamp, values in rows['max'].get('raw', []):
+            self.timestamps.append({'time': timestamp})
+
+    def displayed_keys(self):
+        """Return the history keys that charts are drawn for"""
+        mode = self.preferences['multi_gpu_mode']
+        if mode == 'per_gpu' and self.device_ids:
+            return list(self.device_ids)
+        if mode == 'per_host' and self.host_keys:
+            return list(self.host_keys)
+        return ['avg' if mode == 'avg' else 'max']
+
     def update_gpu_info(self):
-        """Update GPU information and refresh displays"""
-        # Get raw data and store for charts
-        data = self.get_gpu_data()
-        current_time = time.time()
+        """Request a new sample, the displays refresh when it arrives"""
+        if self.replay is not None:
+            # The recording drives the displays
+            return True
+        if self.burst_sampler is not None:
+            # Burst samples are already waiting
+            devices = self.burst_sampler.aggregator.collect()
+            if devices or self.remote is not None:
+                self.on_gpu_data(devices or [])
+        elif self.shared_sampler is None:
+            # The shared sampler pushes samples by itself
+            self.sampling_worker.request()
+        return True
+
+    def start_process_monitor(self):
+        self.process_monitor = ProcessMonitor(
+            self.preferences['process_interval'], self.on_gpu_processes,
+            sysfs_root=self.preferences['sysfs_root'])
+
+    def stop_process_monitor(self):
+        if self.process_monitor:
+            self.process_monitor.stop()
+            self.process_monitor = None
+        self.on_gpu_processes([])
 
-        self.timestamps.append(current_time)
-        self.gpu_data.append(data['usage'])
-        self.temp_data.append(data['temp'])
-        self.memory_data.append(data['memory'])
+    def on_gpu_processes(self, processes):
+        """Show the latest process scan"""
+        if processes == self.gpu_processes:
+            return
+        self.gpu_processes = processes
+        self.update_tooltip()
+        if self.chart_window:
+            self.render_scheduler.set_text(self.processes_label,
+                                           self.format_processes())
+
+    def show_throttling(self):
+        """Colour the panel label and list the throttling events"""
+        reasons = self.throttle.reasons()
+        context = self.label.get_style_context()
+        if self.throttle_css is None:
+            self.throttle_css = Gtk.CssProvider()
+            self.throttle_css.load_from_data("".join(
+                f".throttle-{reason} {{ color: rgb("
+                f"{', '.join(str(round(c * 255)) for c in config['color'])}"
+                f"); }}\n"
+                for reason, config in THROTTLE_REASONS.items()).encode())
+            context.add_provider(self.throttle_css,
+                                 Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        # The most severe reason ongoing on any GPU sets the colour
+        worst = next((reason for reason in THROTTLE_REASONS
+                      if reason in reasons), None)
+        for reason in THROTTLE_REASONS:
+            if reason == worst:
+                context.add_class(f"throttle-{reason}")
+            else:
+                context.remove_class(f"throttle-{reason}")
+        if self.chart_window:
+            self.render_scheduler.set_text(self.throttle_label,
+                                           self.format_throttling())
+
+    def format_throttling(self, count=5):
+        """Return the newest throttling events, one per line"""
+        events = list(self.throttle.log)[-count:]
+        if not events:
+            return ""
+        return "Throttling:\n" + "\n".join(
+            ThrottleDetector.describe(event) for event in reversed(events))
+
+    def key_name(self, key):
+        """Return the name a history key is shown under"""
+        if key in ('max', 'avg') or not is_device_key(key):
+            return key
+        return f"GPU{key}"
+
+    def key_devices(self, key):
+        """Return the device ids a history key covers, None for all"""
+        if key in ('max', 'avg'):
+            return None
+        if is_device_key(key):
+            return [key]
+        return [device_id for device_id in self.device_ids
+                if (device_host(device_id) or self.local_host) == key]
+
+    def throttle_color(self, key):
+        """Return the colour of the worst throttling of a history key"""
+        reasons = self.throttle.reasons(self.key_devices(key))
+        for reason, config in THROTTLE_REASONS.items():
+            if reason in reasons:
+                return config['color']
+        return None
+
+    def format_processes(self):
+        """Return the top GPU processes, one per line"""
+        lines = []
+        for process in self.gpu_processes:
+            line = f"{process['name']} ({process['pid']}) GPU{process['gpu']}"
+            if process['usage'] is not None:
+                line += f" {process['usage']:.0f}%"
+            if process['memory_mib'] is not None:
+                line += f" {process['memory_mib']:.0f} MiB"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def start_metrics_server(self):
+        """Serve the samples on localhost, if the port is free"""
+        try:
+            self.metrics_server = MetricsServer(
+                self.preferences['metrics_port'], self.diagnostics)
+        except OSError:
+            self.metrics_server = None
+            self.diagnostics.count('failures', 'metrics endpoint')
+
+    def stop_metrics_server(self):
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def on_timer(self):
+        """Record how late the tick fired, then update"""
+        now = time.monotonic()
+        if self.timer_due is not None:
+            self.diagnostics.record('timer', 'drift', now - self.timer_due)
+        self.timer_due = now + self.effective_interval
+        return self.update_gpu_info()
+
+    def timed_draw(self, widget, cr, name, draw, *args):
+        """Run a draw handler and record how long it took"""
+        start = time.perf_counter()
+        draw(widget, cr, *args)
+        self.diagnostics.record('draw', name, time.perf_counter() - start)
+        return False
+
+    def sampling_interval_ms(self):
+        """Return the interval the GPUs are sampled at"""
+        if self.burst_sampler is not None and not self.polling_slowed():
+            return self.preferences['burst_interval_ms']
+        return self.effective_interval * 1000
+
+    def display_interval_ms(self):
+        """Return the fastest interval polling may adapt to"""
+        if self.preferences['adaptive_polling']:
+            return self.preferences['min_update_interval'] * 1000
+        return self.preferences['update_interval'] * 1000
+
+    def polling_slowed(self):
+        """Return True while adaptive polling backs off, idle or hidden"""
+        return (self.preferences['adaptive_polling'] and
+                self.poller.reason in ("idle", "hidden"))
+
+    def backend_interval_ms(self):
+        """Return the interval streaming backends sample at
+
+        While polling is active, the fastest it may adapt to, so that its
+        frequent changes never restart the long-lived processes. While
+        idle or hidden, which lasts, the slower interval sampled at.
+        """
+        if self.polling_slowed():
+            return self.effective_interval * 1000
+        if self.burst_sampler is not None:
+            return self.preferences['burst_interval_ms']
+        return self.display_interval_ms()
+
+    def remote_interval_ms(self):
+        """Return the interval the agents of other hosts sample at"""
+        if self.polling_slowed():
+            return self.effective_interval * 1000
+        return self.display_interval_ms()
+
+    def start_burst_sampling(self):
+        """Sample at the burst interval on a background thread"""
+        self.burst_sampler = BurstSampler(
+            self.get_gpu_data, self.preferences['burst_interval_ms'])
+        self.sampling_ms = self.sampling_interval_ms()
+        self.backends.set_interval(self.backend_interval_ms())
+
+    def stop_burst_sampling(self):
+        self.burst_sampler.stop()
+        self.burst_sampler = None
+        self.sampling_ms = self.sampling_interval_ms()
+        self.backends.set_interval(self.backend_interval_ms())
+
+    def start_shared_sampler(self, spawn=True):
+        """Subscribe to the shared sampler service"""
+        if (self.shared_sampler is not None or
+                not self.preferences['shared_sampler']):
+            return False
+        path = (self.preferences['sampler_socket'] or
+                default_sampler_socket())
+        self.shared_sampler = SharedSamplerClient(
+            path, self.sampling_interval_ms(),
+            self.on_shared_sample, self.on_shared_sampler_lost,
+            self.backend_interval_ms(), self.preferences['sysfs_root'],
+            self.sampled_metrics())
+        self.shared_sampler.start(spawn)
+        return False
+
+    def on_shared_sample(self, devices, status):
+        """Handle a sample pushed by the shared sampler"""
+        if self.burst_sampler is not None:
+            self.burst_sampler.pause()
+        if self.backends.backend is not None:
+            # Switched over from in-process sampling
+            self.backends.reset()
+        self.shared_status = status
+        self.diagnostics.count('samples', 'shared sampler')
+        if self.replay is not None:
+            # The recording drives the displays
+            return
+        if self.burst_sampler is not None:
+            self.burst_sampler.aggregator.add(devices)
+        else:
+            self.on_gpu_data(devices)
+
+    def on_shared_sampler_lost(self):
+        """Fall back to in-process sampling, retry the service later"""
+        self.shared_sampler = None
+        self.shared_status = None
+        if self.burst_sampler is not None:
+            self.burst_sampler.resume()
+        if self.preferences['shared_sampler']:
+            GLib.timeout_add_seconds(60, self.start_shared_sampler, False)
+
+    def start_remote_polling(self):
+        """Poll the agents of the hosts listed in the preferences"""
+        addresses = [address.strip() for address
+                     in self.preferences['remote_hosts'].split(',')
+                     if address.strip()]
+        if addresses:
+            self.remote = RemotePoller(addresses,
+                                       self.effective_interval * 1000,
+                                       self.preferences['remote_timeout'],
+                                       self.remote_interval_ms(),
+                                       self.sampled_metrics())
+
+    def stop_remote_polling(self):
+        if self.remote is not None:
+            self.remote.stop()
+            self.remote = None
+
+    def on_gpu_data(self, devices, timestamp=None):
+        """Store a new sample for charts and refresh displays"""
+        if timestamp is None:
+            timestamp = time.time()
+        if self.remote is not None and self.replay is None:
+            devices = devices + self.remote.latest()
+        new_ids = self.store_sample(devices, timestamp)
+        first = self.startup is not None
+        if first:
+            self.diagnostics.record('startup', 'first sample',
+                                    time.perf_counter() - self.startup)
+            self.startup = None
+        if self.replay is None:
+            if self.metrics_server:
+                self.metrics_server.publish(devices)
+            if self.recorder:
+                self.recorder.write(timestamp, devices)
+            # Ongoing events need their durations refreshed
+            if (self.throttle.update(devices, timestamp) or
+                    self.throttle.active):
+                self.show_throttling()
+
+        # The first sample replaces the placeholder label with the charts,
+        # newly seen GPUs and hosts get their own panel charts
+        if self.preferences['show_chart'] and (
+                first or (new_ids and self.preferences['multi_gpu_mode']
+                          in ('per_gpu', 'per_host'))):
+            self.update_panel_display()
 
         # Update chart window if open
-        if self.chart_window and self.chart_window.get_visible():
-            self.chart_drawing_area.queue_draw()
+        if self.chart_window:
+            self.render_scheduler.invalidate(self.chart_drawing_area)
 
         # Update panel display based on mode
         if self.preferences['show_chart']:
             for area in self.chart_areas.values():
-                area.queue_draw()
+                self.render_scheduler.invalidate(area)
         else:
-            gpu_info = self.format_display(usage=data['usage'],
-                                           temp=data['temp'],
-                                           mem_percent=data['memory'])
-            self.label.set_text(gpu_info)
-        return True
+            self.render_scheduler.set_text(self.label,
+                                           self.format_sample(devices))
+
+        if self.replay is None:
+            self.adapt_interval(devices)
+        self.update_tooltip()
+
+    def host_sort_key(self, host):
+        """Sort this host first, like its GPUs, then the others by name"""
+        return (host != self.local_host, host)
+
+    def store_sample(self, devices, current_time):
+        """Append a sample to the history, return newly seen keys"""
+        by_id = {device['id']: device for device in devices}
+        new_ids = [device_id for device_id in by_id
+                   if device_id not in self.history]
+        for device_id in new_ids:
+            self.history[device_id] = self.new_series(device_id)
+        if new_ids:
+            self.device_ids = sorted(self.device_ids + new_ids,
+                                     key=device_sort_key)
+
+        # Each host gets the maximum of its GPUs once remote GPUs show up
+        by_host = {}
+        for device in devices:
+            host = device_host(device['id']) or self.local_host
+            by_host.setdefault(host, []).append(device)
+        if self.host_keys or any(host != self.local_host
+                                 for host in by_host):
+            new_hosts = [host for host in by_host
+                         if host not in self.host_keys]
+            for host in new_hosts:
+                self.history[host] = self.new_series(host)
+            if new_hosts:
+                self.host_keys = sorted(self.host_keys + new_hosts,
+                                        key=self.host_sort_key)
+                new_ids = new_ids + new_hosts
+
+        self.timestamps.append({'time': current_time})
+        for device_id in self.device_ids:
+            device = by_id.get(device_id)
+            values = {}
+            if device:
+                values = {metric: device.get(field) for metric, field
+                          in METRIC_FIELDS.items()}
+                for column, field in BURST_FIELDS.items():
+                    values[column] = device.get(field)
+            self.history[device_id].append(current_time, values)
+        for how in ('max', 'avg'):
+            self.history[how].append(current_time,
+                                     self.combine(devices, how))
+        for host in self.host_keys:
+            self.history[host].append(
+                current_time, self.combine(by_host.get(host, []), 'max'))
+        return new_ids
+
+    def watch_screensaver(self):
+        """Track whether the screen is locked"""
+        # Connecting to the bus may take a while, never wait for it
+        Gio.bus_get(Gio.BusType.SESSION, None, self.on_session_bus)
+
+    def on_session_bus(self, source, result):
+        try:
+            bus = Gio.bus_get_finish(result)
+            bus.signal_subscribe(None, 'org.mate.ScreenSaver',
+                                 'ActiveChanged', '/org/mate/ScreenSaver',
+                                 None, Gio.DBusSignalFlags.NONE,
+                                 self.on_screensaver_changed)
+        except Exception:
+            pass  # Without a session bus the lock is not tracked
+
+    def on_screensaver_changed(self, connection, sender, path, interface,
+                               signal, parameters):
+        self.screen_locked = bool(parameters.unpack()[0])
+        self.on_visibility_changed()
+
+    def is_on_screen(self):
+        """Return True if the applet or the chart window can be seen"""
+        if self.screen_locked:
+            return False
+        if self.chart_window and self.chart_window.get_visible():
+            return True
+        return self.applet.get_mapped()
+
+    def on_visibility_changed(self, *args):
+        """Poll at the base rate again as soon as something is shown"""
+        if (self.preferences['adaptive_polling'] and self.is_on_screen() and
+                self.poller.reason == "hidden"):
+            self.poller.wake()
+            self.set_effective_interval(self.poller.interval)
+            self.update_gpu_info()
+
+    def adapt_interval(self, devices):
+        """Reschedule polling from the latest sample"""
+        if not self.preferences['adaptive_polling']:
+            return
+        self.set_effective_interval(
+            self.poller.update(devices, self.is_on_screen()))
+
+    def set_effective_interval(self, interval):
+        # Burst sampling pauses while idle or hidden, maybe at the same
+        # interval
+        if (interval != self.effective_interval or
+                self.sampling_interval_ms() != self.sampling_ms):
+            self.effective_interval = interval
+            self.restart_timer()
+
+    def update_tooltip(self):
+        """Show backend selection and probe timings in the tooltip"""
+        if self.replay is not None:
+            status = "Replaying a recorded session"
+        elif self.shared_sampler is not None and self.shared_status:
+            status = f"{self.shared_status}\n(shared sampler)"
+        else:
+            status = self.backends.describe()
+        if self.preferences['adaptive_polling']:
+            status += (f"\nPolling every {self.effective_interval} s"
+                       f" ({self.poller.reason})")
+        else:
+            status += f"\nPolling every {self.effective_interval} s"
+        if self.remote is not None:
+            status += "\n\nRemote hosts:\n" + self.remote.describe()
+        if self.throttle.active:
+            status += "\n\nThrottling now:\n" + "\n".join(
+                ThrottleDetector.describe(event)
+                for event in self.throttle.active.values())
+        if self.gpu_processes:
+            status += "\n\nTop processes:\n" + self.format_processes()
+        if status != self.backend_status:
+            self.backend_status = status
+            self.applet.set_tooltip_text(status)
 
     def load_preferences(self):
         """Load preferences from config file"""
@@ -188,14 +4260,184 @@ class GPUApplet:
         preferences_action.connect("activate", self.show_preferences)
         action_group.add_action(preferences_action)
 
+        diagnostics_action = Gtk.Action("Diagnostics", "Diagnostics",
+                                        "Show the applet's own overhead",
+                                        None)
+        diagnostics_action.connect("activate", self.show_diagnostics)
+        action_group.add_action(diagnostics_action)
+
+        self.record_action = Gtk.ToggleAction(
+            "Record", "Record Session", "Write every sample to a file",
+            None)
+        self.record_action.connect("toggled", self.on_record_toggled)
+        action_group.add_action(self.record_action)
+
+        self.replay_action = Gtk.ToggleAction(
+            "Replay", "Replay Session...", "Play a recorded session back",
+            None)
+        self.replay_action.connect("toggled", self.on_replay_toggled)
+        action_group.add_action(self.replay_action)
+
         menu_xml = '''
         <menuitem name="Chart" action="Chart" />
         <separator/>
         <menuitem name="Preferences" action="Preferences" />
+        <menuitem name="Diagnostics" action="Diagnostics" />
+        <separator/>
+        <menuitem name="Record" action="Record" />
+        <menuitem name="Replay" action="Replay" />
         '''
 
         self.applet.setup_menu(menu_xml, action_group)
 
+    def recording_dir(self):
+        return (self.preferences['recording_dir'] or
+                os.path.expanduser("~/.cache/mate-gpu-applet/recordings"))
+
+    def on_record_toggled(self, action):
+        """Start or stop writing samples to a new recording"""
+        if action.get_active() and self.recorder is None:
+            path = os.path.join(
+                self.recording_dir(),
+                time.strftime("session-%Y%m%d-%H%M%S.gpurec"))
+            try:
+                self.recorder = SessionRecorder(path)
+            except OSError:
+                action.set_active(False)
+        elif not action.get_active() and self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def on_replay_toggled(self, action):
+        """Pick a recording and replay it, or stop replaying"""
+        if not action.get_active():
+            self.stop_replay()
+            return
+        if self.replay is not None:
+            return
+
+        chooser = Gtk.FileChooserDialog(
+            "Replay Session", None, Gtk.FileChooserAction.OPEN)
+        chooser.add_button("Cancel", Gtk.ResponseType.CANCEL)
+        chooser.add_button("Replay", Gtk.ResponseType.OK)
+        os.makedirs(self.recording_dir(), exist_ok=True)
+        chooser.set_current_folder(self.recording_dir())
+        file_filter = Gtk.FileFilter()
+        file_filter.set_name("Session recordings")
+        file_filter.add_pattern("*.gpurec")
+        chooser.add_filter(file_filter)
+
+        speed_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                            spacing=10)
+        speed_box.pack_start(Gtk.Label("Speed:"), False, False, 0)
+        speed_combo = Gtk.ComboBoxText()
+        for speed in (1, 10, 60, 600):
+            speed_combo.append(str(speed), f"{speed}x")
+        speed_combo.set_active_id(str(self.preferences['replay_speed']))
+        speed_box.pack_start(speed_combo, False, False, 0)
+        speed_box.show_all()
+        chooser.set_extra_widget(speed_box)
+
+        path = None
+        if chooser.run() == Gtk.ResponseType.OK:
+            path = chooser.get_filename()
+            if speed_combo.get_active_id():
+                self.preferences['replay_speed'] = int(
+                    speed_combo.get_active_id())
+                self.save_preferences()
+        chooser.destroy()
+
+        if path is None or not self.start_replay(path):
+            action.set_active(False)
+
+    def start_replay(self, path):
+        """Show a recording instead of the live samples"""
+        try:
+            replay = SessionReplay(path, self.preferences['replay_speed'],
+                                   self.on_gpu_data, self.on_replay_done)
+        except (OSError, ValueError):
+            return False
+
+        # Keep the live history aside until the replay stops
+        self.live_history = (self.timestamps, self.device_ids,
+                             self.host_keys, self.history,
+                             self.history_store)
+        self.timestamps = TimeSeries(HISTORY_TIERS[0][2], ('time',))
+        self.device_ids = []
+        self.host_keys = []
+        self.history = {}
+        self.history_store = None
+        for key in ('max', 'avg'):
+            self.history[key] = self.new_series(key)
+        self.replay = replay
+        self.update_panel_display()
+        self.refresh_charts()
+        replay.start()
+        return True
+
+    def on_replay_done(self):
+        """Leave the last replayed sample on screen until unchecked"""
+        self.replay.timer_id = None
+
+    def stop_replay(self):
+        """Go back to the live samples"""
+        if self.replay is None:
+            return
+        self.replay.stop()
+        self.replay = None
+        (self.timestamps, self.device_ids, self.host_keys, self.history,
+         self.history_store) = self.live_history
+        self.live_history = None
+        self.update_panel_display()
+        self.refresh_charts()
+
+    def show_diagnostics(self, action):
+        """Show the diagnostics dialog, with saving as JSON"""
+        dialog = Gtk.Dialog("GPU Monitor Diagnostics", None,
+                            Gtk.DialogFlags.DESTROY_WITH_PARENT)
+        dialog.add_button("Save JSON...", 1)
+        dialog.add_button("Refresh", 2)
+        dialog.add_button("Close", Gtk.ResponseType.CLOSE)
+        dialog.set_default_size(500, 300)
+
+        content = dialog.get_content_area()
+        content.set_border_width(10)
+        label = Gtk.Label(self.describe_diagnostics())
+        label.set_selectable(True)
+        label.set_xalign(0)
+        content.pack_start(label, True, True, 0)
+        dialog.show_all()
+
+        while True:
+            response = dialog.run()
+            if response == 1:
+                self.save_diagnostics(dialog)
+            elif response == 2:
+                label.set_text(self.describe_diagnostics())
+            else:
+                break
+        dialog.destroy()
+
+    def describe_diagnostics(self):
+        return (self.render_scheduler.describe() + "\n" +
+                self.diagnostics.describe())
+
+    def save_diagnostics(self, parent):
+        """Ask for a file name and write the diagnostics as JSON"""
+        chooser = Gtk.FileChooserDialog(
+            "Save Diagnostics", parent, Gtk.FileChooserAction.SAVE)
+        chooser.add_button("Cancel", Gtk.ResponseType.CANCEL)
+        chooser.add_button("Save", Gtk.ResponseType.OK)
+        chooser.set_do_overwrite_confirmation(True)
+        chooser.set_current_name("gpu-applet-diagnostics.json")
+        if chooser.run() == Gtk.ResponseType.OK:
+            try:
+                with open(chooser.get_filename(), 'w') as f:
+                    f.write(self.diagnostics.to_json())
+            except OSError:
+                pass
+        chooser.destroy()
+
     def show_preferences(self, action):
         """Show preferences dialog"""
         dialog = Gtk.Dialog("GPU Monitor Preferences", None,
@@ -209,18 +4451,15 @@ class GPUApplet:
         content.set_spacing(10)
         content.set_border_width(10)
 
-        # Create checkboxes
-        self.gpu_load_check = Gtk.CheckButton("Show GPU Load")
-        self.gpu_load_check.set_active(self.preferences['show_gpu_load'])
-        content.pack_start(self.gpu_load_check, False, False, 0)
-
-        self.temp_check = Gtk.CheckButton("Show Temperature")
-        self.temp_check.set_active(self.preferences['show_temperature'])
-        content.pack_start(self.temp_check, False, False, 0)
-
-        self.memory_check = Gtk.CheckButton("Show Memory Usage")
-        self.memory_check.set_active(self.preferences['show_memory'])
-        content.pack_start(self.memory_check, False, False, 0)
+        # Create a checkbox per metric, two columns of them
+        metric_grid = Gtk.Grid(column_spacing=10, row_spacing=2)
+        self.metric_checks = {}
+        for i, (name, metric) in enumerate(METRICS.items()):
+            check = Gtk.CheckButton(metric['check'])
+            check.set_active(self.preferences[metric['preference']])
+            metric_grid.attach(check, i % 2, i // 2, 1, 1)
+            self.metric_checks[name] = check
+        content.pack_start(metric_grid, False, False, 0)
 
         # Add separator
         separator = Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL)
@@ -293,6 +4532,115 @@ class GPUApplet:
 
         content.pack_start(interval_box, False, False, 0)
 
+        # Adaptive polling controls
+        self.adaptive_polling_check = Gtk.CheckButton(
+            "Poll less often while idle or hidden")
+        self.adaptive_polling_check.set_active(
+            self.preferences['adaptive_polling'])
+        content.pack_start(self.adaptive_polling_check, False, False, 0)
+
+        adaptive_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                               spacing=10)
+        adaptive_label = Gtk.Label("Adaptive Range (seconds):")
+        adaptive_box.pack_start(adaptive_label, False, False, 0)
+
+        self.min_interval_spin = Gtk.SpinButton()
+        self.min_interval_spin.set_range(1, 10)
+        self.min_interval_spin.set_increments(1, 1)
+        self.min_interval_spin.set_value(
+            self.preferences['min_update_interval'])
+        adaptive_box.pack_start(self.min_interval_spin, False, False, 0)
+
+        self.max_interval_spin = Gtk.SpinButton()
+        self.max_interval_spin.set_range(1, 300)
+        self.max_interval_spin.set_increments(1, 10)
+        self.max_interval_spin.set_value(
+            self.preferences['max_update_interval'])
+        adaptive_box.pack_start(self.max_interval_spin, False, False, 0)
+
+        content.pack_start(adaptive_box, False, False, 0)
+
+        # Burst sampling controls
+        burst_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                            spacing=10)
+        self.burst_sampling_check = Gtk.CheckButton(
+            "Catch short bursts, sample every (ms):")
+        self.burst_sampling_check.set_active(
+            self.preferences['burst_sampling'])
+        burst_box.pack_start(self.burst_sampling_check, False, False, 0)
+
+        self.burst_interval_spin = Gtk.SpinButton()
+        self.burst_interval_spin.set_range(100, 1000)
+        self.burst_interval_spin.set_increments(50, 100)
+        self.burst_interval_spin.set_value(
+            self.preferences['burst_interval_ms'])
+        burst_box.pack_start(self.burst_interval_spin, False, False, 0)
+
+        content.pack_start(burst_box, False, False, 0)
+
+        # Metrics endpoint controls
+        metrics_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                              spacing=10)
+        self.metrics_endpoint_check = Gtk.CheckButton(
+            "Serve metrics on localhost, port:")
+        self.metrics_endpoint_check.set_active(
+            self.preferences['metrics_endpoint'])
+        metrics_box.pack_start(self.metrics_endpoint_check, False, False, 0)
+
+        self.metrics_port_spin = Gtk.SpinButton()
+        self.metrics_port_spin.set_range(1024, 65535)
+        self.metrics_port_spin.set_increments(1, 100)
+        self.metrics_port_spin.set_value(self.preferences['metrics_port'])
+        metrics_box.pack_start(self.metrics_port_spin, False, False, 0)
+
+        content.pack_start(metrics_box, False, False, 0)
+
+        self.show_processes_check = Gtk.CheckButton(
+            "List the processes using the GPUs")
+        self.show_processes_check.set_active(
+            self.preferences['show_processes'])
+        content.pack_start(self.show_processes_check, False, False, 0)
+
+        # Multiple GPU display control
+        multi_gpu_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                                spacing=10)
+        multi_gpu_label = Gtk.Label("Multiple GPUs:")
+        multi_gpu_box.pack_start(multi_gpu_label, False, False, 0)
+
+        self.multi_gpu_combo = Gtk.ComboBoxText()
+        for mode, title in MULTI_GPU_MODES.items():
+            self.multi_gpu_combo.append(mode, title)
+        self.multi_gpu_combo.set_active_id(
+            self.preferences['multi_gpu_mode'])
+        multi_gpu_box.pack_start(self.multi_gpu_combo, False, False, 0)
+
+        content.pack_start(multi_gpu_box, False, False, 0)
+
+        self.persist_history_check = Gtk.CheckButton(
+            "Keep history across restarts")
+        self.persist_history_check.set_active(
+            self.preferences['persist_history'])
+        content.pack_start(self.persist_history_check, False, False, 0)
+
+        self.shared_sampler_check = Gtk.CheckButton(
+            "Share sampling with other applets")
+        self.shared_sampler_check.set_active(
+            self.preferences['shared_sampler'])
+        content.pack_start(self.shared_sampler_check, False, False, 0)
+
+        # Agents on other hosts
+        remote_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                             spacing=10)
+        remote_label = Gtk.Label("Remote hosts:")
+        remote_box.pack_start(remote_label, False, False, 0)
+
+        self.remote_hosts_entry = Gtk.Entry()
+        self.remote_hosts_entry.set_text(self.preferences['remote_hosts'])
+        self.remote_hosts_entry.set_placeholder_text("host[:port], ...")
+        remote_box.pack_start(self.remote_hosts_entry, True, True, 0)
+
+        content.pack_start(remote_box, False, False, 0)
+
         dialog.show_all()
 
         response = dialog.run()
@@ -302,13 +4650,20 @@ class GPUApplet:
             old_chart_width = self.preferences['chart_width']
             old_transparency = self.preferences['chart_transparency']
             old_font_size = self.preferences['chart_font_size']
-            old_update_interval = self.preferences['update_interval']
-            self.preferences['show_gpu_load'] = \
-                self.gpu_load_check.get_active()
-            self.preferences['show_temperature'] = \
-                self.temp_check.get_active()
-            self.preferences['show_memory'] = \
-                self.memory_check.get_active()
+            old_metrics = (self.preferences['metrics_endpoint'],
+                           self.preferences['metrics_port'])
+            old_polling = (self.preferences['update_interval'],
+                           self.preferences['adaptive_polling'],
+                           self.preferences['min_update_interval'],
+                           self.preferences['max_update_interval'],
+                           self.preferences['burst_sampling'],
+                           self.preferences['burst_interval_ms'])
+            old_multi_gpu_mode = self.preferences['multi_gpu_mode']
+            old_remote_hosts = self.preferences['remote_hosts']
+            old_shown = self.shown_metrics()
+            for name, check in self.metric_checks.items():
+                self.preferences[METRICS[name]['preference']] = \
+                    check.get_active()
             self.preferences['show_chart'] = \
                 self.chart_view_check.get_active()
             self.preferences['chart_width'] = \
@@ -319,11 +4674,78 @@ class GPUApplet:
                 int(self.chart_font_size_spin.get_value())
             self.preferences['update_interval'] = \
                 int(self.update_interval_spin.get_value())
+            self.preferences['adaptive_polling'] = \
+                self.adaptive_polling_check.get_active()
+            self.preferences['min_update_interval'] = \
+                int(self.min_interval_spin.get_value())
+            self.preferences['max_update_interval'] = \
+                int(self.max_interval_spin.get_value())
+            self.preferences['burst_sampling'] = \
+                self.burst_sampling_check.get_active()
+            self.preferences['burst_interval_ms'] = \
+                int(self.burst_interval_spin.get_value())
+            self.preferences['metrics_endpoint'] = \
+                self.metrics_endpoint_check.get_active()
+            self.preferences['metrics_port'] = \
+                int(self.metrics_port_spin.get_value())
+            self.preferences['show_processes'] = \
+                self.show_processes_check.get_active()
+            self.preferences['multi_gpu_mode'] = \
+                self.multi_gpu_combo.get_active_id()
+            self.preferences['persist_history'] = \
+                self.persist_history_check.get_active()
+            self.preferences['shared_sampler'] = \
+                self.shared_sampler_check.get_active()
+            self.preferences['remote_hosts'] = \
+                self.remote_hosts_entry.get_text().strip()
             self.save_preferences()
 
-            # Switch display mode if chart preference changed
-            if old_chart_mode != self.preferences['show_chart']:
+            if self.preferences['persist_history']:
+                if not self.history_store:
+                    self.open_history_store()
+            else:
+                self.close_history_store()
+
+            if self.preferences['show_processes']:
+                if self.process_monitor is None:
+                    self.start_process_monitor()
+            else:
+                self.stop_process_monitor()
+
+            if old_metrics != (self.preferences['metrics_endpoint'],
+                               self.preferences['metrics_port']):
+                self.stop_metrics_server()
+                if self.preferences['metrics_endpoint']:
+                    self.start_metrics_server()
+
+            if self.preferences['shared_sampler']:
+                if self.shared_sampler is None:
+                    self.start_shared_sampler()
+            elif self.shared_sampler is not None:
+                self.shared_sampler.close()
+                self.shared_sampler = None
+                self.shared_status = None
+
+            if old_remote_hosts != self.preferences['remote_hosts']:
+                self.stop_remote_polling()
+                self.start_remote_polling()
+
+            # Sample only the metrics still shown
+            if old_shown != self.shown_metrics():
+                self.backends.set_metrics(self.sampled_metrics())
+                if self.shared_sampler is not None:
+                    self.shared_sampler.set_metrics(self.sampled_metrics())
+                if self.remote is not None:
+                    self.remote.set_metrics(self.sampled_metrics())
+
+            # Switch display mode if chart, metric or multi GPU preference
+            # changed
+            if (old_chart_mode != self.preferences['show_chart'] or
+                    old_shown != self.shown_metrics() or
+                    old_multi_gpu_mode !=
+                    self.preferences['multi_gpu_mode']):
                 self.switch_display_mode()
+                self.refresh_charts()
             # Update chart size if width changed
             elif (self.preferences['show_chart'] and
                   old_chart_width != self.preferences['chart_width']):
@@ -332,8 +4754,29 @@ class GPUApplet:
             elif (old_transparency != self.preferences['chart_transparency'] or
                   old_font_size != self.preferences['chart_font_size']):
                 self.refresh_charts()
-            # Restart timer if update interval changed
-            elif old_update_interval != self.preferences['update_interval']:
+            # Restart timer and sampler if the polling settings changed
+            if old_polling != (self.preferences['update_interval'],
+                               self.preferences['adaptive_polling'],
+                               self.preferences['min_update_interval'],
+                               self.preferences['max_update_interval'],
+                               self.preferences['burst_sampling'],
+                               self.preferences['burst_interval_ms']):
+                if (self.preferences['burst_sampling'] and
+                        self.burst_sampler is None):
+                    self.start_burst_sampling()
+                    if self.shared_sampler is not None:
+                        self.burst_sampler.pause()
+                elif (not self.preferences['burst_sampling'] and
+                        self.burst_sampler is not None):
+                    self.stop_burst_sampling()
+                self.poller.configure(
+                    self.preferences['update_interval'],
+                    self.preferences['min_update_interval'],
+                    self.preferences['max_update_interval'])
+                self.effective_interval = (
+                    self.poller.interval
+                    if self.preferences['adaptive_polling']
+                    else self.preferences['update_interval'])
                 self.restart_timer()
 
         dialog.destroy()
@@ -342,6 +4785,7 @@ class GPUApplet:
         """Show chart window"""
         if self.chart_window:
             self.chart_window.present()
+            self.on_visibility_changed()
             return
 
         self.chart_window = Gtk.Window()
@@ -349,13 +4793,55 @@ class GPUApplet:
         self.chart_window.set_default_size(600, 400)
         self.chart_window.set_position(Gtk.WindowPosition.CENTER)
 
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+
+        # Time range selector
+        range_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                            spacing=10)
+        range_box.set_border_width(5)
+        range_label = Gtk.Label("Time Range:")
+        range_box.pack_start(range_label, False, False, 0)
+
+        self.time_range_combo = Gtk.ComboBoxText()
+        for tier, title in TIME_RANGES.items():
+            self.time_range_combo.append(tier, title)
+        self.time_range_combo.set_active_id(
+            self.preferences['chart_time_range'])
+        self.time_range_combo.connect('changed', self.on_time_range_changed)
+        range_box.pack_start(self.time_range_combo, False, False, 0)
+
+        box.pack_start(range_box, False, False, 0)
+
         # Create drawing area
         self.chart_drawing_area = Gtk.DrawingArea()
-        self.chart_drawing_area.connect('draw', self.on_chart_draw)
-
-        self.chart_window.add(self.chart_drawing_area)
+        self.chart_drawing_area.connect('draw', self.timed_draw, 'window',
+                                        self.on_chart_draw)
+        box.pack_start(self.chart_drawing_area, True, True, 0)
+
+        # Top GPU processes of the latest scan
+        self.processes_label = Gtk.Label(self.format_processes())
+        self.processes_label.set_xalign(0)
+        self.processes_label.set_margin_start(10)
+        self.processes_label.set_margin_bottom(5)
+        box.pack_start(self.processes_label, False, False, 0)
+
+        # Latest throttling events with their durations
+        self.throttle_label = Gtk.Label(self.format_throttling())
+        self.throttle_label.set_xalign(0)
+        self.throttle_label.set_margin_start(10)
+        self.throttle_label.set_margin_bottom(5)
+        box.pack_start(self.throttle_label, False, False, 0)
+
+        self.chart_window.add(box)
         self.chart_window.connect('delete-event', self.on_chart_window_delete)
         self.chart_window.show_all()
+        self.on_visibility_changed()
+
+    def on_time_range_changed(self, combo):
+        """Redraw the chart window from another history tier"""
+        self.preferences['chart_time_range'] = combo.get_active_id()
+        self.save_preferences()
+        self.render_scheduler.invalidate(self.chart_drawing_area)
 
     def on_chart_window_delete(self, window, event):
         """Handle chart window close"""
@@ -372,7 +4858,11 @@ class GPUApplet:
         cr.set_source_rgb(0.1, 0.1, 0.1)
         cr.paint()
 
-        if not self.timestamps or len(self.timestamps) < 2:
+        tier = self.preferences['chart_time_range']
+        if tier not in TIME_RANGES:
+            tier = 'raw'
+
+        if len(self.history['max'].tiers[tier]) < 2:
             # No data yet
             cr.set_source_rgb(1, 1, 1)
             cr.select_font_face("Arial", cairo.FONT_SLANT_NORMAL,
@@ -384,26 +4874,34 @@ class GPUApplet:
             cr.show_text(text)
             return
 
+        # One band of charts per displayed device
+        keys = self.displayed_keys()
+        row_height = height / len(keys)
+        # Stacked bands only need a small gap between each other
+        margin_bottom = 40 if len(keys) == 1 else 10
+        for row, key in enumerate(keys):
+            title = f"{self.key_name(key)}: " if len(keys) > 1 else ""
+            self.draw_chart_row(cr, row * row_height, width, row_height,
+                                margin_bottom, key, title, tier)
+
+    def draw_chart_row(self, cr, top, width, height, margin_bottom, key,
+                       title, tier='raw'):
+        """Draw the charts of one history key into a horizontal band"""
         # Chart area margins
         margin_left = 60
         margin_right = 20
-        margin_top = 20
-        margin_bottom = 40
+        margin_top = top + 20
 
         chart_width = width - margin_left - margin_right
-        chart_height = height - margin_top - margin_bottom
+        chart_height = height - 20 - margin_bottom
+        series = self.history[key].tiers[tier]
 
         # Draw enabled charts
-        charts_to_draw = []
-        if self.preferences['show_gpu_load']:
-            charts_to_draw.append(('GPU Load (%)', self.gpu_data,
-                                   (0.3, 0.7, 1.0), 100))
-        if self.preferences['show_temperature']:
-            charts_to_draw.append(('Temperature (°C)', self.temp_data,
-                                   (1.0, 0.5, 0.2), 100))
-        if self.preferences['show_memory']:
-            charts_to_draw.append(('Memory (%)', self.memory_data,
-                                   (0.2, 0.8, 0.2), 100))
+        charts_to_draw = [
+            (f"{METRICS[metric]['title']} ({METRICS[metric]['unit']})",
+             metric, METRICS[metric]['color'],
+             self.chart_scale(series, metric, tier))
+            for metric in self.shown_metrics()]
 
         if not charts_to_draw:
             cr.set_source_rgb(1, 1, 1)
@@ -412,11 +4910,11 @@ class GPUApplet:
             cr.set_font_size(16)
             text = "No charts enabled"
             text_extents = cr.text_extents(text)
-            cr.move_to((width - text_extents.width) / 2, height / 2)
+            cr.move_to((width - text_extents.width) / 2, top + height / 2)
             cr.show_text(text)
             return
 
-        # Draw grid
+        # Draw grid, all lines in one stroke
         cr.set_source_rgb(0.3, 0.3, 0.3)
         cr.set_line_width(1)
 
@@ -425,14 +4923,17 @@ class GPUApplet:
             x = margin_left + (chart_width * i / 10)
             cr.move_to(x, margin_top)
             cr.line_to(x, margin_top + chart_height)
-            cr.stroke()
 
         # Horizontal grid lines
         for i in range(0, 6):
             y = margin_top + (chart_height * i / 5)
             cr.move_to(margin_left, y)
             cr.line_to(margin_left + chart_width, y)
-            cr.stroke()
+        cr.stroke()
+
+        # Shade the time spans of throttling events
+        self.draw_throttle_marks(cr, series, key, margin_left, margin_top,
+                                 chart_width, chart_height)
 
         # Draw Y-axis labels
         cr.set_source_rgb(0.8, 0.8, 0.8)
@@ -440,79 +4941,127 @@ class GPUApplet:
                             cairo.FONT_WEIGHT_NORMAL)
         cr.set_font_size(10)
 
+        # Label the values of the charts if they share a scale, else the
+        # share of each chart's own scale given in the legend
+        scales = {max_val for _, _, _, max_val in charts_to_draw}
+        shared = len(scales) == 1
+        top_value = scales.pop() if shared else 100
+        suffix = "" if shared else "%"
         for i in range(0, 6):
-            value = 100 - (i * 20)
+            value = top_value * (5 - i) / 5
             y = margin_top + (chart_height * i / 5)
             cr.move_to(5, y + 4)
-            cr.show_text(f"{value}")
+            cr.show_text(f"{value:.0f}{suffix}")
 
         # Draw charts
-        for name, data, color, max_val in charts_to_draw:
-            if not any(d is not None for d in data):
+        for name, metric, color, max_val in charts_to_draw:
+            if not series.has_data(metric):
                 continue
 
-            valid_points = [(i, val) for i, val in enumerate(data)
-                            if val is not None]
-            if len(valid_points) < 2:
+            # Trace the line once and reuse it for the fill and the border,
+            # through about one value per pixel however long the history
+            cr.new_path()
+            if trace_series(cr, series, metric, margin_left, margin_top,
+                            chart_width, chart_height, max_val) < 2:
+                cr.new_path()
                 continue
+            line = cr.copy_path()
 
             # Calculate transparency alpha value (0-1)
             alpha = self.preferences['chart_transparency'] / 100.0
 
-            # Draw filled area
             cr.set_source_rgba(*color, alpha)
-            first_point = True
-            for i, value in valid_points:
-                x = margin_left + (chart_width * i / (len(data) - 1))
-                y = (margin_top + chart_height -
-                     (chart_height * value / max_val))
-
-                if first_point:
-                    cr.move_to(x, y)
-                    first_point = False
-                else:
-                    cr.line_to(x, y)
-
-            # Close the path by drawing to bottom corners
-            if valid_points:
-                last_x = margin_left + (
-                    chart_width * (len(data) - 1) / (len(data) - 1))
-                first_x = margin_left
-                cr.line_to(last_x, margin_top + chart_height)
-                cr.line_to(first_x, margin_top + chart_height)
-                cr.close_path()
-                cr.fill()
+            if tier == 'raw':
+                # Draw filled area, closing the path at the bottom corners
+                cr.line_to(margin_left + chart_width,
+                           margin_top + chart_height)
+                cr.line_to(margin_left, margin_top + chart_height)
+            else:
+                # Draw the min-max band of the buckets behind the average
+                cr.new_path()
+                trace_series(cr, series, metric + '_max', margin_left,
+                             margin_top, chart_width, chart_height, max_val)
+                trace_series(cr, series, metric + '_min', margin_left,
+                             margin_top, chart_width, chart_height, max_val,
+                             reverse=True, connect=True)
+            cr.close_path()
+            cr.fill()
 
             # Draw line border
             cr.set_source_rgb(*color)
             cr.set_line_width(2)
-            first_point = True
-            for i, value in valid_points:
-                x = margin_left + (chart_width * i / (len(data) - 1))
-                y = (margin_top + chart_height -
-                     (chart_height * value / max_val))
-
-                if first_point:
-                    cr.move_to(x, y)
-                    first_point = False
-                else:
-                    cr.line_to(x, y)
-
+            cr.append_path(line)
             cr.stroke()
 
-        # Draw legend
+            # Draw the burst peaks of raw samples as a thin line
+            peak = metric + '_peak'
+            if (tier == 'raw' and peak in series.columns and
+                    series.has_data(peak)):
+                cr.set_source_rgba(1, 1, 1, 0.6)
+                cr.set_line_width(1)
+                trace_series(cr, series, peak, margin_left, margin_top,
+                             chart_width, chart_height, max_val)
+                cr.stroke()
+
+        # Draw legend with the window statistics of each metric
         legend_y = margin_top + 10
-        for i, (name, data, color, max_val) in enumerate(charts_to_draw):
+        for i, (name, metric, color, max_val) in enumerate(charts_to_draw):
             cr.set_source_rgb(*color)
             cr.rectangle(margin_left + 10, legend_y + i * 20, 15, 3)
             cr.fill()
 
+            text = title + name
+            if series.has_data(metric):
+                if tier == 'raw':
+                    low, high = series.min(metric), series.max(metric)
+                    peak = metric + '_peak'
+                    if peak in series.columns and series.has_data(peak):
+                        high = max(high, series.max(peak))
+                else:
+                    low = series.min(metric + '_min')
+                    high = series.max(metric + '_max')
+                text += (f"  min {low:.0f}"
+                         f"  avg {series.mean(metric):.0f}"
+                         f"  max {high:.0f}")
+                if not shared:
+                    text += f"  (0-{max_val:.0f})"
             cr.set_source_rgb(1, 1, 1)
             cr.move_to(margin_left + 30, legend_y + i * 20 + 10)
-            cr.show_text(name)
+            cr.show_text(text)
+
+    def draw_throttle_marks(self, cr, series, key, x, y, width, height):
+        """Shade the spans of throttling events behind the charts"""
+        if not self.throttle.log:
+            return
+        # Rows are spread evenly like in trace_series, so find the rows
+        # of an event by time. Padding rows have no time yet.
+        times = series.filled('time')
+        if len(times) < 2:
+            return
+        step = width / (len(times) - 1)
+        for event in self.throttle.events(times[0], times[-1],
+                                          self.key_devices(key)):
+            first = bisect.bisect_left(times, event['start'])
+            end = event['last'] if event['end'] is None else event['end']
+            last = min(bisect.bisect_right(times, end), len(times)) - 1
+            left = x + step * max(first, 0)
+            cr.set_source_rgba(*THROTTLE_REASONS[event['reason']]['color'],
+                               0.25)
+            cr.rectangle(left, y, max(step * (last - first), 2), height)
+            cr.fill()
+
+    @staticmethod
+    def chart_scale(series, metric, tier='raw'):
+        """Return the value at the top of the charts of a metric"""
+        config = METRICS[metric]
+        if config['scale'] is not None:
+            return config['scale']
+        step = config['step']
+        highest = series.max(metric if tier == 'raw' else metric + '_max')
+        return max(step, math.ceil((highest or 0) / step) * step)
 
     def create_chart_areas(self):
-        """Create individual drawing areas for each chart type"""
+        """Create drawing areas for each chart type of displayed devices"""
         # Get panel height dynamically, fallback to 24 if not available
         try:
             panel_height = self.applet.get_size()
@@ -522,57 +5071,32 @@ class GPUApplet:
         chart_height = panel_height
         chart_width = self.preferences['chart_width']
 
-        # GPU Load chart
-        self.chart_areas['gpu'] = Gtk.DrawingArea()
-        self.chart_areas['gpu'].set_size_request(chart_width, chart_height)
-        self.chart_areas['gpu'].connect(
-            'draw', lambda w, cr:
-            self.draw_individual_chart(w, cr, 'gpu'))
-
-        # Temperature chart
-        self.chart_areas['temp'] = Gtk.DrawingArea()
-        self.chart_areas['temp'].set_size_request(chart_width, chart_height)
-        self.chart_areas['temp'].connect(
-            'draw', lambda w, cr:
-            self.draw_individual_chart(w, cr, 'temp'))
-
-        # Memory chart
-        self.chart_areas['memory'] = Gtk.DrawingArea()
-        self.chart_areas['memory'].set_size_request(chart_width, chart_height)
-        self.chart_areas['memory'].connect(
-            'draw', lambda w, cr:
-            self.draw_individual_chart(w, cr, 'memory'))
-
-    def draw_individual_chart(self, widget, cr, chart_type):
+        # A chart for every enabled metric per device
+        for key in self.displayed_keys():
+            for chart_type in self.shown_metrics():
+                if (key, chart_type) in self.chart_areas:
+                    continue
+                area = Gtk.DrawingArea()
+                area.set_size_request(chart_width, chart_height)
+                area.connect('draw', self.timed_draw,
+                             f"panel {key}/{chart_type}",
+                             self.draw_individual_chart, chart_type, key)
+                self.chart_areas[(key, chart_type)] = area
+
+    def draw_individual_chart(self, widget, cr, chart_type, key='max'):
         """Draw individual chart for specific metric"""
         allocation = widget.get_allocation()
         width = allocation.width
         height = allocation.height
-
-        # Chart configuration
-        config = {
-            'gpu': {'data': self.gpu_data, 'color': (0.3, 0.7, 1.0),
-                    'label': 'gpu',
-                    'label': 'gpu',
-                    'enabled': self.preferences['show_gpu_load']},
-            'temp': {'data': self.temp_data, 'color': (1.0, 0.5, 0.2),
-                     'label': 'tmp',
-                     'label': 'tmp',
-                     'enabled': self.preferences['show_temperature']},
-            'memory': {'data': self.memory_data, 'color': (0.2, 0.8, 0.2),
-                       'label': 'mem',
-                       'label': 'mem',
-                       'enabled': self.preferences['show_memory']}
-        }
-
-        chart_config = config[chart_type]
+        series = self.history[key].raw
+        chart_config = METRICS[chart_type]
 
         # Clear background
         cr.set_source_rgb(0.1, 0.1, 0.1)
         cr.paint()
 
-        # Draw border
-        cr.set_source_rgb(0.3, 0.3, 0.3)
+        # Draw border, in the colour of an ongoing throttling
+        cr.set_source_rgb(*(self.throttle_color(key) or (0.3, 0.3, 0.3)))
         cr.set_line_width(1)
         cr.rectangle(0.5, 0.5, width - 1, height - 1)
         cr.stroke()
@@ -589,10 +5113,9 @@ class GPUApplet:
             cr.show_text(text)
             return
 
-        data = chart_config['data']
         color = chart_config['color']
 
-        if not any(d is not None for d in data):
+        if not series.has_data(chart_type):
             # No valid data
             cr.set_source_rgb(0.5, 0.5, 0.5)
             cr.select_font_face("Arial", cairo.FONT_SLANT_NORMAL,
@@ -604,81 +5127,44 @@ class GPUApplet:
             cr.show_text(text)
             return
 
-        # Draw chart
-        margin = 2
-        chart_width = width - (margin * 2)
-        chart_height = height - (margin * 2)
-
-        valid_points = [(i, val) for i, val in enumerate(data)
-                        if val is not None]
-        if len(valid_points) >= 2:
-            # Calculate transparency alpha value (0-1)
-            alpha = self.preferences['chart_transparency'] / 100.0
-
-            # Draw filled area
-            cr.set_source_rgba(*color, alpha)
-            first_point = True
-            for i, value in valid_points:
-                x = margin + (chart_width * i / (len(data) - 1))
-                y = margin + chart_height - (chart_height * value / 100)
-
-                if first_point:
-                    cr.move_to(x, y)
-                    first_point = False
-                else:
-                    cr.line_to(x, y)
-
-            # Close the path by drawing to bottom corners
-            if valid_points:
-                last_x = margin + (
-                    chart_width * (len(data) - 1) / (len(data) - 1))
-                first_x = margin
-                cr.line_to(last_x, margin + chart_height)
-                cr.line_to(first_x, margin + chart_height)
-                cr.close_path()
-                cr.fill()
-
-            # Draw line border
-            cr.set_source_rgb(*color)
-            cr.set_line_width(1.5)
-            first_point = True
-            for i, value in valid_points:
-                x = margin + (chart_width * i / (len(data) - 1))
-                y = margin + chart_height - (chart_height * value / 100)
-
-                if first_point:
-                    cr.move_to(x, y)
-                    first_point = False
-                else:
-                    cr.line_to(x, y)
-
-            cr.stroke()
+        # Draw chart from its offscreen surface, scrolled up to date
+        renderer = self.chart_renderers.get((key, chart_type))
+        if renderer is None:
+            renderer = ScrollingChart(
+                color, 'gpu_peak' if chart_type == 'gpu' else None)
+            self.chart_renderers[(key, chart_type)] = renderer
+        # Calculate transparency alpha value (0-1)
+        alpha = self.preferences['chart_transparency'] / 100.0
+        surface = renderer.render(series, chart_type, width, height, alpha,
+                                  self.max_data_points,
+                                  self.chart_scale(series, chart_type))
+        cr.save()
+        cr.rectangle(1, 1, width - 2, height - 2)
+        cr.clip()
+        cr.set_source_surface(surface, 0, 0)
+        cr.paint()
+        cr.restore()
 
         # Draw current value in top-left corner
-        # Draw current value in top-left corner
-        current_value = data[-1] if data[-1] is not None else 0
+        current_value = series.last(chart_type) or 0
         cr.set_source_rgb(1, 1, 1)
         cr.select_font_face("Arial", cairo.FONT_SLANT_NORMAL,
                             cairo.FONT_WEIGHT_BOLD)
         cr.set_font_size(self.preferences['chart_font_size'])
 
         # Create label with prefix
-        if chart_type == 'gpu':
-            prefix = "g"
-        elif chart_type == 'temp':
-            prefix = "t"
-        elif chart_type == 'memory':
-            prefix = "m"
-        else:
-            prefix = "?"  # Default fallback
+        prefix = chart_config['prefix']
 
-        if chart_type == 'temp':
-            text = f"{prefix}:{int(current_value)}°"
-            text = f"{prefix}:{int(current_value)}°"
-        else:
-            text = f"{prefix}:{int(current_value)}%"
+        # Tell GPUs apart when there is a chart for each
+        if key not in ('max', 'avg') and len(self.device_ids) > 1:
+            prefix += key
 
-        cr.move_to(3, self.preferences['chart_font_size'] + 2)
+        peak = series.last('gpu_peak') if chart_type == 'gpu' else None
+        if peak is not None and peak > current_value:
+            # Average and peak of the burst samples
+            text = f"{prefix}:{int(current_value)}\u2191{int(peak)}%"
+        else:
+            text = f"{prefix}:{int(current_value)}{chart_config['short']}"
 
         cr.move_to(3, self.preferences['chart_font_size'] + 2)
         cr.show_text(text)
@@ -689,17 +5175,13 @@ class GPUApplet:
         for child in self.container.get_children():
             self.container.remove(child)
 
-        if self.preferences['show_chart']:
-            # Add enabled charts
-            if self.preferences['show_gpu_load']:
-                self.container.pack_start(self.chart_areas['gpu'],
-                                          False, False, 1)
-            if self.preferences['show_temperature']:
-                self.container.pack_start(self.chart_areas['temp'],
-                                          False, False, 1)
-            if self.preferences['show_memory']:
-                self.container.pack_start(self.chart_areas['memory'],
-                                          False, False, 1)
+        if self.preferences['show_chart'] and self.startup is None:
+            self.create_chart_areas()
+            # Add enabled charts for every displayed device
+            for key in self.displayed_keys():
+                for chart_type in self.shown_metrics():
+                    self.container.pack_start(
+                        self.chart_areas[(key, chart_type)], False, False, 1)
         else:
             self.container.add(self.label)
 
@@ -723,27 +5205,43 @@ class GPUApplet:
 
         # Force redraw
         for area in self.chart_areas.values():
-            area.queue_draw()
+            self.render_scheduler.invalidate(area)
 
     def refresh_charts(self):
         """Refresh all charts (useful when transparency changes)"""
-        # Force redraw of panel charts
+        # Force full redraw of panel charts
+        for renderer in self.chart_renderers.values():
+            renderer.invalidate()
         for area in self.chart_areas.values():
-            area.queue_draw()
+            self.render_scheduler.invalidate(area)
 
         # Force redraw of chart window if open
-        if self.chart_window and self.chart_window.get_visible():
-            self.chart_drawing_area.queue_draw()
+        if self.chart_window:
+            self.render_scheduler.invalidate(self.chart_drawing_area)
 
     def restart_timer(self):
         """Restart the update timer with new interval"""
         # Remove existing timer
-        if hasattr(self, 'timer_id') and self.timer_id:
+        if self.timer_id:
             GLib.source_remove(self.timer_id)
 
         # Start new timer with updated interval
         self.timer_id = GLib.timeout_add_seconds(
-            self.preferences['update_interval'], self.update_gpu_info)
+            self.effective_interval, self.on_timer)
+        self.timer_due = time.monotonic() + self.effective_interval
+
+        # Backends keep their fastest rate until polling backs off
+        interval_ms = self.sampling_ms = self.sampling_interval_ms()
+        self.backends.set_interval(self.backend_interval_ms())
+        if self.burst_sampler:
+            self.burst_sampler.set_interval(interval_ms)
+        if self.shared_sampler:
+            self.shared_sampler.set_interval(interval_ms,
+                                             self.backend_interval_ms())
+        if self.remote:
+            # Remote samples are only merged into displayed ones
+            self.remote.set_interval(self.effective_interval * 1000,
+                                     self.remote_interval_ms())
 
 
 def applet_factory(applet, iid, data):
@@ -755,13 +5253,19 @@ def applet_factory(applet, iid, data):
 
 
 def main():
-    import sys
     import signal
 
     # Handle SIGINT and SIGTERM gracefully
     signal.signal(signal.SIGINT, signal.SIG_DFL)
     signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
+    if '--sampler-service' in sys.argv[1:]:
+        run_sampler_service(sys.argv[1:])
+        return
+    if '--agent' in sys.argv[1:]:
+        run_remote_agent(sys.argv[1:])
+        return
+
     try:
         MatePanelApplet.Applet.factory_main("GPUAppletFactory", True,
                                             MatePanelApplet.Applet.__gtype__,
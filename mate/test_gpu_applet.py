@@ -0,0 +1,548 @@
+"""Tests of the GPU applet parts that run without a panel
+
+The backends are fed fake sysfs trees and the fake nvidia-smi,
+radeontop and intel_gpu_top of bench_gpu_applet.py, the sampler service
+and the remote agents are talked to over local sockets.
+
+    python3 -m pytest test_gpu_applet.py
+"""
+
+import json                                            # noqa
+import math                                            # noqa
+import os                                              # noqa
+import socket                                          # noqa
+import struct                                          # noqa
+import sys                                             # noqa
+import threading                                       # noqa
+import time                                            # noqa
+
+import pytest                                          # noqa
+
+import mate_gpu_applet                                 # noqa
+from mate_gpu_applet import GLib                       # noqa
+from bench_gpu_applet import (FAKE_INTEL_GPU_TOP, FAKE_NVIDIA_SMI,  # noqa
+                              FAKE_RADEONTOP)
+
+
+def wait_for(func, timeout=5):
+    """Return the first true result of func, polled until timeout"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = func()
+        if result:
+            return result
+        time.sleep(0.02)
+    return func()
+
+
+@pytest.fixture(scope='module')
+def main_loop():
+    """Run the GLib main loop on a thread, like the panel does"""
+    loop = GLib.MainLoop()
+    thread = threading.Thread(target=loop.run, daemon=True)
+    thread.start()
+    yield loop
+    loop.quit()
+
+
+@pytest.fixture
+def fake_tool(tmp_path, monkeypatch):
+    """Install a fake executable first on PATH"""
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    def install(name, script, gpus=1):
+        path = tmp_path / name
+        path.write_text(script.format(python=sys.executable, gpus=gpus))
+        path.chmod(0o755)
+    return install
+
+
+def write_files(root, files):
+    """Create files under root from {relative path: content}"""
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def link_driver(sysfs, card, driver):
+    """Bind a fake DRM card to a driver"""
+    target = sysfs / 'bus' / 'pci' / 'drivers' / driver
+    target.mkdir(parents=True, exist_ok=True)
+    device = sysfs / 'class' / 'drm' / card / 'device'
+    device.mkdir(parents=True, exist_ok=True)
+    (device / 'driver').symlink_to(target)
+
+
+# Parsers
+
+def test_nvidia_smi_line():
+    sampler = mate_gpu_applet.NvidiaSmiSampler(
+        1000, ('gpu', 'temp', 'memory', 'power'))
+    values = {'index': '1', 'utilization.gpu': '45', 'temperature.gpu': '61',
+              'memory.used': '2048', 'memory.total': '8192',
+              'power.draw': '[N/A]',
+              'clocks_throttle_reasons.active': '0x0000000000000020',
+              'clocks.sm': '1400', 'clocks.max.sm': '1900'}
+    line = ', '.join(values[field] for field in sampler.fields)
+    assert sampler.handle_line(line)
+    sample, = sampler.latest()
+    assert sample['id'] == '1'
+    assert sample['usage'] == 45.0
+    assert sample['temp'] == 61.0
+    assert sample['memory'] == 25
+    assert sample['power'] is None
+    assert sample['throttle'] == 0x20
+    assert sample['sm_clock'] == 1400.0
+    assert sample['max_sm_clock'] == 1900.0
+
+
+def test_nvidia_smi_bad_lines():
+    sampler = mate_gpu_applet.NvidiaSmiSampler(1000)
+    assert not sampler.handle_line("Failed to initialize NVML")
+    fields = ['[N/A]' if field != 'index' else '0'
+              for field in sampler.fields]
+    assert not sampler.handle_line(', '.join(fields))
+    assert sampler.latest() is None
+
+
+def test_radeontop_line():
+    line = ("1700000000.000000: bus 03, gpu 12.50%, ee 0.00%, "
+            "vram 20.00% 800.00mb, gtt 1.00% 40.00mb, "
+            "mclk 50.00% 0.500ghz, sclk 40.00% 0.800ghz")
+    sample = mate_gpu_applet.RadeontopSampler.parse_line(
+        line, ('gpu', 'temp', 'memory', 'gtt', 'sm_clock'))
+    assert sample['usage'] == 12.5
+    assert sample['memory'] == 20.0
+    assert sample['gtt'] == 1.0
+    assert sample['sm_clock'] == 800
+    assert 'mem_clock' not in sample
+    # radeontop has no temperature
+    assert sample['temp'] is None
+    assert mate_gpu_applet.RadeontopSampler.parse_line(
+        "Dumping to -", mate_gpu_applet.CORE_METRICS) is None
+
+
+def test_intel_gpu_top_reports():
+    report = {
+        'frequency': {'requested': 1200.0, 'actual': 1100.0},
+        'power': {'GPU': 4.5, 'Package': 12.0},
+        'engines': {'Render/3D/0': {'busy': 30.0},
+                    'Compute/0': {'busy': 55.0},
+                    'Video/0': {'busy': 12.5}},
+    }
+    text = '[\n' + json.dumps(report, indent='\t') + ',\n' + \
+        json.dumps(report, indent='\t')
+    parser = mate_gpu_applet.JSONStreamParser()
+    reports = []
+    for line in text.splitlines(keepends=True):
+        reports += parser.feed(line)
+    assert reports == [report, report]
+
+    sample = mate_gpu_applet.IntelGpuTopSampler.parse_report(
+        report, ('gpu', 'temp', 'memory', 'power', 'sm_clock', 'decoder'))
+    assert sample['usage'] == 55.0
+    assert sample['power'] == 4.5
+    assert sample['sm_clock'] == 1100.0
+    assert sample['decoder'] == 12.5
+    assert 'encoder' not in sample
+    # Not measured by intel_gpu_top
+    assert sample['temp'] is None
+    assert sample['memory'] is None
+    assert mate_gpu_applet.IntelGpuTopSampler.parse_report(
+        {'engines': {'Video/0': {'busy': 1.0}}},
+        mate_gpu_applet.CORE_METRICS) is None
+
+
+# Streaming backends against fake tools
+
+@pytest.mark.parametrize('name, script, cls', [
+    ('nvidia-smi', FAKE_NVIDIA_SMI, mate_gpu_applet.NvidiaSmiBackend),
+    ('radeontop', FAKE_RADEONTOP, mate_gpu_applet.RadeontopBackend),
+    ('intel_gpu_top', FAKE_INTEL_GPU_TOP,
+     mate_gpu_applet.IntelGpuTopBackend),
+])
+def test_streaming_backend(main_loop, fake_tool, name, script, cls):
+    fake_tool(name, script, gpus=2)
+    backend = cls(100)
+    assert backend.probe()
+    mate_gpu_applet.call_on_main(backend.start)
+    try:
+        assert wait_for(lambda: backend.sampler.process is not None)
+        first = wait_for(backend.sample)
+        assert first
+        # Every GPU nvidia-smi lists, the first one of the others
+        assert [device['id'] for device in first] == (
+            ['0', '1'] if name == 'nvidia-smi' else ['0'])
+        for device in first:
+            assert 0 <= device['usage'] <= 100
+        # The child keeps reporting newer samples
+        assert wait_for(lambda: (backend.sample() or first)[0]['time'] >
+                        first[0]['time'])
+    finally:
+        mate_gpu_applet.call_on_main(backend.stop)
+        wait_for(lambda: backend.sampler.process is None)
+
+
+def test_missing_tool(fake_tool):
+    fake_tool('nvidia-smi', "#!/bin/sh\nexit 9\n")
+    assert not mate_gpu_applet.NvidiaSmiBackend(100).probe()
+
+
+# Sysfs backends against fake trees
+
+def test_amd_sysfs(tmp_path):
+    sysfs = tmp_path / 'sys'
+    card0 = 'class/drm/card0/device/'
+    card1 = 'class/drm/card1/device/'
+    write_files(sysfs, {
+        card0 + 'gpu_busy_percent': "37\n",
+        card0 + 'mem_info_vram_used': "1073741824\n",
+        card0 + 'mem_info_vram_total': "4294967296\n",
+        card0 + 'hwmon/hwmon2/temp1_input': "54000\n",
+        card0 + 'hwmon/hwmon2/power1_average': "45500000\n",
+        card1 + 'gpu_busy_percent': "3\n",
+        card1 + 'mem_info_vram_used': "0\n",
+        card1 + 'mem_info_vram_total': "1024\n",
+        'class/drm/card0-DP-1/status': "connected\n",
+    })
+    backend = mate_gpu_applet.AmdSysfsBackend(
+        1000, sysfs_root=str(sysfs), metrics=('gpu', 'temp', 'memory',
+                                              'power'))
+    assert backend.probe()
+    try:
+        devices = backend.sample()
+        assert [device['id'] for device in devices] == ['0', '1']
+        assert devices[0]['usage'] == 37.0
+        assert devices[0]['memory'] == 25
+        assert devices[0]['temp'] == 54.0
+        assert devices[0]['power'] == 45.5
+        # No hwmon: no temperature rather than 0°C
+        assert devices[1]['temp'] is None
+        assert 'power' not in devices[1]
+
+        # The files stay open and are read again
+        write_files(sysfs, {card0 + 'gpu_busy_percent': "81\n"})
+        assert backend.sample()[0]['usage'] == 81.0
+    finally:
+        backend.stop()
+    assert backend.fds == {}
+
+
+def test_amd_sysfs_missing(tmp_path):
+    (tmp_path / 'class' / 'drm').mkdir(parents=True)
+    assert not mate_gpu_applet.AmdSysfsBackend(
+        1000, sysfs_root=str(tmp_path)).probe()
+
+
+def test_intel_sysfs(tmp_path):
+    sysfs = tmp_path / 'sys'
+    write_files(sysfs, {
+        'class/drm/card0/power/rc6_residency_ms': "1000\n",
+        'class/drm/card0/gt_act_freq_mhz': "350\n",
+        'class/drm/card1/power/rc6_residency_ms': "0\n",
+        'class/drm/card1/gt_act_freq_mhz': "0\n",
+    })
+    link_driver(sysfs, 'card0', 'i915')
+    link_driver(sysfs, 'card1', 'amdgpu')
+    backend = mate_gpu_applet.IntelSysfsBackend(
+        1000, sysfs_root=str(sysfs), metrics=('gpu', 'sm_clock'))
+    assert backend.probe()
+    try:
+        device, = backend.sample()
+        assert device['id'] == '0'
+        assert device['sm_clock'] == 350.0
+        assert device['temp'] is None
+        assert device['memory'] is None
+
+        # Never idle since the previous sample
+        time.sleep(0.05)
+        device, = backend.sample()
+        assert device['usage'] == 100.0
+    finally:
+        backend.stop()
+
+
+def test_amdgpu_processes(tmp_path):
+    sysfs = tmp_path / 'sys'
+    proc = tmp_path / 'proc'
+    (sysfs / 'devices' / '0000:03:00.0').mkdir(parents=True)
+    (sysfs / 'class' / 'drm' / 'card1').mkdir(parents=True)
+    (sysfs / 'class' / 'drm' / 'card1' / 'device').symlink_to(
+        sysfs / 'devices' / '0000:03:00.0')
+    write_files(proc, {
+        '100/comm': "game\n",
+        '100/fdinfo/3': ("drm-driver:\tamdgpu\ndrm-client-id:\t7\n"
+                         "drm-pdev:\t0000:03:00.0\n"
+                         "drm-memory-vram:\t204800 KiB\n"
+                         "drm-engine-gfx:\t1000 ns\n"),
+    })
+    (proc / '100' / 'fd').mkdir()
+    (proc / '100' / 'fd' / '3').symlink_to('/dev/dri/renderD128')
+
+    monitor = mate_gpu_applet.ProcessMonitor(
+        3600, lambda processes: None, sysfs_root=str(sysfs),
+        proc_root=str(proc))
+    monitor.stop()
+    # Not bound to amdgpu, /proc is not searched
+    assert monitor.scan_amdgpu() == []
+
+    link_driver(sysfs, 'card1', 'amdgpu')
+    process, = monitor.scan_amdgpu()
+    assert process['pid'] == 100
+    assert process['name'] == 'game'
+    assert process['gpu'] == '1'
+    assert process['memory_mib'] == 200.0
+
+
+# History
+
+def test_time_series_window():
+    series = mate_gpu_applet.TimeSeries(3, ('time', 'usage'))
+    for i, value in enumerate([5, None, 9, 1, 7]):
+        series.append({'time': i, 'usage': value})
+    assert len(series) == 3
+    assert list(series.values('usage')) == [9.0, 1.0, 7.0]
+    assert series.min('usage') == 1.0
+    assert series.max('usage') == 9.0
+    assert series.mean('usage') == pytest.approx(17 / 3)
+    assert series.last('usage') == 7.0
+
+    series.append({'time': 5})
+    assert series.last('usage') is None
+    assert series.max('usage') == 7.0
+    assert series.filled('usage') == [1.0, 7.0, 7.0]
+
+    series.pad(3)
+    assert not series.has_data('usage')
+    assert series.min('usage') is None
+
+
+def test_time_series_decimated():
+    series = mate_gpu_applet.TimeSeries(1000, ('usage',))
+    for i in range(1000):
+        series.append({'usage': 100 if i == 500 else i % 10})
+    points = series.decimated('usage', 50)
+    assert len(points) == 50
+    assert points[0] == (0, 0.0)
+    assert points[-1] == (999, 9.0)
+    # A lone spike survives
+    assert (500, 100.0) in points
+    assert series.decimated('usage', 50) is points
+
+
+def test_tiered_history_buckets():
+    history = mate_gpu_applet.TieredHistory({'gpu': 'usage'})
+    start = 1000000
+    for offset, usage, peak in ((0, 10, None), (4, 30, 90), (8, 20, None),
+                                (10, 50, None)):
+        history.append(start + offset, {'gpu': usage, 'gpu_peak': peak})
+    assert len(history.raw) == 4
+
+    # The bucket of the first 10 s closed with the first sample after it
+    tier = history.tiers['10s']
+    assert len(tier) == 1
+    assert tier.last('time') == start
+    assert tier.last('gpu_min') == 10.0
+    assert tier.last('gpu') == 20.0
+    assert tier.last('gpu_max') == 90.0
+    # The minute is still open
+    assert len(history.tiers['1m']) == 0
+
+
+def test_history_store(tmp_path):
+    path = str(tmp_path / 'history.bin')
+    history = mate_gpu_applet.TieredHistory(mate_gpu_applet.METRIC_FIELDS)
+    raw = history.raw
+    long_key = 'render-node-with-a-long-name.example.com:1'
+
+    store = mate_gpu_applet.HistoryStore(path, keys=1)
+    capacity = store.capacities[0]
+    for i in range(capacity + 5):
+        store.write('0', 'raw', raw, {'time': i, 'gpu': i % 100})
+    store.write(long_key, 'raw', raw, {'time': capacity + 5, 'temp': 60})
+    # A second writer would overwrite the rows
+    with pytest.raises(OSError):
+        mate_gpu_applet.HistoryStore(path, keys=1)
+    store.close()
+
+    store = mate_gpu_applet.HistoryStore(path, keys=1)
+    rows = store.read('raw')
+    store.close()
+    assert len(rows) == capacity
+    # The oldest rows were overwritten by the ring
+    assert rows[0][0] == 6
+    timestamp, key, values = rows[-1]
+    assert (timestamp, key) == (capacity + 5, long_key)
+    columns = raw.columns[1:]
+    assert values[columns.index('temp')] == 60.0
+    assert math.isnan(values[columns.index('gpu')])
+
+
+def test_history_store_format_change(tmp_path):
+    path = str(tmp_path / 'history.bin')
+    raw = mate_gpu_applet.TieredHistory(mate_gpu_applet.METRIC_FIELDS).raw
+    store = mate_gpu_applet.HistoryStore(path, keys=1)
+    store.write('0', 'raw', raw, {'time': 1, 'gpu': 5})
+    store.close()
+    with open(path, 'r+b') as f:
+        f.seek(8)
+        f.write(struct.pack('<I', mate_gpu_applet.HistoryStore.VERSION + 1))
+    store = mate_gpu_applet.HistoryStore(path, keys=1)
+    assert store.read('raw') == []
+    store.close()
+
+
+def test_session_recording(tmp_path):
+    path = str(tmp_path / 'recordings' / 'session.bin')
+    recorder = mate_gpu_applet.SessionRecorder(path)
+    recorder.write(10.0, [{'id': 'render1:0', 'usage': 12.0, 'temp': None},
+                          {'id': '1', 'usage': 80.0, 'memory': 40}])
+    recorder.write(12.0, [])
+    recorder.close()
+    (first, devices), (second, empty) = \
+        mate_gpu_applet.SessionRecorder.read(path)
+    assert (first, second, empty) == (10.0, 12.0, [])
+    assert devices[0]['id'] == 'render1:0'
+    assert devices[0]['usage'] == 12.0
+    assert devices[0]['temp'] is None
+    assert devices[1]['memory'] == 40.0
+
+    with open(path, 'r+b') as f:
+        f.seek(8)
+        f.write(struct.pack('<I', 2))
+    with pytest.raises(ValueError):
+        list(mate_gpu_applet.SessionRecorder.read(path))
+
+
+# Throttling
+
+def test_throttle_events():
+    detector = mate_gpu_applet.ThrottleDetector()
+    thermal = 0x40
+
+    def feed(timestamp, bits, clock=1800):
+        return detector.update([{'id': '0', 'throttle': bits,
+                                 'sm_clock': clock,
+                                 'max_sm_clock': 1900}], timestamp)
+
+    assert feed(1, 0) == []
+    # A single sample does not start an event
+    assert feed(2, thermal, 1500) == []
+    assert feed(3, 0) == []
+    assert feed(4, thermal, 1400) == []
+    event, = feed(5, thermal, 1200)
+    assert event['reason'] == 'thermal'
+    assert event['start'] == 4
+    assert event['end'] is None
+    assert detector.reasons() == ['thermal']
+    assert detector.reasons(['1']) == []
+
+    # Nor does a single sample end it
+    assert feed(6, 0) == []
+    assert feed(7, thermal, 1300) == []
+    assert feed(8, 0) == []
+    assert feed(9, 0) == []
+    ended, = feed(10, 0)
+    assert ended is event
+    assert event['end'] == 7
+    assert event['clock'] == 1200
+    assert event['clock_max'] == 1900
+    assert detector.reasons() == []
+    assert detector.events(0, 3) == []
+    assert detector.events(6, 20) == [event]
+
+
+# Sampler service and remote agents
+
+def fake_devices():
+    return [{'id': '0', 'usage': 42.0, 'temp': 50.0, 'memory': 10}]
+
+
+def start_service(service):
+    service.backends.sample = fake_devices
+    assert service.listen()
+    service.update_interval()
+
+
+def stop_service(service):
+    service.worker.stop()
+    GLib.source_remove(service.timer_id)
+    service.close()
+
+
+def send(sock, message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def test_sampler_service(main_loop, tmp_path):
+    path = str(tmp_path / 'sampler.sock')
+    service = mate_gpu_applet.SamplerService(path, 100)
+    start_service(service)
+    assert not mate_gpu_applet.SamplerService(path, 100).listen()
+    try:
+        subscriber = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        subscriber.settimeout(5)
+        subscriber.connect(path)
+        reader = subscriber.makefile('rb')
+        send(subscriber, {'interval_ms': 100, 'backend_ms': 100,
+                          'metrics': ['gpu', 'power', 'unknown']})
+        message = json.loads(reader.readline())
+        assert message['devices'] == fake_devices()
+        # The subscriber's metrics and the core ones
+        assert wait_for(lambda: service.backends.metrics ==
+                        ('gpu', 'temp', 'memory', 'power'))
+
+        poller = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        poller.settimeout(5)
+        poller.connect(path)
+        send(poller, {'poll': True})
+        with poller.makefile('rb') as poll_reader:
+            assert json.loads(poll_reader.readline())['devices'] == \
+                fake_devices()
+        # Polls ask for no particular metrics, so for all of them
+        assert wait_for(lambda: service.backends.metrics ==
+                        tuple(mate_gpu_applet.METRICS))
+        poller.close()
+        assert wait_for(lambda: len(service.backends.metrics) == 4)
+
+        reader.close()
+        subscriber.close()
+        assert wait_for(lambda: not service.clients)
+    finally:
+        stop_service(service)
+    assert not os.path.exists(path)
+
+
+def test_remote_agents(main_loop):
+    agent = mate_gpu_applet.RemoteAgent(('127.0.0.1', 0), 100)
+    start_service(agent)
+    # Accepts connections but never answers
+    hung = socket.create_server(('127.0.0.1', 0))
+    addresses = ['127.0.0.1:%d' % agent.server.getsockname()[1],
+                 '127.0.0.1:%d' % hung.getsockname()[1]]
+    poller = mate_gpu_applet.RemotePoller(addresses, 100, 0.5,
+                                          metrics=('gpu',))
+    try:
+        devices = wait_for(poller.latest)
+        assert [device['id'] for device in devices] == ['127.0.0.1:0']
+        assert devices[0]['usage'] == 42.0
+        assert agent.backends.metrics == mate_gpu_applet.CORE_METRICS
+
+        answering, silent = poller.hosts
+        assert wait_for(lambda: silent.describe().endswith("timed out"))
+        # The hung host never delays the other one
+        assert answering.latency < 0.5
+        assert answering.describe().startswith("127.0.0.1: ")
+    finally:
+        poller.stop()
+        hung.close()
+        stop_service(agent)
+
+
+def test_parse_host_port():
+    parse = mate_gpu_applet.parse_host_port
+    assert parse('render1', 9840) == ('render1', 9840)
+    assert parse(' render2:9841 ', 9840) == ('render2', 9841)
+    assert parse('[::1]:9841', 9840) == ('::1', 9841)
+    assert parse('::1', 9840) == ('::1', 9840)